@@ -1,10 +1,23 @@
 import os
-import json
-from flask import Flask, request, jsonify
+import gzip
+import hashlib
+from collections import OrderedDict
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from cache import ResponseCache, start_version_poller, warm
+from formats import ARROW_MIMETYPE, MSGPACK_MIMETYPE, UnsupportedFormat, encode, records_from_rows, requested_format
+from jobs import JobQueue, load_predictor
+from history import BadRequest, HISTORY_CACHE_ROWS, history_chunks, history_page, history_query, parse_date
+from news import news_query
+from screen import screen_query
+
+try:
+    import brotli
+except ImportError:  # fall back to gzip only
+    brotli = None
 
 load_dotenv(override=True)
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -16,22 +29,130 @@ Session = sessionmaker(bind=engine)
 
 app = Flask(__name__)
 CORS(app)
+response_cache = ResponseCache()
+predict_jobs = JobQueue(engine, load_predictor())
+
+# ─── Conditional GET and compression ──────────────────────────────────────────
+# Responses of the data endpoints only change when ingestion bumps
+# data_version, so their ETag is derived from the version and the request
+# alone: a matching If-None-Match is answered with 304 before the view (and
+# its query) runs. Bodies above COMPRESS_MIN_BYTES are then compressed with
+# brotli or gzip, whichever the client prefers.
+
+VERSIONED_ENDPOINTS = {"history", "current", "growth", "screen", "news"}
+COMPRESSIBLE_MIMETYPES = {"application/json", ARROW_MIMETYPE, MSGPACK_MIMETYPE}
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+ENCODING_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+_compressed = OrderedDict()  # (etag, encoding) -> body, so cache hits are not recompressed
+_COMPRESSED_ENTRIES = 256
+
+def data_etag():
+    """Strong ETag for the current request at the current data version, or None."""
+    if response_cache.version is None or request.endpoint not in VERSIONED_ENDPOINTS:
+        return None
+    try:
+        fmt = requested_format()
+    except UnsupportedFormat:
+        return None
+    identity = repr((request.path, sorted(request.args.items(multi=True)), fmt))
+    return f"v{response_cache.version}-{hashlib.sha1(identity.encode()).hexdigest()[:16]}"
+
+def preferred_encoding():
+    if brotli is not None and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def compress(body, encoding, etag):
+    key = (etag, encoding)
+    if etag and key in _compressed:
+        _compressed.move_to_end(key)
+        return _compressed[key]
+    data = brotli.compress(body, quality=5) if encoding == "br" else gzip.compress(body, compresslevel=6)
+    if etag:
+        _compressed[key] = data
+        if len(_compressed) > _COMPRESSED_ENTRIES:
+            _compressed.popitem(last=False)
+    return data
+
+@app.before_request
+def not_modified():
+    etag = data_etag()
+    if etag is None:
+        return None
+    # Compressed representations carry a suffixed ETag; any of them matches
+    if any(request.if_none_match.contains(etag + s) for s in ("", *ENCODING_SUFFIXES.values())):
+        response = app.response_class(status=304)
+    elif (not request.if_none_match and request.if_modified_since and response_cache.updated_at
+          and response_cache.updated_at.replace(microsecond=0) <= request.if_modified_since):
+        response = app.response_class(status=304)
+    else:
+        return None
+    response.set_etag(etag)
+    return response
+
+@app.after_request
+def add_validators_and_compress(response):
+    etag = data_etag()
+    if etag and response.status_code == 200:
+        response.headers["Cache-Control"] = "no-cache"
+        if response_cache.updated_at:
+            response.last_modified = response_cache.updated_at
+        response.vary.add("Accept")
+    if etag and response.status_code in (200, 304):
+        response.set_etag(etag)
+
+    if (response.status_code != 200 or response.is_streamed or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = preferred_encoding()
+    body = response.get_data()
+    if encoding is None or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(body, encoding, etag))
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        response.set_etag(etag + ENCODING_SUFFIXES[encoding])
+    return response
+
+@app.errorhandler(BadRequest)
+def bad_request(e):
+    return jsonify({"error": str(e)}), 400
+
+@app.errorhandler(UnsupportedFormat)
+def unsupported_format(e):
+    return jsonify({"error": str(e)}), 406
+
+# /api/history, /api/current, /api/growth, /api/screen and /api/news negotiate their format (see
+# formats.py): the default is the original list-of-objects JSON, and
+# format=columns|arrow|msgpack (or orient=columns, or an Accept header)
+# returns the same rows column-wise, built straight from the cursor.
 
 @app.get("/api/history")
+@response_cache.cached
 def history():
-    session = Session()
-    try:
-        result = session.execute(text(
-            "SELECT ticker, allocation_date, market_cap_usd, allocation_pct "
-            "FROM allocations ORDER BY allocation_date DESC LIMIT 100"
-        ))
-        records = [dict(r) for r in result]
-    finally:
-        session.close()
-    return jsonify(records)
+    """
+    Allocation history, newest first, paged by keyset cursor.
+    Query args: ticker (comma-separated), from, to, limit, cursor (the
+    next_cursor of the previous page). Small pages are cached; larger
+    records-format pages are streamed as chunked JSON.
+    """
+    fmt = requested_format()
+    sql, params, limit = history_query(request.args)
+    if fmt != "records":
+        names, rows, next_cursor = history_page(engine, sql, params, limit)
+        return encode(fmt, names, rows, {"next_cursor": next_cursor}, key="data")
+    chunks = history_chunks(engine, sql, params, limit)
+    if limit <= HISTORY_CACHE_ROWS:
+        return "".join(chunks).encode()
+    return Response(stream_with_context(chunks), mimetype="application/json")
 
 @app.get("/api/current")
+@response_cache.cached
 def current():
+    fmt = requested_format()
     session = Session()
     try:
         latest_date = session.execute(text("SELECT MAX(allocation_date) FROM allocations")).scalar()
@@ -42,47 +163,103 @@ def current():
                 text("SELECT ticker, market_cap_usd, allocation_pct FROM allocations WHERE allocation_date = :d"),
                 {"d": latest_date}
             )
+            names, rows = list(result.keys()), result.fetchall()
+            if fmt != "records":
+                return encode(fmt, names, rows, {"date": str(latest_date)}, key="allocations")
             data = {
                 "date": str(latest_date),
-                "allocations": [dict(r) for r in result]
+                "allocations": records_from_rows(names, rows)
             }
     finally:
         session.close()
-    return jsonify(data)
+    return data
 
 @app.get("/api/growth")
+@response_cache.cached
 def growth():
+    fmt = requested_format()
     session = Session()
     try:
+        # allocation_totals is kept up to date by the market-cap fetcher, so
+        # this is a range scan of its primary key rather than a GROUP BY
         result = session.execute(text(
-            "SELECT allocation_date, SUM(market_cap_usd) AS total_market_cap "
-            "FROM allocations GROUP BY allocation_date ORDER BY allocation_date"
-        ))
-        records = [{"allocation_date": r[0].isoformat(), "total_market_cap": int(r[1])} for r in result]
+            "SELECT allocation_date, total_market_cap, constituent_count "
+            "FROM allocation_totals "
+            "WHERE allocation_date BETWEEN COALESCE(:start, '-infinity'::date) "
+            "AND COALESCE(:end, 'infinity'::date) "
+            "ORDER BY allocation_date"
+        ), {"start": parse_date(request.args.get("from"), "from"), "end": parse_date(request.args.get("to"), "to")})
+        if fmt != "records":
+            return encode(fmt, list(result.keys()), result.fetchall())
+        records = [
+            {"allocation_date": r[0].isoformat(), "total_market_cap": int(r[1]), "constituent_count": r[2]}
+            for r in result
+        ]
     finally:
         session.close()
-    return jsonify(records)
+    return records
+
+@app.get("/api/screen")
+@response_cache.cached
+def screen():
+    """
+    Stock screen over the latest key metrics and profile of every ticker,
+    e.g. /api/screen?sector=Technology&max_pe_ratio=15. See screen.py for
+    the filters.
+    """
+    fmt = requested_format()
+    sql, params = screen_query(request.args)
+    with engine.connect() as conn:
+        result = conn.execute(text(sql), params)
+        names, rows = list(result.keys()), result.fetchall()
+    if fmt != "records":
+        return encode(fmt, names, rows)
+    return records_from_rows(names, rows)
+
+@app.get("/api/news")
+@response_cache.cached
+def news():
+    """
+    Recent or keyword-ranked articles from stock_news, e.g.
+    /api/news?symbol=AAPL,MSFT&q=guidance&since=2025-01-01&limit=5. See
+    news.py for the ranking.
+    """
+    fmt = requested_format()
+    sql, params = news_query(request.args)
+    with engine.connect() as conn:
+        result = conn.execute(text(sql), params)
+        names, rows = list(result.keys()), result.fetchall()
+    if fmt != "records":
+        return encode(fmt, names, rows)
+    return records_from_rows(names, rows)
 
 @app.post("/api/predict")
 def predict():
+    """Queues a forecast and returns its job id; poll GET /api/predict/<id>."""
     payload = request.get_json(silent=True) or {}
-    result = {"prediction": "LLM forecast placeholder"}
-    session = Session()
-    try:
-        session.execute(
-            text(
-                "INSERT INTO predictions (request_data, response_data) "
-                "VALUES (:req, :res)"
-            ),
-            {
-                "req": json.dumps(payload),
-                "res": json.dumps(result),
-            },
-        )
-        session.commit()
-    finally:
-        session.close()
-    return jsonify({**result, "input": payload})
+    job_id = predict_jobs.submit(payload)
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.status_code = 202
+    response.headers["Location"] = f"/api/predict/{job_id}"
+    return response
+
+@app.get("/api/predict/<job_id>")
+def predict_status(job_id):
+    job = predict_jobs.status(job_id)
+    if job is None:
+        return jsonify({"error": f"unknown job {job_id}"}), 404
+    return jsonify(job)
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.get("/api/predict/stats")
+def predict_stats():
+    return jsonify(predict_jobs.stats())
+
+warm(app, response_cache, engine, ["/api/current", "/api/growth", "/api/history"])
+start_version_poller(response_cache, engine)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
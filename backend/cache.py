@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from dotenv import load_dotenv
+from flask import Response, current_app, request
+from sqlalchemy import text
+from formats import UnsupportedFormat, requested_format
+
+load_dotenv(override=True)
+
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+DATA_VERSION_POLL_SECONDS = float(os.getenv("DATA_VERSION_POLL_SECONDS", "5"))
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of serialized JSON response bodies.
+    Entries belong to the current data_version; when ingestion bumps the
+    version the whole cache is dropped, so a cached body is never older than
+    the last poll of data_version. Size is bounded by total body bytes.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.version = None
+        self.updated_at = None
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def set_version(self, version, updated_at=None):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.size = 0
+                self.version = version
+            self.updated_at = updated_at
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, version):
+        """
+        Stores a body computed under `version`. Bodies computed before a
+        version change are dropped rather than cached as current.
+        """
+        with self.lock:
+            if version is None or version != self.version or len(body) > self.max_bytes:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self.entries[key] = (body, mimetype)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "version": self.version,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def cached(self, view):
+        """
+        Decorator for GET views. A view may return JSON-serializable data, an
+        already-serialized JSON body (bytes) or a complete Response; the body
+        is served from the cache when present, keyed on path, query string and
+        negotiated format. Streamed and non-200 responses pass through uncached.
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                fmt = requested_format()
+            except UnsupportedFormat:
+                fmt = None  # the view raises it again and gets its error response
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), fmt)
+            entry = self.get(key)
+            if entry is None:
+                version = self.version
+                result = view(*args, **kwargs)
+                if isinstance(result, tuple):
+                    return result
+                if isinstance(result, Response):
+                    if result.is_streamed or result.status_code != 200:
+                        return result
+                    entry = (result.get_data(), result.mimetype)
+                elif isinstance(result, bytes):
+                    entry = (result, "application/json")
+                else:
+                    entry = (current_app.json.dumps(result).encode(), "application/json")
+                self.put(key, *entry, version)
+            body, mimetype = entry
+            return current_app.response_class(body, mimetype=mimetype)
+        return wrapper
+
+
+def read_data_version(engine):
+    """
+    Returns (version, updated_at) from data_version, or (None, None) if it
+    cannot be read. updated_at is timezone-aware.
+    """
+    try:
+        with engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT version, updated_at AT TIME ZONE current_setting('TimeZone') FROM data_version"
+            )).first()
+            return tuple(row) if row else (None, None)
+    except Exception:
+        return None, None
+
+
+def start_version_poller(cache, engine, interval=DATA_VERSION_POLL_SECONDS):
+    """
+    Polls data_version on a daemon thread so requests never query it
+    themselves; a changed version invalidates the cache.
+    """
+    def poll():
+        while True:
+            time.sleep(interval)
+            cache.set_version(*read_data_version(engine))
+
+    threading.Thread(target=poll, name="data-version-poller", daemon=True).start()
+
+
+def warm(app, cache, engine, paths):
+    """Reads the current data_version and pre-computes the given GET paths."""
+    cache.set_version(*read_data_version(engine))
+    if cache.version is None:
+        print("⚠️ Could not read data_version (run init_db.py); response caching is off.")
+        return
+    client = app.test_client()
+    for path in paths:
+        response = client.get(path)
+        if response.status_code != 200:
+            print(f"⚠️ Cache warm-up of {path} returned {response.status_code}")
@@ -0,0 +1,117 @@
+import io
+import json
+from datetime import date
+from decimal import Decimal
+from flask import Response, request
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # Arrow responses are optional
+    pa = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack responses are optional
+    msgpack = None
+
+JSON_MIMETYPE = "application/json"
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+MSGPACK_MIMETYPE = "application/msgpack"
+
+# format query arg -> response format; "records" is the original list-of-objects JSON
+FORMAT_ALIASES = {
+    "json": "records",
+    "records": "records",
+    "columns": "columns",
+    "arrow": "arrow",
+    "msgpack": "msgpack",
+}
+MIMETYPE_FORMATS = {
+    JSON_MIMETYPE: "records",
+    ARROW_MIMETYPE: "arrow",
+    MSGPACK_MIMETYPE: "msgpack",
+}
+
+
+class UnsupportedFormat(ValueError):
+    """Raised when a client asks for a format this server cannot produce."""
+
+
+def requested_format() -> str:
+    """
+    Negotiates the response format for the current request.
+    An explicit `format` arg wins, then `orient=columns`, then the Accept
+    header; anything else gets the original records JSON.
+    """
+    name = request.args.get("format")
+    if name is None and request.args.get("orient"):
+        name = request.args["orient"]
+    if name is None:
+        best = request.accept_mimetypes.best_match(list(MIMETYPE_FORMATS), default=JSON_MIMETYPE)
+        name = MIMETYPE_FORMATS[best]
+    fmt = FORMAT_ALIASES.get(name)
+    if fmt is None:
+        raise UnsupportedFormat(f"unknown format {name!r}; use one of {', '.join(FORMAT_ALIASES)}")
+    if fmt == "arrow" and pa is None:
+        raise UnsupportedFormat("Arrow responses need pyarrow installed on the server")
+    if fmt == "msgpack" and msgpack is None:
+        raise UnsupportedFormat("MessagePack responses need msgpack installed on the server")
+    return fmt
+
+
+def _plain(column):
+    """Converts a column of dates/Decimals to ISO strings/floats in one pass."""
+    sample = next((v for v in column if v is not None), None)
+    if isinstance(sample, date):
+        return [v.isoformat() if v is not None else None for v in column]
+    if isinstance(sample, Decimal):
+        return [float(v) if v is not None else None for v in column]
+    return list(column)
+
+
+def columns_from_rows(names, rows):
+    """Transposes cursor rows into {name: [values]} without building per-row dicts."""
+    columns = zip(*rows) if rows else [()] * len(names)
+    return dict(zip(names, columns))
+
+
+def records_from_rows(names, rows):
+    """Cursor rows as the records format's list of objects, with JSON-ready values."""
+    columns = [_plain(column) for column in zip(*rows)] if rows else []
+    return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+def encode(fmt, names, rows, envelope=None, key=None):
+    """
+    Builds a columnar response from cursor rows.
+    Args:
+        fmt: "columns", "arrow" or "msgpack".
+        names: Column names, in cursor order.
+        rows: Sequence of row tuples.
+        envelope: Extra top-level fields (e.g. date, next_cursor). For Arrow
+            they are stored as JSON in the schema metadata.
+        key: If given, the columns are nested under this field of the
+            envelope rather than returned at the top level.
+    """
+    columns = columns_from_rows(names, rows)
+    envelope = envelope or {}
+
+    if fmt == "arrow":
+        arrays = []
+        for column in columns.values():
+            sample = next((v for v in column if v is not None), None)
+            arrays.append(pa.array(_plain(column) if isinstance(sample, Decimal) else list(column)))
+        table = pa.Table.from_arrays(arrays, names=list(names)).replace_schema_metadata(
+            {k: json.dumps(v) for k, v in envelope.items()}
+        )
+        sink = io.BytesIO()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return Response(sink.getvalue(), mimetype=ARROW_MIMETYPE)
+
+    plain = {name: _plain(column) for name, column in columns.items()}
+    payload = {**envelope, key: plain} if key else {**envelope, **plain}
+    if fmt == "msgpack":
+        return Response(msgpack.packb(payload), mimetype=MSGPACK_MIMETYPE)
+    return Response(json.dumps(payload, separators=(",", ":")), mimetype=JSON_MIMETYPE)
@@ -0,0 +1,121 @@
+import json
+import os
+from datetime import date
+from sqlalchemy import text
+
+HISTORY_DEFAULT_LIMIT = 100
+HISTORY_MAX_LIMIT = int(os.getenv("HISTORY_MAX_LIMIT", "1000000"))
+# Pages up to this size are built in memory (and cached); larger ones stream
+HISTORY_CACHE_ROWS = int(os.getenv("HISTORY_CACHE_ROWS", "1000"))
+HISTORY_CHUNK_ROWS = 2000
+
+
+class BadRequest(ValueError):
+    """Raised for invalid query parameters (answered with 400)."""
+
+
+def parse_cursor(cursor: str):
+    """Parses a `<allocation_date>,<ticker>` cursor as returned in next_cursor."""
+    try:
+        day, ticker = cursor.split(",", 1)
+        return date.fromisoformat(day), ticker
+    except ValueError:
+        raise BadRequest(f"invalid cursor {cursor!r}")
+
+
+def parse_date(value, name):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        raise BadRequest(f"{name} must be YYYY-MM-DD")
+
+
+def history_query(args):
+    """
+    Builds the keyset-paginated allocations query from request args.
+    Rows are ordered by (allocation_date, ticker) descending, so a page
+    resumes strictly after the cursor row using the (allocation_date, ticker)
+    index, or the primary key when filtering by ticker.
+    Args:
+        args: Request args with optional ticker (comma-separated), from, to,
+            limit and cursor.
+    Returns:
+        (sql, params, limit). The query fetches limit + 1 rows so the caller
+        can tell whether another page follows.
+    """
+    try:
+        limit = int(args.get("limit", HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+    if not 1 <= limit <= HISTORY_MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {HISTORY_MAX_LIMIT}")
+
+    conditions = []
+    params = {"limit": limit + 1}
+    if args.get("ticker"):
+        conditions.append("ticker = ANY(:tickers)")
+        params["tickers"] = [t.strip().upper() for t in args["ticker"].split(",") if t.strip()]
+    if args.get("from"):
+        conditions.append("allocation_date >= :start")
+        params["start"] = parse_date(args["from"], "from")
+    if args.get("to"):
+        conditions.append("allocation_date <= :end")
+        params["end"] = parse_date(args["to"], "to")
+    if args.get("cursor"):
+        conditions.append("(allocation_date, ticker) < (:cursor_date, :cursor_ticker)")
+        params["cursor_date"], params["cursor_ticker"] = parse_cursor(args["cursor"])
+
+    sql = "SELECT ticker, allocation_date, market_cap_usd, allocation_pct FROM allocations"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY allocation_date DESC, ticker DESC LIMIT :limit"
+    return sql, params, limit
+
+
+def cursor_for(row):
+    """The cursor that resumes after a (ticker, allocation_date, ...) row."""
+    return f"{row[1].isoformat()},{row[0]}"
+
+
+def history_page(engine, sql, params, limit):
+    """
+    Runs the history query and returns (column names, rows, next_cursor),
+    for the columnar formats that need the whole page at once.
+    """
+    with engine.connect() as conn:
+        result = conn.execute(text(sql), params)
+        names = list(result.keys())
+        rows = result.fetchall()
+    next_cursor = cursor_for(rows[limit - 1]) if len(rows) > limit else None
+    return names, rows[:limit], next_cursor
+
+
+def history_chunks(engine, sql, params, limit):
+    """
+    Yields a `{"data": [...], "next_cursor": ...}` JSON document in pieces,
+    reading rows through a server-side cursor HISTORY_CHUNK_ROWS at a time so
+    memory stays flat however many rows match.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(text(sql), params)
+        yield '{"data": ['
+        sent = 0
+        last = None
+        more = False
+        for rows in result.partitions(HISTORY_CHUNK_ROWS):
+            # The query asks for one extra row; if it arrives, another page follows
+            if sent + len(rows) > limit:
+                rows = rows[:limit - sent]
+                more = True
+            if rows:
+                yield ("," if sent else "") + ",".join(
+                    f'{{"ticker": {json.dumps(ticker)}, "allocation_date": "{day.isoformat()}", '
+                    f'"market_cap_usd": {market_cap}, "allocation_pct": {pct}}}'
+                    for ticker, day, market_cap, pct in rows
+                )
+                sent += len(rows)
+                last = rows[-1]
+            if more:
+                break
+        next_cursor = cursor_for(last) if more else None
+        yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
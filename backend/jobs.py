@@ -0,0 +1,207 @@
+import importlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv(override=True)
+# "module:attribute" of a factory returning the predictor; see placeholder_predictor
+PREDICTOR = os.getenv("PREDICTOR", "jobs:placeholder_predictor")
+PREDICT_WORKERS = int(os.getenv("PREDICT_WORKERS", "2"))
+PREDICT_BATCH_SIZE = int(os.getenv("PREDICT_BATCH_SIZE", "8"))
+PREDICT_WRITE_BATCH = int(os.getenv("PREDICT_WRITE_BATCH", "100"))
+PREDICT_WRITE_INTERVAL_MS = int(os.getenv("PREDICT_WRITE_INTERVAL_MS", "200"))
+# Attempts to write a batch of finished jobs before they are marked failed
+PREDICT_WRITE_RETRIES = int(os.getenv("PREDICT_WRITE_RETRIES", "3"))
+WRITE_RETRY_BASE_SECONDS = 0.5
+# Finished jobs kept in memory; older ones are answered from the predictions table
+PREDICT_JOBS_IN_MEMORY = int(os.getenv("PREDICT_JOBS_IN_MEMORY", "10000"))
+
+
+def placeholder_predictor():
+    """
+    The default predictor. A predictor is a callable that takes a list of
+    request payloads and returns one response dict per payload, so a model
+    can serve a whole batch in one call.
+    """
+    def predict(payloads):
+        return [{"prediction": "LLM forecast placeholder"} for _ in payloads]
+    return predict
+
+
+def load_predictor(spec=PREDICTOR):
+    """Imports and calls the predictor factory named by a "module:attribute" spec."""
+    module_name, attribute = spec.split(":")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+class JobQueue:
+    """
+    Runs /api/predict jobs in the background.
+    Submitted payloads wait in a queue; PREDICT_WORKERS threads take up to
+    PREDICT_BATCH_SIZE of them at a time and run the predictor on the batch.
+    Finished jobs go to a single writer thread that inserts them into
+    `predictions` in batches of up to PREDICT_WRITE_BATCH rows, flushing at
+    least every PREDICT_WRITE_INTERVAL_MS.
+
+    Done jobs stay in memory until they are written, so a finished job can
+    always be polled. Failed jobs (the predictor raised, or returned the
+    wrong number of results) are not written to `predictions`; they are
+    only held in memory, and once trimmed their ids return 404. A batch
+    whose insert still fails after PREDICT_WRITE_RETRIES attempts (with
+    exponential backoff) is failed too, with the database error.
+    """
+
+    def __init__(self, engine, predictor, workers=PREDICT_WORKERS, batch_size=PREDICT_BATCH_SIZE):
+        self.engine = engine
+        self.predictor = predictor
+        self.batch_size = batch_size
+        self.pending = queue.Queue()
+        self.finished = queue.Queue()
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.written = self.write_errors = 0
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"predict-worker-{i}", daemon=True).start()
+        threading.Thread(target=self._write, name="predict-writer", daemon=True).start()
+
+    def submit(self, payload) -> str:
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = {"status": "queued", "input": payload, "submitted_at": time.time()}
+        self.pending.put(job_id)
+        return job_id
+
+    def status(self, job_id):
+        """
+        Returns the job's status dict, falling back to the predictions table
+        for jobs no longer held in memory, or None if the id is unknown.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return {"job_id": job_id, **{k: v for k, v in job.items() if k not in ("submitted_at", "persisted")}}
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            return None
+        with self.engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT request_data, response_data FROM predictions WHERE job_id = :job_id"
+            ), {"job_id": job_id}).first()
+        if row is None:
+            return None
+        return {"job_id": job_id, "status": "done", "input": row[0], "result": row[1]}
+
+    def _work(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            with self.lock:
+                payloads = [self.jobs[job_id]["input"] for job_id in batch]
+                for job_id in batch:
+                    self.jobs[job_id]["status"] = "running"
+            try:
+                results = self.predictor(payloads)
+                error = None
+                if not isinstance(results, list) or len(results) != len(batch):
+                    count = len(results) if isinstance(results, list) else type(results).__name__
+                    error = f"predictor returned {count} results for {len(batch)} jobs"
+            except Exception as e:
+                error = str(e)
+            if error:
+                results = [None] * len(batch)
+            with self.lock:
+                for job_id, result in zip(batch, results):
+                    job = self.jobs[job_id]
+                    if error:
+                        job.update(status="failed", error=error)
+                    else:
+                        job.update(status="done", result=result)
+                        self.finished.put((job_id, job["input"], result))
+                self._trim()
+
+    def _trim(self):
+        """
+        Drops the oldest jobs beyond PREDICT_JOBS_IN_MEMORY that can still be
+        answered without them: done jobs once written to `predictions`, and
+        failed jobs (lock held).
+        """
+        excess = len(self.jobs) - PREDICT_JOBS_IN_MEMORY
+        for job_id in list(self.jobs):
+            if excess <= 0:
+                break
+            job = self.jobs[job_id]
+            if job["status"] == "failed" or job.get("persisted"):
+                del self.jobs[job_id]
+                excess -= 1
+
+    def _write(self):
+        interval = PREDICT_WRITE_INTERVAL_MS / 1000
+        while True:
+            rows = [self.finished.get()]
+            deadline = time.monotonic() + interval
+            while len(rows) < PREDICT_WRITE_BATCH:
+                try:
+                    rows.append(self.finished.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            params = [
+                {"job_id": job_id, "req": json.dumps(payload), "res": json.dumps(result)}
+                for job_id, payload, result in rows
+            ]
+            error = self._insert(params)
+            with self.lock:
+                for job_id, _, _ in rows:
+                    job = self.jobs.get(job_id)
+                    if job is None:
+                        continue
+                    if error:
+                        # The result never reached `predictions`, so the job
+                        # must not keep reporting "done"
+                        job.update(status="failed", error=f"could not store the prediction: {error}")
+                        job.pop("result", None)
+                    else:
+                        job["persisted"] = True
+                self._trim()
+
+    def _insert(self, params):
+        """
+        Inserts a batch of finished jobs into `predictions`, retrying with
+        exponential backoff. Returns None on success, or the last error.
+        """
+        for attempt in range(PREDICT_WRITE_RETRIES):
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(
+                        "INSERT INTO predictions (job_id, request_data, response_data) "
+                        "VALUES (:job_id, :req, :res) ON CONFLICT (job_id) DO NOTHING"
+                    ), params)
+                self.written += len(params)
+                return None
+            except Exception as e:
+                error = e
+                print(f"⚠️ Failed to write {len(params)} predictions "
+                      f"(attempt {attempt + 1}/{PREDICT_WRITE_RETRIES}): {e}")
+                if attempt + 1 < PREDICT_WRITE_RETRIES:
+                    time.sleep(WRITE_RETRY_BASE_SECONDS * 2 ** attempt)
+        self.write_errors += len(params)
+        print(f"❌ Giving up on {len(params)} predictions; their jobs are marked failed")
+        return error
+
+    def stats(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"jobs": counts, "queued": self.pending.qsize(),
+                "written": self.written, "write_errors": self.write_errors}
@@ -0,0 +1,58 @@
+import os
+from history import BadRequest, parse_date
+
+NEWS_DEFAULT_LIMIT = 20
+NEWS_MAX_LIMIT = int(os.getenv("NEWS_MAX_LIMIT", "200"))
+NEWS_COLUMNS = "url, symbol, published_date, publisher, title, site, text"
+
+
+def news_query(args):
+    """
+    Builds the /api/news query from request args.
+    Without q, articles come newest first; with q (web-search syntax, e.g.
+    `"rate cut" OR guidance -crypto`), they are ranked by ts_rank_cd over
+    the weighted title/text search_vector, then by recency. With symbol,
+    each symbol gets its own top `limit` articles, read from the
+    (symbol, published_date DESC) index; otherwise `limit` is overall.
+    Args:
+        args: Request args with optional symbol (comma-separated), q, since
+            (YYYY-MM-DD) and limit.
+    Returns:
+        (sql, params)
+    """
+    try:
+        limit = int(args.get("limit", NEWS_DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+    if not 1 <= limit <= NEWS_MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {NEWS_MAX_LIMIT}")
+
+    conditions = []
+    params = {"limit": limit}
+    if args.get("since"):
+        conditions.append("published_date >= :since")
+        params["since"] = parse_date(args["since"], "since")
+    if args.get("q"):
+        conditions.append("search_vector @@ websearch_to_tsquery('english', :q)")
+        params["q"] = args["q"]
+        rank = "ts_rank_cd(search_vector, websearch_to_tsquery('english', :q))"
+        select = f"{NEWS_COLUMNS}, {rank} AS rank"
+        order = "rank DESC, published_date DESC"
+    else:
+        select = NEWS_COLUMNS
+        order = "published_date DESC"
+
+    if not args.get("symbol"):
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return f"SELECT {select} FROM stock_news{where} ORDER BY {order} LIMIT :limit", params
+
+    params["symbols"] = list(dict.fromkeys(s.strip().upper() for s in args["symbol"].split(",") if s.strip()))
+    conditions.insert(0, "n.symbol = s.symbol")
+    sql = (
+        f"SELECT a.* FROM unnest(CAST(:symbols AS text[])) WITH ORDINALITY AS s(symbol, position) "
+        f"CROSS JOIN LATERAL ("
+        f"SELECT {select} FROM stock_news n WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {order} LIMIT :limit"
+        f") a ORDER BY s.position, {order}"
+    )
+    return sql, params
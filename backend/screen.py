@@ -0,0 +1,65 @@
+import os
+from history import BadRequest
+
+# Numeric columns of the stock_screen view that can be filtered and sorted on
+SCREEN_COLUMNS = (
+    "market_cap", "price", "beta", "pe_ratio", "pb_ratio", "price_to_sales_ratio", "ev_to_ebitda",
+    "debt_to_equity", "current_ratio", "dividend_yield", "roe", "free_cash_flow_yield",
+)
+SCREEN_DEFAULT_LIMIT = 100
+SCREEN_MAX_LIMIT = int(os.getenv("SCREEN_MAX_LIMIT", "1000"))
+
+
+def parse_number(value, name):
+    try:
+        return float(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be a number")
+
+
+def screen_query(args):
+    """
+    Builds a stock_screen query from request args, e.g.
+    ?sector=Technology&max_pe_ratio=15&sort=-market_cap.
+    Every filter is on a typed column extracted from the key_metrics and
+    profiles documents, so no JSON is parsed at query time.
+    Args:
+        args: Request args with optional sector, industry, exchange,
+            min_<column> / max_<column> for any of SCREEN_COLUMNS, sort (a
+            column, prefixed with - for descending) and limit.
+    Returns:
+        (sql, params)
+    """
+    try:
+        limit = int(args.get("limit", SCREEN_DEFAULT_LIMIT))
+    except ValueError:
+        raise BadRequest("limit must be an integer")
+    if not 1 <= limit <= SCREEN_MAX_LIMIT:
+        raise BadRequest(f"limit must be between 1 and {SCREEN_MAX_LIMIT}")
+
+    conditions = []
+    params = {"limit": limit}
+    for column in ("sector", "industry", "exchange"):
+        if args.get(column):
+            conditions.append(f"{column} = :{column}")
+            params[column] = args[column]
+    for name, value in args.items():
+        bound, _, column = name.partition("_")
+        if bound not in ("min", "max") or not column:
+            continue
+        if column not in SCREEN_COLUMNS:
+            raise BadRequest(f"cannot filter on {column!r}; use one of {', '.join(SCREEN_COLUMNS)}")
+        conditions.append(f"{column} {'>=' if bound == 'min' else '<='} :{name}")
+        params[name] = parse_number(value, name)
+
+    sort = args.get("sort", "ticker")
+    column = sort.lstrip("-")
+    if column != "ticker" and column not in SCREEN_COLUMNS:
+        raise BadRequest(f"cannot sort on {column!r}")
+    order = f"{column} DESC NULLS LAST" if sort.startswith("-") else f"{column} ASC NULLS LAST"
+
+    sql = "SELECT * FROM stock_screen"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {order}, ticker LIMIT :limit"
+    return sql, params
@@ -0,0 +1,14 @@
+# chat_format.py
+
+# Llama-2 chat-format tokens and the forecaster's system prompt, shared by
+# test.py and inference_service.py. Kept free of model dependencies so
+# prompts can be built without torch/peft installed.
+
+B_INST, E_INST = "[INST]", "[/INST]"
+B_SYS,  E_SYS  = "<<SYS>>\n", "\n<</SYS>>\n\n"
+SYSTEM_PROMPT = (
+    "You are a seasoned stock market analyst. Your task is to list the positive "
+    "developments and potential concerns for companies based on relevant news and "
+    "basic financials from the past weeks, then provide an analysis and prediction "
+    "for the companies' stock price movement for the upcoming week."
+)
@@ -16,7 +16,7 @@ function GrowthOverview() {
   const [data, setData] = useState(null);
 
   useEffect(() => {
-    fetch('/api/growth')
+    fetch('/api/growth?orient=columns')
       .then((res) => res.json())
       .then(setData)
       .catch(() => setData(null));
@@ -27,11 +27,11 @@ function GrowthOverview() {
   }
 
   const chartData = {
-    labels: data.dates,
+    labels: data.allocation_date,
     datasets: [
       {
         label: 'Portfolio Value',
-        data: data.values,
+        data: data.total_market_cap,
         fill: false,
         borderColor: 'rgb(75, 192, 192)',
       },
@@ -0,0 +1,261 @@
+# inference_service.py
+
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+from transformers import AutoTokenizer, PreTrainedTokenizerFast, GPT2Config, GPT2LMHeadModel
+
+from chat_format import SYSTEM_PROMPT
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = int(os.getenv("INFERENCE_MAX_WAIT_MS", "20"))
+MAX_NEW_TOKENS = int(os.getenv("INFERENCE_MAX_NEW_TOKENS", "128"))
+# "fingpt" loads test.py's Llama-2 + FinGPT LoRA; "tiny" a random CPU model
+INFERENCE_MODEL = os.getenv("INFERENCE_MODEL", "fingpt")
+
+
+class InferenceService:
+    """
+    Long-lived wrapper around one loaded model that batches prompts.
+    Callers submit prompts from any thread; a single batching thread waits
+    for the first prompt, keeps collecting until it has max_batch_size of
+    them or max_wait_ms has passed, and runs them through one padded
+    model.generate call. Generation uses the same sampling settings as
+    test.py's simple_generate.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_new_tokens=MAX_NEW_TOKENS):
+        self.model = model
+        self.tokenizer = tokenizer
+        # Decoder-only models must be left-padded so every prompt ends where generation starts
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_new_tokens = max_new_tokens
+
+        self.requests = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.started_at = time.perf_counter()
+        self.completed = self.batches = self.generated_tokens = 0
+        self.latencies = deque(maxlen=1000)
+        self.batch_sizes = deque(maxlen=1000)
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, prompt, max_new_tokens=None) -> Future:
+        """Queues a prompt; the returned Future resolves to the generated text."""
+        if self.closed:
+            raise RuntimeError("inference service is closed")
+        future = Future()
+        self.requests.put((prompt, max_new_tokens or self.max_new_tokens, time.perf_counter(), future))
+        return future
+
+    def generate(self, prompt, max_new_tokens=None) -> str:
+        return self.submit(prompt, max_new_tokens).result()
+
+    def generate_many(self, prompts, max_new_tokens=None) -> list:
+        futures = [self.submit(p, max_new_tokens) for p in prompts]
+        return [f.result() for f in futures]
+
+    def close(self):
+        self.closed = True
+        self.requests.put(None)
+        self.thread.join()
+
+    def _next_batch(self):
+        first = self.requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)  # finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                outputs, new_tokens = self._generate_batch(
+                    [prompt for prompt, _, _, _ in batch],
+                    [max_tokens for _, max_tokens, _, _ in batch],
+                )
+            except Exception as e:
+                logger.exception("Batch generation failed")
+                for *_, future in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+            with self.stats_lock:
+                self.completed += len(batch)
+                self.batches += 1
+                self.generated_tokens += new_tokens
+                self.batch_sizes.append(len(batch))
+                self.latencies.extend(finished - submitted for _, _, submitted, _ in batch)
+            for (_, _, _, future), text in zip(batch, outputs):
+                future.set_result(text)
+
+    def _generate_batch(self, prompts, max_new_tokens):
+        """
+        Generates completions for a batch of prompts in one model.generate
+        call, run to the largest of their max_new_tokens; each completion is
+        then cut to its own limit.
+        Returns:
+            (completion texts, number of tokens generated across them)
+        """
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        with torch.no_grad():
+            out_ids = self.model.generate(
+                **inputs,
+                max_new_tokens=max(max_new_tokens),
+                do_sample=True,
+                temperature=.3,
+                top_p=0.9,
+                pad_token_id=self.tokenizer.pad_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                use_cache=True
+            )
+        # With left padding every prompt ends at the same column, so the
+        # completion is everything after it (no need to regex out [/INST])
+        completions = [ids[:limit] for ids, limit in zip(out_ids[:, inputs["input_ids"].shape[1]:], max_new_tokens)]
+        new_tokens = sum(int((ids != self.tokenizer.pad_token_id).sum()) for ids in completions)
+        texts = self.tokenizer.batch_decode(completions, skip_special_tokens=True)
+        return [t.strip() for t in texts], new_tokens
+
+    def stats(self) -> dict:
+        """Throughput since start and latency over the last 1000 prompts."""
+        with self.stats_lock:
+            elapsed = time.perf_counter() - self.started_at
+            latencies = sorted(self.latencies)
+            batch_sizes = list(self.batch_sizes)
+            completed, batches, tokens = self.completed, self.batches, self.generated_tokens
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else None
+
+        return {
+            "completed": completed,
+            "batches": batches,
+            "queued": self.requests.qsize(),
+            "mean_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else None,
+            "prompts_per_sec": completed / elapsed,
+            "tokens_per_sec": tokens / elapsed,
+            "latency_p50_ms": percentile(0.50),
+            "latency_p95_ms": percentile(0.95),
+            "latency_max_ms": latencies[-1] * 1000 if latencies else None,
+        }
+
+
+def chat_prompt(body):
+    """Wraps a forecasting request in the Llama-2 chat format used by test.py."""
+    return "<s>[INST] <<SYS>>\n" + SYSTEM_PROMPT + "\n<</SYS>>\n\n" + body + "[/INST]"
+
+
+def tiny_model(seed=0):
+    """
+    A randomly initialised 2-layer GPT-2 with a byte-level tokenizer, built
+    entirely offline. Its output is noise, but it exercises the same
+    tokenize/pad/generate path on CPU, which is what batching benchmarks need.
+    """
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+    alphabet = pre_tokenizers.ByteLevel.alphabet()
+    vocab = {ch: i for i, ch in enumerate(sorted(alphabet))}
+    vocab["<|endoftext|>"] = len(vocab)
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="<|endoftext|>")
+
+    torch.manual_seed(seed)
+    config = GPT2Config(vocab_size=len(vocab), n_positions=2048, n_embd=64, n_layer=2, n_head=2,
+                        bos_token_id=vocab["<|endoftext|>"], eos_token_id=vocab["<|endoftext|>"])
+    model = GPT2LMHeadModel(config)
+    model.eval()
+    return model, tokenizer
+
+
+def load(model_name=INFERENCE_MODEL):
+    """Returns (model, tokenizer) for "tiny", "fingpt", or a local/hub model path."""
+    if model_name == "tiny":
+        return tiny_model()
+    if model_name == "fingpt":
+        from test import BASE_MODEL, load_model
+        logger.info(f"Loading tokenizer for {BASE_MODEL}…")
+        return load_model(), AutoTokenizer.from_pretrained(BASE_MODEL, trust_remote_code=True)
+    from transformers import AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    model.eval()
+    return model, tokenizer
+
+
+def predictor():
+    """
+    Factory for the backend's /api/predict job queue (PREDICTOR=inference_service:predictor,
+    with the repository root on PYTHONPATH). Payloads carry the request body in "prompt".
+    """
+    service = InferenceService(*load())
+
+    def predict(payloads):
+        futures = [service.submit(chat_prompt(p.get("prompt", ""))) for p in payloads]
+        return [{"prediction": f.result()} for f in futures]
+    return predict
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s: %(message)s",
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Benchmark dynamic batching of model.generate.")
+    parser.add_argument("--model", default="tiny", help='"tiny", "fingpt", or a model name/path')
+    parser.add_argument("--requests", type=int, default=64, help="prompts to send")
+    parser.add_argument("--concurrency", type=int, default=16, help="client threads sending prompts")
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=int, default=MAX_WAIT_MS)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    model, tokenizer = load(args.model)
+    service = InferenceService(model, tokenizer, args.max_batch_size, args.max_wait_ms, args.max_new_tokens)
+    prompts = [
+        chat_prompt(f"Company {i} reported revenue growth of {i % 7 + 1}% last quarter.\n"
+                    f"Forecast the 7-day price movement for TCK{i}:\n" + "Recent news. " * (i % 5))
+        for i in range(args.requests)
+    ]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as clients:
+        list(clients.map(service.generate, prompts))
+    wall = time.perf_counter() - started
+    service.close()
+
+    print(f"\n=== Inference benchmark ({args.model}, max_batch_size={args.max_batch_size}, "
+          f"max_wait_ms={args.max_wait_ms}) ===")
+    print(f"wall time: {wall:.2f}s for {args.requests} prompts")
+    for name, value in service.stats().items():
+        print(f"{name:>16}: {value:.2f}" if isinstance(value, float) else f"{name:>16}: {value}")
@@ -0,0 +1,95 @@
+import csv
+import io
+from sqlalchemy import literal_column, or_
+from sqlalchemy.dialects.postgresql import insert
+
+
+def copy_upsert(session, table, columns, rows, key_columns, guard_columns=None, returning=None,
+                insert_only=()):
+    """
+    Bulk-upserts rows into `table` inside the session's current transaction.
+    The rows are streamed into a temp staging table with COPY, then merged with
+    a single INSERT ... SELECT ... ON CONFLICT DO UPDATE, so a batch costs two
+    round trips instead of a SELECT plus INSERT/UPDATE per row.
+    Args:
+        session: SQLAlchemy session bound to a psycopg2 engine.
+        table: Name of the target table.
+        columns: Column names, in the order they appear in each row.
+        rows: Iterable of tuples; None is loaded as NULL.
+        key_columns: Primary-key columns used as the conflict target.
+        guard_columns: If given, an existing row is only rewritten when one of
+            these columns differs from the incoming value.
+        returning: If given, a column to return for every inserted or updated row.
+        insert_only: Columns only written when a row is inserted; an update
+            keeps their existing values (e.g. a placeholder computed later).
+    Returns:
+        The number of rows inserted or updated, or the list of `returning`
+        values for those rows when `returning` is set.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    staging = f"{table}_staging"
+    column_list = ", ".join(columns)
+    key_list = ", ".join(key_columns)
+    updates = ", ".join(
+        f"{c} = EXCLUDED.{c}" for c in columns if c not in key_columns and c not in insert_only
+    )
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+            f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        cursor.execute(f"TRUNCATE {staging}")
+        cursor.copy_expert(f"COPY {staging} ({column_list}) FROM STDIN WITH CSV", buffer)
+        # DISTINCT ON guards against a payload repeating a key, which
+        # ON CONFLICT would otherwise reject.
+        statement = (
+            f"INSERT INTO {table} ({column_list}) "
+            f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging} "
+            f"ON CONFLICT ({key_list}) DO UPDATE SET {updates}"
+        )
+        if guard_columns:
+            statement += " WHERE " + " OR ".join(
+                f"{table}.{c} IS DISTINCT FROM EXCLUDED.{c}" for c in guard_columns
+            )
+        if returning:
+            cursor.execute(f"{statement} RETURNING {table}.{returning}")
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(statement)
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+def guarded_upsert(table, values, key_columns, unguarded=()):
+    """
+    Builds a single-row INSERT ... ON CONFLICT DO UPDATE that leaves an
+    existing row alone unless a column actually changes, so reruns over
+    unchanged data write no new tuple versions (and no WAL). The statement
+    returns (xmax = 0): true for an insert, false for an update, and no row
+    when the existing row was already identical.
+    Args:
+        table: Reflected Table to upsert into.
+        values: {column: value} for the new row.
+        key_columns: Conflict target (the primary key).
+        unguarded: Columns that are written along with a change but do not
+            count as one on their own (e.g. a fetch date).
+    """
+    stmt = insert(table).values(**values)
+    updates = {c: stmt.excluded[c] for c in values if c not in key_columns}
+    changed = or_(*(table.c[c].is_distinct_from(stmt.excluded[c]) for c in updates if c not in unguarded))
+    return stmt.on_conflict_do_update(
+        index_elements=key_columns, set_=updates, where=changed
+    ).returning(literal_column("(xmax = 0)").label("inserted"))
+
+
+def upsert_outcome(result):
+    """Classifies the result of a guarded_upsert as "inserted", "updated" or "unchanged"."""
+    row = result.first()
+    if row is None:
+        return "unchanged"
+    return "inserted" if row[0] else "updated"
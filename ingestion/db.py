@@ -0,0 +1,46 @@
+import os
+import threading
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, MetaData, text
+from sqlalchemy.orm import sessionmaker
+
+# Load environment variables
+load_dotenv(override=True)
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+if not DATABASE_URL:
+    raise ValueError("DATABASE_URL environment variable is not set")
+
+# One engine (and connection pool) per process, shared by every fetcher.
+# The pool is sized so all fetchers can hold a connection when
+# run_all_fetch_scripts.py runs them concurrently.
+engine = create_engine(DATABASE_URL, pool_size=10, max_overflow=5)
+Session = sessionmaker(bind=engine)
+
+_metadata = None
+_metadata_lock = threading.Lock()
+
+
+def reflect_metadata() -> MetaData:
+    """
+    Returns the reflected schema, reflecting it only on first use so it
+    happens after init_db has created the tables.
+    """
+    global _metadata
+    with _metadata_lock:
+        if _metadata is None:
+            metadata = MetaData()
+            metadata.reflect(bind=engine)
+            _metadata = metadata
+        return _metadata
+
+
+def bump_data_version(session):
+    """
+    Increments the data_version stamp inside the session's transaction, so
+    the backend drops cached responses once the new data is committed.
+    """
+    session.execute(text(
+        "INSERT INTO data_version (id, version) VALUES (TRUE, 1) "
+        "ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1, updated_at = NOW()"
+    ))
@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
-import os
+import argparse
+import json
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
 import psycopg2
 
 # ———— Config (match your docker-compose) ————
@@ -22,21 +27,233 @@ TABLES = [
     "allocations"
 ]
 
-def main():
-    conn = psycopg2.connect(
+# Parquet partitioning: table -> (ticker column, date column). These tables
+# carry an updated_at write time for the incremental export; tables without
+# a date column (tickers, profiles) have none and are rewritten in full, as
+# a single file, on every export
+PARTITIONS = {
+    "prices": ("ticker", "price_date"),
+    "analyst_labels": ("ticker", "label_date"),
+    "analyst_estimates": ("symbol", "report_date"),
+    "grades_historical": ("symbol", "rating_date"),
+    "stock_news": ("symbol", "published_date"),
+    "key_metrics": ("ticker", "date"),
+    "allocations": ("ticker", "allocation_date"),
+}
+BATCH_ROWS = 100_000
+# Write-time bookkeeping (see schema.sql), not data; left out of the export
+BOOKKEEPING_COLUMNS = {"updated_at"}
+# Fingerprints of the (ticker, year) partitions written by the last export
+STATE_FILE = "_partitions.json"
+
+
+# Postgres type OID -> pyarrow type factory (NUMERIC and JSON are cast in SQL)
+def _parquet_types():
+    import pyarrow as pa
+    return {
+        16: pa.bool_, 20: pa.int64, 21: pa.int16, 23: pa.int32, 700: pa.float32, 701: pa.float64,
+        25: pa.string, 1042: pa.string, 1043: pa.string,
+        1082: pa.date32, 1114: lambda: pa.timestamp("us"), 1184: lambda: pa.timestamp("us", tz="UTC"),
+    }
+
+
+def connect(dsn=None):
+    if dsn:
+        return psycopg2.connect(dsn)
+    return psycopg2.connect(
         host=DB_HOST,
         port=DB_PORT,
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
     )
+
+
+def stored_columns(cur, table):
+    """
+    The table's columns as loaded by ingestion, in order: generated columns
+    (stock_news.search_vector, the typed key_metrics/profiles columns) and
+    BOOKKEEPING_COLUMNS are left out.
+    """
+    cur.execute(
+        "SELECT attname FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = '' "
+        "ORDER BY attnum",
+        (table,),
+    )
+    return [name for (name,) in cur.fetchall() if name not in BOOKKEEPING_COLUMNS]
+
+
+def export_csv(conn):
+    for table in TABLES:
+        filename = f"{table}.csv"
+        print(f"Exporting {table} → {filename} …", end="", flush=True)
+        with conn.cursor() as cur, open(filename, "w", newline="") as f:
+            columns = ", ".join(stored_columns(cur, table))
+            # COPY cannot read a partitioned table (prices, allocations) directly
+            cur.copy_expert(f"COPY (SELECT {columns} FROM {table}) TO STDOUT WITH CSV HEADER", f)
+        print(" done.")
+
+
+def typed_select(cur, table):
+    """
+    SELECT list that maps columns to Parquet-friendly types: NUMERIC to
+    double precision and JSON to text; everything else keeps its type.
+    tsvector columns (stock_news.search_vector) are derived data for
+    Postgres full-text search and are left out, as are BOOKKEEPING_COLUMNS.
+    """
+    cur.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        "WHERE table_name = %s AND table_schema = current_schema() ORDER BY ordinal_position",
+        (table,),
+    )
+    columns = []
+    for name, data_type in cur.fetchall():
+        if data_type == "numeric":
+            columns.append(f"{name}::double precision AS {name}")
+        elif data_type in ("json", "jsonb"):
+            columns.append(f"{name}::text AS {name}")
+        elif data_type == "tsvector" or name in BOOKKEEPING_COLUMNS:
+            continue
+        else:
+            columns.append(name)
+    return ", ".join(columns)
+
+
+def partition_fingerprints(cur, table):
+    """
+    {"<ticker>/<year>": fingerprint} for every (ticker, year) partition of a
+    time-series table: its row count and latest updated_at. Inserts and
+    updates move updated_at and deletes lower the count, whatever the
+    dates of the rows involved, without reading or hashing row contents.
+    """
+    key, date_column = PARTITIONS[table]
+    cur.execute(
+        f"SELECT {key}, EXTRACT(YEAR FROM {date_column})::int, "
+        f"COUNT(*) || ':' || MAX(updated_at) "
+        f"FROM {table} GROUP BY 1, 2"
+    )
+    return {f"{ticker}/{year}": fingerprint for ticker, year, fingerprint in cur.fetchall()}
+
+
+def export_parquet_table(dsn, table, out_dir, previous=None):
+    """
+    Exports one table to zstd-compressed Parquet over its own connection.
+    Time-series tables are partitioned as <table>/<ticker column>=X/year=Y/.
+    Given the partition fingerprints of the previous export, only
+    partitions that are new or changed are rewritten (and vanished ones
+    removed); otherwise the table is rewritten in full.
+    Returns:
+        (rows written, partitions rewritten or None if all, new fingerprints or None)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    PARQUET_TYPES = _parquet_types()
+    target = Path(out_dir) / table
+    key, date_column = PARTITIONS.get(table, (None, None))
+    conn = connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            query = f"SELECT {typed_select(cur, table)} FROM {table}"
+            fingerprints = partition_fingerprints(cur, table) if date_column else None
+        params = ()
+        changed = None
+        if date_column and previous is not None:
+            changed = sorted(p for p, fp in fingerprints.items() if previous.get(p) != fp)
+            for partition in set(previous) - set(fingerprints) | set(changed):
+                ticker, year = partition.rsplit("/", 1)
+                shutil.rmtree(target / f"{key}={ticker}" / f"year={year}", ignore_errors=True)
+            split = [p.rsplit("/", 1) for p in changed]
+            query += (
+                f" WHERE ({key}, EXTRACT(YEAR FROM {date_column})::int) IN "
+                f"(SELECT * FROM unnest(%s::text[], %s::int[]))"
+            )
+            params = ([ticker for ticker, _ in split], [int(year) for _, year in split])
+        else:
+            shutil.rmtree(target, ignore_errors=True)
+        target.mkdir(parents=True, exist_ok=True)
+
+        rows = 0
+        with conn.cursor(name=f"export_{table}") as cur:  # server-side cursor
+            cur.itersize = BATCH_ROWS
+            cur.execute(query, params)
+            batch_number = 0
+            while True:
+                batch = cur.fetchmany(BATCH_ROWS)
+                if not batch:
+                    break
+                # Type each column from its Postgres type, so an all-NULL batch
+                # still matches the schema of the other files
+                types = [PARQUET_TYPES.get(d[1]) for d in cur.description]
+                data = pa.Table.from_arrays(
+                    [pa.array(list(col), type=t() if t else None) for col, t in zip(zip(*batch), types)],
+                    names=[d[0] for d in cur.description],
+                )
+                rows += data.num_rows
+                if date_column:
+                    data = data.append_column("year", pc.year(data[date_column]).cast(pa.int16()))
+                    ds.write_dataset(
+                        data, target, format="parquet",
+                        partitioning=ds.partitioning(
+                            pa.schema([(key, pa.string()), ("year", pa.int16())]), flavor="hive"
+                        ),
+                        basename_template=f"part-{int(time.time())}-{batch_number}-{{i}}.parquet",
+                        existing_data_behavior="overwrite_or_ignore",
+                        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+                    )
+                else:
+                    pq.write_table(data, target / f"part-{batch_number}.parquet", compression="zstd")
+                batch_number += 1
+        return rows, changed, fingerprints
+    finally:
+        conn.close()
+
+
+def export_parquet(dsn, out_dir, full=False, workers=4):
+    """
+    Exports every table to Parquet concurrently, one connection per table.
+    Unless `full`, time-series tables are exported incrementally: only the
+    (ticker, year) partitions whose fingerprint differs from the previous
+    run's are rewritten, so backfilled tickers and revisions of any date
+    are picked up.
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    state_file = out / STATE_FILE
+    state = {} if full or not state_file.exists() else json.loads(state_file.read_text())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(export_parquet_table, dsn, t, out, state.get(t)): t for t in TABLES}
+        for future in as_completed(futures):
+            table = futures[future]
+            rows, changed, fingerprints = future.result()
+            if fingerprints is not None:
+                state[table] = fingerprints
+            mode = "full" if changed is None else f"{len(changed)} changed partitions"
+            print(f"Exported {table} ({mode}): {rows} rows")
+    state_file.write_text(json.dumps(state, indent=2, sort_keys=True))
+    print(f"✅ All tables exported to {out}/ in {time.perf_counter() - started:.1f}s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the database tables.")
+    parser.add_argument("--parquet", metavar="DIR",
+                        help="write partitioned Parquet to DIR instead of CSVs in the current directory")
+    parser.add_argument("--full", action="store_true", help="re-export everything, ignoring the previous export's fingerprints")
+    parser.add_argument("--workers", type=int, default=4, help="tables exported concurrently")
+    parser.add_argument("--dsn", help="libpq connection string (defaults to the docker-compose settings)")
+    args = parser.parse_args()
+
+    if args.parquet:
+        export_parquet(args.dsn, args.parquet, full=args.full, workers=args.workers)
+        return
+    conn = connect(args.dsn)
     try:
-        for table in TABLES:
-            filename = f"{table}.csv"
-            print(f"Exporting {table} → {filename} …", end="", flush=True)
-            with conn.cursor() as cur, open(filename, "w", newline="") as f:
-                cur.copy_expert(f"COPY {table} TO STDOUT WITH CSV HEADER", f)
-            print(" done.")
+        export_csv(conn)
     finally:
         conn.close()
     print("✅ All tables exported.")
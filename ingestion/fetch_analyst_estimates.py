@@ -1,153 +1,157 @@
+from collections import Counter
 from datetime import date, datetime, timedelta
-import requests
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
-from dotenv import load_dotenv
-import time
-import os
-
-# Load environment (override if already set)
-load_dotenv(override=True)
-
-# Configuration
-# Define a delay to stay within API rate limits
-API_REQUEST_DELAY = 0.21  # seconds
-
-DATABASE_URL = os.getenv('DATABASE_URL')
-FMP_API_KEY   = os.getenv('FMP_API_KEY')
+from fmp_client import get_client
+from db import Session, reflect_metadata
+from bulk_load import guarded_upsert, upsert_outcome
+from run_ledger import RunLedger
+from watermarks import load_watermarks, fetch_start
+import argparse
 
 # SQLAlchemy setup
-engine   = create_engine(DATABASE_URL)
-Session  = sessionmaker(bind=engine)
-session  = Session()
-metadata = MetaData()
-metadata.reflect(bind=engine)
+metadata = reflect_metadata()
 
 tickers_table           = metadata.tables['tickers']
 analyst_estimates_table = metadata.tables['analyst_estimates']
 
-def fetch_and_upsert_analyst_estimates_quarterly():
+def fetch_analyst_estimates(ticker, cutoffs):
+    """
+    Pages through a ticker's estimates in chunks of 10 until we're beyond its cutoff.
+    Returns (records, error); records fetched before an error are kept.
+    """
+    cutoff = cutoffs[ticker]
+    print(f"Processing analyst estimates for {ticker}...")
+    page = 0
+    all_records = []
+    while True:
+        try:
+            print(f"  Fetching analyst estimates for {ticker}, page {page}...")
+            data = get_client().get_json(
+                "stable/analyst-estimates",
+                symbol=ticker,
+                period='annual',            # ← back to annual for your plan
+                page=page,
+                limit=10
+            )
+            if not data or not isinstance(data, list):
+                return all_records, None
+
+            all_records.extend(data)
+
+            # stop if the oldest date on this page is before cutoff
+            oldest = min(datetime.fromisoformat(r["date"]).date() for r in data)
+            if oldest < cutoff:
+                return all_records, None
+
+            page += 1
+
+        except Exception as e:
+            return all_records, f"page {page}: {e}"
+
+def fetch_and_upsert_analyst_estimates_quarterly(full=False, resume=False):
+    """
+    Upserts analyst estimates for the last 3 years. Unless `full` is set, tickers
+    already in the table are only paged back to their latest past report_date
+    (less the revision overlap); forward-looking estimates are always refreshed
+    since they sit on the first page. Commits in batches as tickers complete
+    (see run_ledger.RunLedger); with `resume`, a standalone run continues
+    the last unfinished run and skips the tickers it already completed.
+    """
+    session    = Session()
     today      = date.today()
-    cutoff     = today - timedelta(days=365*3)
-    inserted = updated = skipped = 0
-
-    # Retrieve all tickers
-    tickers = [t[0] for t in session.query(tickers_table.c.ticker).all()]
-
-    for ticker in tickers:
-        print(f"Processing analyst estimates for {ticker}...")
-        page = 0
-        all_records = []
-
-        # Page through in chunks of 10 until we're beyond the 3-year cutoff
-        while True:
-            url = (
-               f"https://financialmodelingprep.com/stable/analyst-estimates"
-                   f"?symbol={ticker}"                
-                    f"&period=annual"            # ← back to annual for your plan
-                    f"&page={page}"
-                    f"&limit=10"
-                    f"&apikey={FMP_API_KEY}"
-                )
+    backfill   = today - timedelta(days=365*3)
+    counts   = Counter()
+    skipped  = 0
+    client   = get_client()
+    try:
+        ledger   = RunLedger(session, "estimates", resume)
+
+        # Retrieve all tickers
+        tickers = ledger.pending([t[0] for t in session.query(tickers_table.c.ticker).all()])
+        # Estimates carry future report dates, so each watermark is the latest
+        # report_date that is already past
+        watermarks = {} if full else load_watermarks(session, 'analyst_estimates', 'symbol', 'report_date',
+                                                     until=today)
+        cutoffs = {ticker: fetch_start(watermarks.get(ticker), backfill) for ticker in tickers}
+
+        for ticker, future in client.map_tickers(fetch_analyst_estimates, tickers, cutoffs):
+            ledger.start(ticker)
+            status = "done"
+            ticker_counts = Counter()
             try:
-                print(f"  Fetching analyst estimates for {ticker}, page {page}...")
-                resp = requests.get(url)
-                time.sleep(API_REQUEST_DELAY) # Respect API rate limit
-                resp.raise_for_status()
-                data = resp.json()
-                if not data or not isinstance(data, list):
-                    break
-
-                all_records.extend(data)
-
-                # stop if the oldest date on this page is before cutoff
-                oldest = min(datetime.fromisoformat(r["date"]).date() for r in data)
-                if oldest < cutoff:
-                    break
-
-                page += 1
-
-            except Exception as e:
-                session.rollback()
-                print(f"  -> Error fetching page {page} for {ticker}: {e}. Skipping rest for this ticker.")
-                skipped += 1
-                break
-
-        # filter to the last 3 years
-        recent = [r for r in all_records if datetime.fromisoformat(r["date"]).date() >= cutoff]
+                all_records, error = future.result()
+                if error:
+                    print(f"  -> Error fetching {error} for {ticker}. Skipping rest for this ticker.")
+                    skipped += 1
+                    status = "partial"
+
+                # filter to the last 3 years, or to what changed since the last run
+                recent = [r for r in all_records if datetime.fromisoformat(r["date"]).date() >= cutoffs[ticker]]
         
-        if not recent:
-            skipped += 1
-            if all_records:
-                print(f"  -> For {ticker}: Fetched {len(all_records)} records, but none are recent (last 3 years).")
-            else:
-                print(f"  -> For {ticker}: No analyst estimates records found after API calls.")
-            continue
+                if not recent:
+                    skipped += 1
+                    if not error:
+                        status = "no_data"
+                    if all_records:
+                        print(f"  -> For {ticker}: Fetched {len(all_records)} records, but none are recent (last 3 years).")
+                    else:
+                        print(f"  -> For {ticker}: No analyst estimates records found after API calls.")
+                    continue
         
-        print(f"  -> For {ticker}: Found {len(recent)} recent analyst estimates to upsert.")
-        # upsert each record
-        for rec in recent:
-            pub_date = rec["date"]
-            stmt = insert(analyst_estimates_table).values(
-                symbol                  = rec.get("symbol"),
-                report_date             = pub_date,
-                revenue_low             = rec.get("revenueLow"),
-                revenue_high            = rec.get("revenueHigh"),
-                revenue_avg             = rec.get("revenueAvg"),
-                ebitda_low              = rec.get("ebitdaLow"),
-                ebitda_high             = rec.get("ebitdaHigh"),
-                ebitda_avg              = rec.get("ebitdaAvg"),
-                ebit_low                = rec.get("ebitLow"),
-                ebit_high               = rec.get("ebitHigh"),
-                ebit_avg                = rec.get("ebitAvg"),
-                net_income_low          = rec.get("netIncomeLow"),
-                net_income_high         = rec.get("netIncomeHigh"),
-                net_income_avg          = rec.get("netIncomeAvg"),
-                sga_expense_low         = rec.get("sgaExpenseLow"),
-                sga_expense_high        = rec.get("sgaExpenseHigh"),
-                sga_expense_avg         = rec.get("sgaExpenseAvg"),
-                eps_avg                 = rec.get("epsAvg"),
-                eps_high                = rec.get("epsHigh"),
-                eps_low                 = rec.get("epsLow"),
-                num_analysts_revenue    = rec.get("numAnalystsRevenue"),
-                num_analysts_eps        = rec.get("numAnalystsEps"),
-                source                  = 'FMP'
-            ).on_conflict_do_update(
-                index_elements=['symbol','report_date'],
-                set_={
-                  'revenue_low':          rec.get("revenueLow"),
-                  'revenue_high':         rec.get("revenueHigh"),
-                  'revenue_avg':          rec.get("revenueAvg"),
-                  'ebitda_low':           rec.get("ebitdaLow"),
-                  'ebitda_high':          rec.get("ebitdaHigh"),
-                  'ebitda_avg':           rec.get("ebitdaAvg"),
-                  'ebit_low':             rec.get("ebitLow"),
-                  'ebit_high':            rec.get("ebitHigh"),
-                  'ebit_avg':             rec.get("ebitAvg"),
-                  'net_income_low':       rec.get("netIncomeLow"),
-                  'net_income_high':      rec.get("netIncomeHigh"),
-                  'net_income_avg':       rec.get("netIncomeAvg"),
-                  'sga_expense_low':      rec.get("sgaExpenseLow"),
-                  'sga_expense_high':     rec.get("sgaExpenseHigh"),
-                  'sga_expense_avg':      rec.get("sgaExpenseAvg"),
-                  'eps_avg':              rec.get("epsAvg"),
-                  'eps_high':             rec.get("epsHigh"),
-                  'eps_low':              rec.get("epsLow"),
-                  'num_analysts_revenue': rec.get("numAnalystsRevenue"),
-                  'num_analysts_eps':     rec.get("numAnalystsEps"),
-                  'source':               'FMP'
-                }
-            )
-            res = session.execute(stmt)
-            if res.rowcount == 1:
-                inserted += 1
-            else:
-                updated += 1
-
-    session.commit()
-    print(f"✅ Quarterly analyst estimates: Inserted={inserted}, Updated={updated}, Skipped={skipped}")
-    session.close()
+                print(f"  -> For {ticker}: Found {len(recent)} recent analyst estimates to upsert.")
+                # upsert each record
+                for rec in recent:
+                    pub_date = rec["date"]
+                    stmt = guarded_upsert(analyst_estimates_table, {
+                        'symbol':               rec.get("symbol"),
+                        'report_date':          pub_date,
+                        'revenue_low':          rec.get("revenueLow"),
+                        'revenue_high':         rec.get("revenueHigh"),
+                        'revenue_avg':          rec.get("revenueAvg"),
+                        'ebitda_low':           rec.get("ebitdaLow"),
+                        'ebitda_high':          rec.get("ebitdaHigh"),
+                        'ebitda_avg':           rec.get("ebitdaAvg"),
+                        'ebit_low':             rec.get("ebitLow"),
+                        'ebit_high':            rec.get("ebitHigh"),
+                        'ebit_avg':             rec.get("ebitAvg"),
+                        'net_income_low':       rec.get("netIncomeLow"),
+                        'net_income_high':      rec.get("netIncomeHigh"),
+                        'net_income_avg':       rec.get("netIncomeAvg"),
+                        'sga_expense_low':      rec.get("sgaExpenseLow"),
+                        'sga_expense_high':     rec.get("sgaExpenseHigh"),
+                        'sga_expense_avg':      rec.get("sgaExpenseAvg"),
+                        'eps_avg':              rec.get("epsAvg"),
+                        'eps_high':             rec.get("epsHigh"),
+                        'eps_low':              rec.get("epsLow"),
+                        'num_analysts_revenue': rec.get("numAnalystsRevenue"),
+                        'num_analysts_eps':     rec.get("numAnalystsEps"),
+                        'source':               'FMP'
+                    }, ['symbol', 'report_date'])
+                    ticker_counts[upsert_outcome(session.execute(stmt))] += 1
+            except Exception as e:
+                status = "failed"  # rolls back this ticker only
+                print(f"  -> Error upserting analyst estimates for {ticker}: {e}")
+                skipped += 1
+            finally:
+                if status != "failed":  # a failed ticker's writes are rolled back, so not counted
+                    counts.update(ticker_counts)
+                ledger.finish(ticker, status)
+
+        ledger.close()
+        print(f"✅ Quarterly analyst estimates: Inserted={counts['inserted']}, Updated={counts['updated']}, "
+              f"Unchanged={counts['unchanged']}, Skipped={skipped}")
+
+    except Exception as e:
+        print(f"❌ An error occurred during the analyst estimates fetching process: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 if __name__ == '__main__':
-    fetch_and_upsert_analyst_estimates_quarterly()
+    parser = argparse.ArgumentParser(description="Fetch and upsert analyst estimates.")
+    parser.add_argument("--full", action="store_true",
+                        help="page back through the full 3-year window for every ticker")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last unfinished run, skipping tickers it completed")
+    args = parser.parse_args()
+    fetch_and_upsert_analyst_estimates_quarterly(full=args.full, resume=args.resume)
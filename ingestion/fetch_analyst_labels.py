@@ -1,90 +1,76 @@
+import argparse
+from collections import Counter
 from datetime import date
-import requests
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
-from dotenv import load_dotenv
-import time
-import os
-
-# Load environment with override
-load_dotenv(override=True)
-
-# Configuration
-# Define a delay to stay within API rate limits
-API_REQUEST_DELAY = 0.21  # seconds
-
-DATABASE_URL = os.getenv('DATABASE_URL')
-FMP_API_KEY = os.getenv('FMP_API_KEY')
+from fmp_client import get_client
+from db import Session, reflect_metadata
+from bulk_load import guarded_upsert, upsert_outcome
+from run_ledger import RunLedger
 
 # SQLAlchemy setup
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
-metadata = MetaData()
-metadata.reflect(bind=engine)
+metadata = reflect_metadata()
 
 tickers_table = metadata.tables['tickers']
 analyst_labels_table = metadata.tables['analyst_labels']
 
-def fetch_and_upsert_analyst_labels():
+def fetch_analyst_labels(ticker):
+    print(f"Fetching analyst labels for {ticker}...")
+    return get_client().get_json("stable/ratings-snapshot", symbol=ticker)
+
+def fetch_and_upsert_analyst_labels(resume=False):
+    """
+    Upserts today's ratings snapshot for every ticker, committing in batches
+    as tickers complete (see run_ledger.RunLedger).
+    Args:
+        resume: When run on its own, continue the last unfinished run and
+            skip the tickers it already completed.
+    """
+    session = Session()
     today = date.today()
-    inserted = updated = skipped = 0
-
-    # Retrieve all tickers
-    tickers = [t[0] for t in session.query(tickers_table.c.ticker).all()]
-
-    for ticker in tickers:
-        url = (
-            f"https://financialmodelingprep.com/stable/ratings-snapshot"
-            f"?symbol={ticker}&apikey={FMP_API_KEY}"
-        )
-        try:
-            response = requests.get(url)
-            print(f"Fetching analyst labels for {ticker}...")
-            time.sleep(API_REQUEST_DELAY) # Respect API rate limit
-            response.raise_for_status()
-            data = response.json()
-
-            # Validate response structure
-            if not data or not isinstance(data, list):
-                skipped += 1
-                print(f"  -> Skipped {ticker}: No data or invalid format from API.")
-                continue
-
-            snapshot = data[0]
-            # Extract all relevant fields
-            rating                     = snapshot.get('rating')
-            overall_score              = snapshot.get('overallScore')
-            discounted_cash_flow_score = snapshot.get('discountedCashFlowScore')
-            return_on_equity_score     = snapshot.get('returnOnEquityScore')
-            return_on_assets_score     = snapshot.get('returnOnAssetsScore')
-            debt_to_equity_score       = snapshot.get('debtToEquityScore')
-            price_to_earnings_score    = snapshot.get('priceToEarningsScore')
-            price_to_book_score        = snapshot.get('priceToBookScore')
-
-            # Skip if no overall score available
-            if overall_score is None:
-                skipped += 1
-                print(f"  -> Skipped {ticker}: No overall score available.")
-                continue
-
-            # Build upsert statement
-            stmt = insert(analyst_labels_table).values(
-                ticker=ticker,
-                label_date=today,
-                rating=rating,
-                overall_score=overall_score,
-                discounted_cash_flow_score=discounted_cash_flow_score,
-                return_on_equity_score=return_on_equity_score,
-                return_on_assets_score=return_on_assets_score,
-                debt_to_equity_score=debt_to_equity_score,
-                price_to_earnings_score=price_to_earnings_score,
-                price_to_book_score=price_to_book_score,
-                source='FMP'
-            ).on_conflict_do_update(
-                index_elements=['ticker', 'label_date'],
-                set_={
+    counts = Counter()
+    skipped = 0
+    client = get_client()
+    try:
+        ledger = RunLedger(session, "labels", resume)
+
+        # Retrieve all tickers
+        tickers = ledger.pending([t[0] for t in session.query(tickers_table.c.ticker).all()])
+
+        for ticker, future in client.map_tickers(fetch_analyst_labels, tickers):
+            ledger.start(ticker)
+            status = "done"
+            ticker_counts = Counter()
+            try:
+                data = future.result()
+
+                # Validate response structure
+                if not data or not isinstance(data, list):
+                    skipped += 1
+                    status = "no_data"
+                    print(f"  -> Skipped {ticker}: No data or invalid format from API.")
+                    continue
+
+                snapshot = data[0]
+                # Extract all relevant fields
+                rating                     = snapshot.get('rating')
+                overall_score              = snapshot.get('overallScore')
+                discounted_cash_flow_score = snapshot.get('discountedCashFlowScore')
+                return_on_equity_score     = snapshot.get('returnOnEquityScore')
+                return_on_assets_score     = snapshot.get('returnOnAssetsScore')
+                debt_to_equity_score       = snapshot.get('debtToEquityScore')
+                price_to_earnings_score    = snapshot.get('priceToEarningsScore')
+                price_to_book_score        = snapshot.get('priceToBookScore')
+
+                # Skip if no overall score available
+                if overall_score is None:
+                    skipped += 1
+                    status = "no_data"
+                    print(f"  -> Skipped {ticker}: No overall score available.")
+                    continue
+
+                # Build upsert statement
+                stmt = guarded_upsert(analyst_labels_table, {
+                    'ticker': ticker,
+                    'label_date': today,
                     'rating': rating,
                     'overall_score': overall_score,
                     'discounted_cash_flow_score': discounted_cash_flow_score,
@@ -94,24 +80,34 @@ def fetch_and_upsert_analyst_labels():
                     'price_to_earnings_score': price_to_earnings_score,
                     'price_to_book_score': price_to_book_score,
                     'source': 'FMP'
-                }
-            )
-
-            result = session.execute(stmt)
-            if result.rowcount == 1:
-                inserted += 1
-            else:
-                updated += 1
-            print(f"  -> Successfully processed analyst labels for {ticker}.")
+                }, ['ticker', 'label_date'])
 
-        except Exception as e:
-            session.rollback()
-            print(f"  -> Error processing analyst labels for {ticker}: {e}")
-            skipped += 1
+                ticker_counts[upsert_outcome(session.execute(stmt))] += 1
+                print(f"  -> Successfully processed analyst labels for {ticker}.")
 
-    session.commit()
-    print(f"✅ Analyst labels: Inserted={inserted}, Updated={updated}, Skipped={skipped}")
-    session.close()
+            except Exception as e:
+                status = "failed"  # rolls back this ticker only
+                print(f"  -> Error processing analyst labels for {ticker}: {e}")
+                skipped += 1
+            finally:
+                if status != "failed":  # a failed ticker's writes are rolled back, so not counted
+                    counts.update(ticker_counts)
+                ledger.finish(ticker, status)
+
+        ledger.close()
+        print(f"✅ Analyst labels: Inserted={counts['inserted']}, Updated={counts['updated']}, "
+              f"Unchanged={counts['unchanged']}, Skipped={skipped}")
+
+    except Exception as e:
+        print(f"❌ An error occurred during the analyst labels fetching process: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 if __name__ == '__main__':
-    fetch_and_upsert_analyst_labels()
+    parser = argparse.ArgumentParser(description="Fetch and upsert analyst rating snapshots.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last unfinished run, skipping tickers it completed")
+    args = parser.parse_args()
+    fetch_and_upsert_analyst_labels(resume=args.resume)
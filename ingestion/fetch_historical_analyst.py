@@ -1,103 +1,108 @@
+from collections import Counter
 from datetime import date, datetime, timedelta
-import requests
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
-from dotenv import load_dotenv
-import time
-import os
-
-# Load environment (override if already set)
-load_dotenv(override=True)
-
-# Configuration
-# Define a delay to stay within API rate limits
-API_REQUEST_DELAY = 0.21  # seconds
-
-DATABASE_URL = os.getenv('DATABASE_URL')
-FMP_API_KEY  = os.getenv('FMP_API_KEY')
+from fmp_client import get_client
+from db import Session, reflect_metadata
+from bulk_load import guarded_upsert, upsert_outcome
+from run_ledger import RunLedger
+from watermarks import load_watermarks, fetch_start
+import argparse
 
 # SQLAlchemy setup
-engine   = create_engine(DATABASE_URL)
-Session  = sessionmaker(bind=engine)
-session  = Session()
-metadata = MetaData()
-metadata.reflect(bind=engine)
+metadata = reflect_metadata()
 
 tickers_table           = metadata.tables['tickers']
 grades_historical_table = metadata.tables['grades_historical']
 
-def fetch_and_upsert_grades_historical():
+def fetch_grades_historical(ticker):
+    print(f"Fetching historical grades for {ticker}...")
+    return get_client().get_json("stable/grades-historical", symbol=ticker)
+
+def fetch_and_upsert_grades_historical(full=False, resume=False):
+    """
+    Upserts the last 3 years of historical grades. Unless `full` is set, only
+    grades newer than each ticker's latest stored rating_date (less the revision
+    overlap) are written; the endpoint has no date filter, so the payload itself
+    is unchanged. Commits in batches as tickers complete (see
+    run_ledger.RunLedger); with `resume`, a standalone run continues the last
+    unfinished run and skips the tickers it already completed.
+    """
+    session    = Session()
     today      = date.today()
     cutoff     = today - timedelta(days=365*3)
-    inserted = updated = skipped = 0
+    counts   = Counter()
+    skipped  = 0
+    client   = get_client()
+    try:
+        ledger   = RunLedger(session, "grades", resume)
 
-    # Retrieve all tickers
-    tickers = [t[0] for t in session.query(tickers_table.c.ticker).all()]
+        # Retrieve all tickers
+        tickers = ledger.pending([t[0] for t in session.query(tickers_table.c.ticker).all()])
+        watermarks = {} if full else load_watermarks(session, 'grades_historical', 'symbol', 'rating_date')
 
-    for ticker in tickers:
-        url   = (
-            f"https://financialmodelingprep.com/stable/grades-historical"
-            f"?symbol={ticker}&apikey={FMP_API_KEY}"
-        )
-        try:
-            resp = requests.get(url)
-            print(f"Fetching historical grades for {ticker}...")
-            time.sleep(API_REQUEST_DELAY) # Respect API rate limit
-            resp.raise_for_status()
-            data = resp.json()
+        for ticker, future in client.map_tickers(fetch_grades_historical, tickers):
+            ledger.start(ticker)
+            status = "done"
+            ticker_counts = Counter()
+            try:
+                data = future.result()
 
-            # Expecting a list of { symbol, date, analystRatingsBuy, … }
-            if not data or not isinstance(data, list):
-                skipped += 1
-                print(f"  -> Skipped {ticker}: No data or invalid format from API for historical grades.")
-                continue
+                # Expecting a list of { symbol, date, analystRatingsBuy, … }
+                if not data or not isinstance(data, list):
+                    skipped += 1
+                    status = "no_data"
+                    print(f"  -> Skipped {ticker}: No data or invalid format from API for historical grades.")
+                    continue
 
-            # Filter to last 3 years
-            recent = [
-                r for r in data
-                if r.get("date") and datetime.fromisoformat(r.get("date")).date() >= cutoff
-            ]
-            if not recent:
-                skipped += 1
-                print(f"  -> No recent (last 3 years) historical grades found for {ticker}.")
-                continue
+                # Filter to last 3 years, or to what is new since the last run
+                start = fetch_start(watermarks.get(ticker), cutoff)
+                recent = [
+                    r for r in data
+                    if r.get("date") and datetime.fromisoformat(r.get("date")).date() >= start
+                ]
+                if not recent:
+                    skipped += 1
+                    status = "no_data"
+                    print(f"  -> No historical grades since {start} found for {ticker}.")
+                    continue
 
-            for rec in recent:
-                stmt = insert(grades_historical_table).values(
-                    symbol                      = rec.get("symbol"),
-                    rating_date                 = rec.get("date"),
-                    analyst_ratings_buy         = rec.get("analystRatingsBuy"),
-                    analyst_ratings_hold        = rec.get("analystRatingsHold"),
-                    analyst_ratings_sell        = rec.get("analystRatingsSell"),
-                    analyst_ratings_strong_sell = rec.get("analystRatingsStrongSell"),
-                    source                      = 'FMP'
-                ).on_conflict_do_update(
-                    index_elements=['symbol','rating_date'],
-                    set_={
-                      'analyst_ratings_buy':         rec.get("analystRatingsBuy"),
-                      'analyst_ratings_hold':        rec.get("analystRatingsHold"),
-                      'analyst_ratings_sell':        rec.get("analystRatingsSell"),
-                      'analyst_ratings_strong_sell': rec.get("analystRatingsStrongSell"),
-                      'source':                      'FMP'
-                    }
-                )
+                for rec in recent:
+                    stmt = guarded_upsert(grades_historical_table, {
+                        'symbol':                      rec.get("symbol"),
+                        'rating_date':                 rec.get("date"),
+                        'analyst_ratings_buy':         rec.get("analystRatingsBuy"),
+                        'analyst_ratings_hold':        rec.get("analystRatingsHold"),
+                        'analyst_ratings_sell':        rec.get("analystRatingsSell"),
+                        'analyst_ratings_strong_sell': rec.get("analystRatingsStrongSell"),
+                        'source':                      'FMP'
+                    }, ['symbol', 'rating_date'])
+                    ticker_counts[upsert_outcome(session.execute(stmt))] += 1
+                print(f"  -> Successfully processed {len(recent)} historical grade records for {ticker}.")
 
-                result = session.execute(stmt)
-                if result.rowcount == 1:
-                    inserted += 1
-                else:
-                    updated += 1
-            print(f"  -> Successfully processed {len(recent)} historical grade records for {ticker}.")
+            except Exception as e:
+                status = "failed"  # rolls back this ticker only
+                print(f"  -> Error processing historical grades for {ticker}: {e}")
+                skipped += 1
+            finally:
+                if status != "failed":  # a failed ticker's writes are rolled back, so not counted
+                    counts.update(ticker_counts)
+                ledger.finish(ticker, status)
 
-        except Exception as e:
-            session.rollback()
-            print(f"  -> Error processing historical grades for {ticker}: {e}")
-            skipped += 1
+        ledger.close()
+        print(f"✅ Grades historical: Inserted={counts['inserted']}, Updated={counts['updated']}, "
+              f"Unchanged={counts['unchanged']}, Skipped={skipped}")
 
-    session.commit()
-    print(f"✅ Grades historical: Inserted={inserted}, Updated={updated}, Skipped={skipped}")
-    session.close()
+    except Exception as e:
+        print(f"❌ An error occurred during the historical grades fetching process: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 if __name__ == '__main__':
-    fetch_and_upsert_grades_historical()
+    parser = argparse.ArgumentParser(description="Fetch and upsert historical analyst grades.")
+    parser.add_argument("--full", action="store_true",
+                        help="rewrite the full 3-year window instead of only new grades")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last unfinished run, skipping tickers it completed")
+    args = parser.parse_args()
+    fetch_and_upsert_grades_historical(full=args.full, resume=args.resume)
@@ -1,11 +1,8 @@
-import os
+import argparse
 import time
-import requests
 from datetime import date, timedelta, datetime
 from decimal import Decimal
-from dotenv import load_dotenv
 from sqlalchemy import (
-    create_engine,
     Column,
     String,
     Date,
@@ -13,23 +10,14 @@ from sqlalchemy import (
     BigInteger,
     text,
 )
-from sqlalchemy.orm import declarative_base, sessionmaker
-
-# Load environment variables
-load_dotenv(override=True)
-FMP_API_KEY = os.getenv("FMP_API_KEY")
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-if not FMP_API_KEY or not DATABASE_URL:
-    raise ValueError("FMP_API_KEY and DATABASE_URL must be set in .env file")
-
-# Define a delay to stay within API rate limits
-API_REQUEST_DELAY = 0.21  # seconds (~285 requests per minute)
+from sqlalchemy.orm import declarative_base
+from fmp_client import get_client
+from db import Session, bump_data_version
+from bulk_load import copy_upsert
+from watermarks import load_watermarks, fetch_start
 
 # SQLAlchemy setup
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
 
 # ORM model for allocations table
 class HistoricalAllocation(Base):
@@ -47,34 +35,121 @@ class Ticker(Base):
     __tablename__ = "tickers"
     ticker = Column(String(10), primary_key=True)
 
-def fetch_and_upsert_market_caps():
+ALLOCATION_COLUMNS = ["ticker", "allocation_date", "market_cap_usd", "allocation_pct", "source"]
+
+def fetch_market_caps(symbol, from_dates, to_date_str):
+    from_date_str = from_dates[symbol]
+    print(f"  Fetching market caps for {symbol} from {from_date_str} to {to_date_str}...")
+    return get_client().get_json(
+        f"api/v3/historical-market-capitalization/{symbol}",
+        **{'from': from_date_str, 'to': to_date_str}
+    )
+
+def mark_dirty(session, dates):
+    """Records dates whose allocations changed, in the caller's transaction."""
+    if dates:
+        session.execute(text(
+            "INSERT INTO allocation_dirty_dates (allocation_date) "
+            "SELECT DISTINCT unnest(CAST(:dates AS date[])) ON CONFLICT DO NOTHING"
+        ), {"dates": sorted(set(dates))})
+
+def pending_allocation_dates(session):
+    """
+    Dates whose allocation_totals and allocation_pct need recomputing, i.e.
+    those marked dirty. Totals of databases loaded before allocation_totals
+    existed are backfilled once by init_db.py.
+    """
+    return [d for (d,) in session.execute(text("SELECT allocation_date FROM allocation_dirty_dates"))]
+
+def recompute_allocation_pct(session, dates):
+    """
+    Refreshes allocation_totals and allocation_pct for the given dates only,
+    and clears them from allocation_dirty_dates in the same transaction.
+    Totals and constituent counts are re-aggregated per touched date, and
+    allocation rows are only rewritten when their rounded pct actually changes.
+    Returns:
+        The number of allocation rows updated.
+    """
+    params = {"dates": sorted(dates)}
+    session.execute(text("""
+        INSERT INTO allocation_totals (allocation_date, total_market_cap, constituent_count, updated_at)
+        SELECT allocation_date, SUM(market_cap_usd), COUNT(*), NOW()
+        FROM allocations
+        WHERE allocation_date = ANY(:dates)
+        GROUP BY allocation_date
+        ON CONFLICT (allocation_date) DO UPDATE
+        SET total_market_cap = EXCLUDED.total_market_cap,
+            constituent_count = EXCLUDED.constituent_count,
+            updated_at = NOW()
+        WHERE allocation_totals.total_market_cap IS DISTINCT FROM EXCLUDED.total_market_cap
+           OR allocation_totals.constituent_count IS DISTINCT FROM EXCLUDED.constituent_count;
+    """), params)
+    result = session.execute(text("""
+        UPDATE allocations AS a
+        SET allocation_pct = ROUND(a.market_cap_usd::numeric / t.total_market_cap, 6)
+        FROM allocation_totals AS t
+        WHERE a.allocation_date = t.allocation_date
+          AND t.allocation_date = ANY(:dates)
+          AND t.total_market_cap > 0
+          AND a.allocation_pct IS DISTINCT FROM ROUND(a.market_cap_usd::numeric / t.total_market_cap, 6);
+    """), params)
+    session.execute(text("DELETE FROM allocation_dirty_dates WHERE allocation_date = ANY(:dates)"), params)
+    return result.rowcount
+
+def refresh_allocation_pct(session, label):
+    """Recomputes every pending date and commits; returns how many dates were pending."""
+    dates = pending_allocation_dates(session)
+    print(f"\n🔢 Calculating allocation_pct for {len(dates)} {label} allocation dates …")
+    if dates:
+        updated_rows = recompute_allocation_pct(session, dates)
+        bump_data_version(session)
+        session.commit()
+        print(f"✅ allocation_pct updated for {updated_rows} rows.")
+    return len(dates)
+
+def fetch_and_upsert_market_caps(use_copy=True, full=False):
+    """
+    Fetches daily market caps for every ticker, upserts them into `allocations`
+    and recomputes allocation_pct for the dates whose market caps changed.
+    Changed dates are recorded in allocation_dirty_dates with each ticker's
+    rows, and any left over from an interrupted run are recomputed first.
+    Args:
+        use_copy: Load each ticker's batch with COPY + one INSERT ... ON CONFLICT
+            (see bulk_load.copy_upsert). False falls back to per-row session.merge().
+        full: Re-download the whole 3-year window for every ticker. By default only
+            dates after each ticker's latest stored allocation_date (less the
+            revision overlap) are requested; new tickers get the full window.
+    """
     session = Session()
+    client = get_client()
     try:
         today = date.today()
         three_years_ago = today - timedelta(days=365 * 3)
+        to_date_str = today.isoformat()
+
+        # Dates an interrupted run changed but never recomputed
+        refresh_allocation_pct(session, "pending")
 
         # Get all tickers from the database
         tickers = [t[0] for t in session.query(Ticker.ticker).all()]
+        watermarks = {} if full else load_watermarks(session, "allocations", "ticker", "allocation_date")
+        from_dates = {
+            symbol: fetch_start(watermarks.get(symbol), three_years_ago).isoformat()
+            for symbol in tickers
+        }
+        print(f"Incremental windows for {len(watermarks)} tickers, full backfill for "
+              f"{len(tickers) - len(watermarks)}.")
         total_upserts = 0
         skipped_tickers = 0
-        print(f"Found {len(tickers)} tickers to process for historical market cap data.")
-
-        for idx, symbol in enumerate(tickers, start=1):
-            from_date_str = three_years_ago.isoformat()
-            to_date_str = today.isoformat()
-            url = (
-                f"https://financialmodelingprep.com/api/v3/"
-                f"historical-market-capitalization/{symbol}"
-                f"?from={from_date_str}&to={to_date_str}&apikey={FMP_API_KEY}"
-            )
+        write_seconds = 0.0
+        print(f"Found {len(tickers)} tickers to process for historical market cap data "
+              f"({'COPY' if use_copy else 'merge'} load).")
 
+        results = client.map_tickers(fetch_market_caps, tickers, from_dates, to_date_str)
+        for idx, (symbol, future) in enumerate(results, start=1):
             print(f"\nProcessing {idx}/{len(tickers)}: {symbol}")
-            print(f"  Fetching market caps from {from_date_str} to {to_date_str}...")
             try:
-                resp = requests.get(url)
-                time.sleep(API_REQUEST_DELAY)
-                resp.raise_for_status()
-                data = resp.json()
+                data = future.result()
 
                 if not isinstance(data, list):
                     print(f"  Unexpected JSON for {symbol}: {type(data)}. Skipping.")
@@ -84,7 +159,7 @@ def fetch_and_upsert_market_caps():
                     print(f"  No data returned for {symbol}.")
                     continue
 
-                upserts_for_ticker = 0
+                rows = []
                 for record in data:
                     date_str = record.get("date")
                     mc = record.get("marketCap")
@@ -92,19 +167,40 @@ def fetch_and_upsert_market_caps():
                         continue
                     try:
                         rec_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                        entry = HistoricalAllocation(
-                            ticker=symbol,
-                            allocation_date=rec_date,
-                            market_cap_usd=int(mc),
-                            allocation_pct=Decimal("0.000000"),  # placeholder
-                            source="FMP Historical Market Cap",
-                        )
-                        session.merge(entry)
-                        upserts_for_ticker += 1
+                        rows.append((
+                            symbol,
+                            rec_date,
+                            int(mc),
+                            Decimal("0.000000"),  # placeholder for new rows, set by the recompute
+                            "FMP Historical Market Cap",
+                        ))
                     except Exception as e:
                         print(f"    Error on record {record}: {e}")
 
+                started = time.perf_counter()
+                if use_copy:
+                    # Unchanged market caps are not rewritten, so only new or
+                    # revised rows come back as touched dates. Existing rows
+                    # keep their allocation_pct until the recompute.
+                    changed_dates = copy_upsert(
+                        session, "allocations", ALLOCATION_COLUMNS, rows, ["ticker", "allocation_date"],
+                        guard_columns=["market_cap_usd"], returning="allocation_date",
+                        insert_only=["allocation_pct"],
+                    )
+                else:
+                    for row in rows:
+                        values = dict(zip(ALLOCATION_COLUMNS, row))
+                        existing = session.get(HistoricalAllocation, (symbol, values["allocation_date"]))
+                        if existing is not None:
+                            values["allocation_pct"] = existing.allocation_pct
+                        session.merge(HistoricalAllocation(**values))
+                    changed_dates = [row[1] for row in rows]
+                # data_version is bumped once, by the recompute that makes
+                # these rows' allocation_pct valid
+                mark_dirty(session, changed_dates)
                 session.commit()
+                upserts_for_ticker = len(changed_dates)
+                write_seconds += time.perf_counter() - started
                 print(f"  Upserted {upserts_for_ticker} records for {symbol}.")
                 total_upserts += upserts_for_ticker
 
@@ -113,22 +209,12 @@ def fetch_and_upsert_market_caps():
                 skipped_tickers += 1
                 session.rollback()
 
-        # ─── Compute allocation_pct for each date ───────────────────────────────
-        print("\n🔢 Calculating allocation_pct for each allocation_date …")
-        session.execute(text("""
-            UPDATE allocations AS a
-            SET allocation_pct = (a.market_cap_usd::numeric) / totals.total_mc
-            FROM (
-              SELECT allocation_date, SUM(market_cap_usd) AS total_mc
-              FROM allocations
-              GROUP BY allocation_date
-            ) AS totals
-            WHERE a.allocation_date = totals.allocation_date;
-        """))
-        session.commit()
-        print("✅ allocation_pct updated for all dates.")
+        # ─── Compute allocation_pct for touched dates ───────────────────────────
+        refresh_allocation_pct(session, "touched")
 
         print(f"\n🏁 Finished. Total upserted: {total_upserts}, Skipped: {skipped_tickers}")
+        if write_seconds > 0:
+            print(f"   DB write time: {write_seconds:.2f}s ({total_upserts / write_seconds:,.0f} rows/sec)")
 
     except Exception as e:
         print(f"❌ Fatal error: {e}")
@@ -138,6 +224,12 @@ def fetch_and_upsert_market_caps():
         session.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch historical market caps and recompute allocations.")
+    parser.add_argument("--merge", action="store_true",
+                        help="use the per-row session.merge() path instead of COPY")
+    parser.add_argument("--full", action="store_true",
+                        help="re-download the full 3-year window instead of fetching incrementally")
+    args = parser.parse_args()
     print("🚀 Starting historical market cap fetch …")
-    fetch_and_upsert_market_caps()
+    fetch_and_upsert_market_caps(use_copy=not args.merge, full=args.full)
     print("🏁 Complete.")
@@ -1,55 +1,57 @@
-import os
+import argparse
 from datetime import datetime
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
+from fmp_client import get_client
+from db import Session, reflect_metadata
+from bulk_load import guarded_upsert, upsert_outcome
+from run_ledger import RunLedger
 import requests
-import time
+from collections import Counter
 
-# Load environment variables
-load_dotenv(override=True)
-FMP_API_KEY = os.getenv('FMP_API_KEY')
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-if not FMP_API_KEY or not DATABASE_URL:
-    raise ValueError("FMP_API_KEY and DATABASE_URL must be set in .env file")
-
-# Create SQLAlchemy base and engine
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-metadata = MetaData()
-metadata.reflect(bind=engine)
+# Reflect the shared engine's schema
+metadata = reflect_metadata()
 
 tickers_table = metadata.tables['tickers']
 key_metrics_table = metadata.tables['key_metrics']
 
-API_REQUEST_DELAY = 0.21  # seconds (for ~285 requests per minute)
-
-def fetch_and_upsert_metrics():
+def fetch_metrics(ticker):
+    print(f"  Fetching key metrics for {ticker}...")
+    return get_client().get_json(f"api/v3/key-metrics/{ticker}", period='annual', limit=3)
+
+def fetch_and_upsert_metrics(resume=False):
+    """
+    Upserts the last 3 annual key-metrics entries of every ticker, committing
+    in batches as tickers complete (see run_ledger.RunLedger).
+    Args:
+        resume: When run on its own, continue the last unfinished run and
+            skip the tickers it already completed.
+    """
     session = Session()
-    inserted = updated = skipped = 0
+    client = get_client()
+    counts = Counter()
+    skipped = 0
     try:
+        # /api/screen serves these rows from the backend's response cache, so each
+        # batch that changes rows bumps data_version as it commits
+        ledger = RunLedger(session, "metrics", resume, outcomes=counts)
         # Get all tickers from the tickers table
-        ticker_symbols = [t[0] for t in session.query(tickers_table.c.ticker).all()]
+        ticker_symbols = ledger.pending([t[0] for t in session.query(tickers_table.c.ticker).all()])
         total_tickers = len(ticker_symbols)
         print(f"Found {total_tickers} tickers in DB to process for key metrics.")
 
-        for idx, ticker in enumerate(ticker_symbols):
+        results = client.map_tickers(fetch_metrics, ticker_symbols)
+        for idx, (ticker, future) in enumerate(results):
             print(f"\nProcessing Ticker {idx + 1}/{total_tickers}: {ticker}")
             items_processed_for_ticker = 0
+            ledger.start(ticker)
+            status = "done"
+            ticker_counts = Counter()
             try:
-                url = f"https://financialmodelingprep.com/api/v3/key-metrics/{ticker}?period=annual&limit=3&apikey={FMP_API_KEY}"
-                print(f"  Fetching key metrics for {ticker}...")
-                response = requests.get(url)
-                time.sleep(API_REQUEST_DELAY)  # Respect API rate limit
-                response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-
-                metrics_data = response.json()
+                metrics_data = future.result() # Raises HTTPError for bad responses (4xx or 5xx)
 
                 if not isinstance(metrics_data, list) or not metrics_data:
                     print(f"  -> No metrics data returned or invalid format for {ticker}.")
                     skipped += 1
+                    status = "no_data"
                     continue
 
                 print(f"  -> Processing {len(metrics_data)} metric entries for {ticker}.")
@@ -60,21 +62,12 @@ def fetch_and_upsert_metrics():
                         continue
                     date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
 
-                    stmt = insert(key_metrics_table).values(
-                        ticker=ticker,
-                        date=date_obj,
-                        metrics=entry  # Store the whole JSON entry
-                    ).on_conflict_do_update(
-                        index_elements=['ticker', 'date'], # Primary key columns
-                        set_={'metrics': entry} # Column to update on conflict
+                    stmt = guarded_upsert(
+                        key_metrics_table,
+                        {'ticker': ticker, 'date': date_obj, 'metrics': entry},  # Store the whole JSON entry
+                        ['ticker', 'date'],
                     )
-                    res = session.execute(stmt)
-
-                    if res.rowcount == 1: # Row was affected (inserted or updated)
-                        inserted += 1 # As per fetch_stock_news, this counts an affected row.
-                                      # A more precise insert/update count would need res.inserted_primary_key
-                    else: # rowcount == 0 (e.g. conflict, but DO UPDATE conditions not met or DO NOTHING)
-                        updated += 1
+                    ticker_counts[upsert_outcome(session.execute(stmt))] += 1
                     items_processed_for_ticker +=1
                 
                 if items_processed_for_ticker > 0:
@@ -87,16 +80,23 @@ def fetch_and_upsert_metrics():
             except requests.exceptions.HTTPError as http_err:
                 print(f"  -> HTTP error fetching metrics for {ticker}: {http_err}")
                 skipped += 1
+                status = "failed"
             except requests.exceptions.RequestException as req_err: # Catch other request-related errors
                 print(f"  -> Request error fetching metrics for {ticker}: {req_err}")
                 skipped += 1
+                status = "failed"
             except Exception as e: # Catch any other error during this ticker's processing
                 print(f"  -> Error processing metrics for {ticker}: {e}")
                 skipped += 1 # Count this ticker as skipped
-                continue
+                status = "failed"
+            finally:
+                if status != "failed":  # a failed ticker's writes are rolled back, so not counted
+                    counts.update(ticker_counts)
+                ledger.finish(ticker, status) # Commits every LEDGER_COMMIT_EVERY tickers
 
-        session.commit() # Commit once after processing all tickers
-        print(f"\n✅ Key metrics processing complete: Inserted/Updated={inserted}, Potentially Re-updated={updated}, Skipped Tickers={skipped}")
+        ledger.close()
+        print(f"\n✅ Key metrics processing complete: Inserted={counts['inserted']}, Updated={counts['updated']}, "
+              f"Unchanged={counts['unchanged']}, Skipped Tickers={skipped}")
 
     except Exception as e:
         print(f"❌ An error occurred during the metrics fetching process: {str(e)}")
@@ -106,4 +106,8 @@ def fetch_and_upsert_metrics():
         session.close()
 
 if __name__ == "__main__":
-    fetch_and_upsert_metrics()
+    parser = argparse.ArgumentParser(description="Fetch and upsert key metrics.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last unfinished run, skipping tickers it completed")
+    args = parser.parse_args()
+    fetch_and_upsert_metrics(resume=args.resume)
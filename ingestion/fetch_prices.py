@@ -1,26 +1,24 @@
 import os
-from datetime import date, timedelta, datetime
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, String, Date, Numeric, BigInteger
-from sqlalchemy.orm import declarative_base, sessionmaker
+import argparse
+import queue
+import threading
 import time
-import requests
+from collections import deque
+from datetime import date, timedelta
+from itertools import islice
+from dotenv import load_dotenv
+from sqlalchemy import Column, String, Date, Numeric, BigInteger
+from sqlalchemy.orm import declarative_base
+from fmp_client import get_client, iter_items
+from db import Session
+from bulk_load import copy_upsert
+from watermarks import load_watermarks, fetch_start
 
 # Load environment variables
 load_dotenv(override=True)
-FMP_API_KEY  = os.getenv('FMP_API_KEY')
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-if not FMP_API_KEY or not DATABASE_URL:
-    raise ValueError("FMP_API_KEY and DATABASE_URL must be set in .env file")
-
-# Define a delay to stay within API rate limits (e.g., FMP allows 300 req/min -> 5 req/sec -> 0.2s/req)
-API_REQUEST_DELAY = 0.21  # seconds (for ~285 requests per minute)
 
 # SQLAlchemy setup
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
 
 # ORM model for prices table
 class Price(Base):
@@ -38,84 +36,185 @@ class Ticker(Base):
     __tablename__ = 'tickers'
     ticker = Column(String(10), primary_key=True)
 
-def fetch_and_upsert_prices():
+PRICE_COLUMNS = ['ticker', 'price_date', 'open_price', 'high_price', 'low_price', 'close_price', 'volume']
+# Rows per batch handed from the parser to the writer, batches a ticker may
+# parse ahead of the writer, and tickers downloaded ahead of the one being
+# written; together they bound memory however many tickers and days there are
+PRICE_BATCH_ROWS = int(os.getenv('PRICE_BATCH_ROWS', '2000'))
+PRICE_QUEUE_BATCHES = 2
+PRICE_TICKERS_AHEAD = int(os.getenv('PRICE_TICKERS_AHEAD', '16'))
+
+def fetch_prices(symbol, from_dates, to_date_str, batches, stop):
+    """
+    Streams a ticker's price history and puts it on `batches` as rows of
+    PRICE_BATCH_ROWS, parsed incrementally from the response, then puts None
+    (or the exception that ended the download). Blocks while the queue is
+    full, so at most PRICE_QUEUE_BATCHES batches per ticker are held ahead
+    of the writer; gives up once `stop` is set.
+    """
+    # Using /api/v3/historical-price-full/ which is documented to support from/to
+    from_date_str = from_dates[symbol]
+    print(f"\nFetching prices for {symbol} (from {from_date_str} to {to_date_str})...")
+    try:
+        with get_client().stream(
+            f"api/v3/historical-price-full/{symbol}",
+            **{'from': from_date_str, 'to': to_date_str}
+        ) as body:
+            # FMP returns {"symbol": "XYZ", "historical": [...]} (or, rarely, a bare list)
+            records = iter_items(body, 'historical')
+            while batch := list(islice(records, PRICE_BATCH_ROWS)):
+                if not _put(batches, normalize_prices(symbol, batch), stop):
+                    return
+        _put(batches, None, stop)
+    except Exception as e:
+        _put(batches, e, stop)
+
+
+def _put(batches, item, stop):
+    """Queues an item for the writer, or returns False if the run was stopped."""
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def normalize_prices(symbol, records):
+    """
+    Converts a batch of raw price records to PRICE_COLUMNS rows. Dates and
+    volumes are converted for the whole batch at once; if that fails, the
+    batch is converted record by record, and records with a missing or
+    malformed field are logged and dropped.
+    """
+    try:
+        days = list(map(date.fromisoformat, [record.get('date') for record in records]))
+        # FMP 'historical-price-full' uses 'volume'
+        volumes = [int(v) if v is not None else None for v in (record.get('volume') for record in records)]
+    except (TypeError, ValueError, ArithmeticError):
+        return [row for row in (_normalize_price(symbol, record) for record in records) if row is not None]
+    return [
+        # Use the symbol from the outer loop, as 'historical' items might not have it
+        (symbol, day, record.get('open'), record.get('high'), record.get('low'), record.get('close'), volume)
+        for day, record, volume in zip(days, records, volumes)
+    ]
+
+
+def _normalize_price(symbol, record):
+    """One record's PRICE_COLUMNS row, or None (logged) if it cannot be converted."""
+    try:
+        volume = record.get('volume')
+        return (
+            symbol, date.fromisoformat(record.get('date')),
+            record.get('open'), record.get('high'), record.get('low'), record.get('close'),
+            int(volume) if volume is not None else None,
+        )
+    except (TypeError, ValueError, ArithmeticError) as e:
+        print(f"    Skipping price record for {symbol} ({e}): {record}")
+        return None
+
+
+def fetch_and_upsert_prices(use_copy=True, full=False):
+    """
+    Fetches daily prices for every ticker and upserts them into `prices`.
+    Each ticker's history is streamed, parsed and written in batches of
+    PRICE_BATCH_ROWS while the next PRICE_TICKERS_AHEAD tickers are still
+    downloading, and is committed once all of its batches are written, so
+    memory stays bounded however many tickers and days there are.
+    Args:
+        use_copy: Load each batch with COPY + one INSERT ... ON CONFLICT
+            (see bulk_load.copy_upsert). False falls back to per-row session.merge().
+        full: Re-download the whole 3-year window for every ticker. By default only
+            dates after each ticker's latest stored price_date (less the revision
+            overlap) are requested; tickers with no prices get the full window.
+    """
     session = Session()
+    client = get_client()
+    stop = threading.Event()
+    futures = []
     try:
         today = date.today()
         three_years_ago = today - timedelta(days=365*3)
+        to_date_str = today.isoformat()
 
         # Get all tickers from the database
         tickers = [t[0] for t in session.query(Ticker.ticker).all()]
+        watermarks = {} if full else load_watermarks(session, 'prices', 'ticker', 'price_date')
+        # Format dates for the API query
+        from_dates = {
+            symbol: fetch_start(watermarks.get(symbol), three_years_ago).isoformat()
+            for symbol in tickers
+        }
+        print(f"Incremental windows for {len(watermarks)} tickers, full backfill for "
+              f"{len(tickers) - len(watermarks)}.")
         total_upserts = 0
-        print(f"Found {len(tickers)} tickers to process for price data.")
-
-        for symbol in tickers:
-            # Format dates for the API query
-            from_date_str = three_years_ago.isoformat()
-            to_date_str = today.isoformat()
-
-            # Updated URL to fetch only the required date range
-            # Using /api/v3/historical-price-full/ which is documented to support from/to
-            url = f"https://financialmodelingprep.com/api/v3/historical-price-full/{symbol}?from={from_date_str}&to={to_date_str}&apikey={FMP_API_KEY}"
-
-            print(f"\nFetching prices for {symbol} (from {from_date_str} to {to_date_str})...")
-            response = requests.get(url)
-            time.sleep(API_REQUEST_DELAY) # Respect API rate limit
-            response.raise_for_status()
-
-            print(f"  Parsing JSON response for {symbol}...")
-            data_response = response.json()
-            print(f"  Finished parsing JSON for {symbol}.")
-
-            # FMP API for single symbol history usually returns: {"symbol": "XYZ", "historical": [...]}
-            if isinstance(data_response, dict) and 'historical' in data_response:
-                historical_data = data_response['historical']
-            elif isinstance(data_response, list): # Fallback if it's a direct list (less common for single symbol with date range)
-                historical_data = data_response
-            else:
-                print(f"  Unexpected JSON structure for {symbol}: {type(data_response)}. Skipping.")
-                continue
-
-            if not historical_data:
+        write_seconds = 0.0
+        print(f"Found {len(tickers)} tickers to process for price data ({'COPY' if use_copy else 'merge'} load).")
+
+        # Tickers are written in the order they were submitted, which is the
+        # order the worker pool starts them in, so the ticker being written
+        # is always downloading while up to PRICE_TICKERS_AHEAD later ones
+        # parse ahead of it; the next ticker is submitted as one is taken
+        remaining = iter(tickers)
+        window = deque()
+
+        def submit_next():
+            symbol = next(remaining, None)
+            if symbol is not None:
+                batches = queue.Queue(maxsize=PRICE_QUEUE_BATCHES)
+                futures.append(client.submit(fetch_prices, symbol, from_dates, to_date_str, batches, stop))
+                window.append((symbol, batches))
+
+        for _ in range(PRICE_TICKERS_AHEAD):
+            submit_next()
+        while window:
+            symbol, batches = window.popleft()
+            submit_next()
+            records = upserts = 0
+            while (batch := batches.get()) is not None:
+                if isinstance(batch, Exception):
+                    raise batch
+                started = time.perf_counter()
+                if use_copy:
+                    # The revision overlap is re-fetched every run; only rows whose
+                    # prices actually changed are rewritten (and counted)
+                    upserts += copy_upsert(session, 'prices', PRICE_COLUMNS, batch, ['ticker', 'price_date'],
+                                           guard_columns=PRICE_COLUMNS[2:])
+                else:
+                    for row in batch:
+                        session.merge(Price(**dict(zip(PRICE_COLUMNS, row))))
+                    upserts += len(batch)
+                write_seconds += time.perf_counter() - started
+                records += len(batch)
+
+            if not records:
                 print(f"  No historical price data returned for {symbol} in the date range.")
                 continue
-
-            print(f"  Processing {len(historical_data)} price records for {symbol}...")
-            upserts = 0
-            for record_idx, record in enumerate(historical_data):
-                # parse the record date
-                record_date_str = record.get('date')
-                if not record_date_str:
-                    print(f"    Skipping record for {symbol} (index {record_idx}) due to missing date: {record}")
-                    continue
-                try:
-                    record_date = datetime.strptime(record_date_str, '%Y-%m-%d').date()
-                    price = Price(
-                        ticker      = symbol, # Use the symbol from the outer loop, as 'historical' items might not have it
-                        price_date  = record_date,
-                        open_price  = record.get('open'),
-                        high_price  = record.get('high'),
-                        low_price   = record.get('low'),
-                        close_price = record.get('close'),
-                        volume      = record.get('volume') # FMP 'historical-price-full' uses 'volume'
-                    )
-                    session.merge(price)
-                    upserts += 1
-                except Exception as e:
-                    print(f"    Error processing record for {symbol} on {record_date_str} (index {record_idx}): {e}")
-
+            started = time.perf_counter()
             session.commit() # Commit after processing all records for the current ticker
-            print(f"  {symbol}: Upserted and committed {upserts} price records.")
+            write_seconds += time.perf_counter() - started
+            print(f"  {symbol}: Upserted and committed {upserts} of {records} price records.")
             total_upserts += upserts
 
-        # session.commit() # Final commit is redundant if committing per ticker
         print(f"\n✅ Finished processing all tickers. Total price records upserted: {total_upserts}")
+        if write_seconds > 0:
+            print(f"   DB write time: {write_seconds:.2f}s ({total_upserts / write_seconds:,.0f} rows/sec)")
     except Exception as e:
         print(f"Error: {e}")
         session.rollback()
         raise
     finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
         session.close()
 
 if __name__ == "__main__":
-    fetch_and_upsert_prices()
+    parser = argparse.ArgumentParser(description="Fetch and upsert daily prices.")
+    parser.add_argument("--merge", action="store_true",
+                        help="use the per-row session.merge() path instead of COPY")
+    parser.add_argument("--full", action="store_true",
+                        help="re-download the full 3-year window instead of fetching incrementally")
+    args = parser.parse_args()
+    fetch_and_upsert_prices(use_copy=not args.merge, full=args.full)
@@ -1,92 +1,94 @@
-import os
+import argparse
 from datetime import date
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
+from fmp_client import get_client
+from db import Session, reflect_metadata
+from bulk_load import guarded_upsert, upsert_outcome
+from run_ledger import RunLedger
 import requests
-import time
-
-# Load environment variables
-load_dotenv(override=True)
-FMP_API_KEY = os.getenv('FMP_API_KEY')
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-if not FMP_API_KEY or not DATABASE_URL:
-    raise ValueError("FMP_API_KEY and DATABASE_URL must be set in .env file")
+from collections import Counter
 
 # SQLAlchemy setup
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-metadata = MetaData()
-metadata.reflect(bind=engine)
+metadata = reflect_metadata()
 
 tickers_table = metadata.tables['tickers']
 profiles_table = metadata.tables['profiles']
 
-API_REQUEST_DELAY = 0.21  # seconds (for ~285 requests per minute)
+def fetch_profiles(tickers):
+    # The profile endpoint accepts a comma-separated list of symbols
+    print(f"  Fetching profiles for {', '.join(tickers)}...")
+    return get_client().get_json(f"api/v3/profile/{','.join(tickers)}")
 
-def fetch_and_upsert_profiles():
+def fetch_and_upsert_profiles(resume=False):
+    """
+    Upserts every ticker's company profile, committing in batches as tickers
+    complete (see run_ledger.RunLedger).
+    Args:
+        resume: When run on its own, continue the last unfinished run and
+            skip the tickers it already completed.
+    """
     session = Session()
+    client = get_client()
     today = date.today()
-    inserted = updated = skipped = 0
+    counts = Counter()
+    skipped = 0
     try:
+        # /api/screen serves these rows from the backend's response cache, so each
+        # batch that changes rows bumps data_version as it commits
+        ledger = RunLedger(session, "profiles", resume, outcomes=counts)
         # Get all tickers from the tickers table
-        ticker_symbols = [t[0] for t in session.query(tickers_table.c.ticker).all()]
+        ticker_symbols = ledger.pending([t[0] for t in session.query(tickers_table.c.ticker).all()])
         total_tickers = len(ticker_symbols)
         print(f"Found {total_tickers} tickers in DB to process for profiles.")
 
-        for idx, ticker in enumerate(ticker_symbols):
+        results = client.map_symbol_chunks(fetch_profiles, ticker_symbols)
+        for idx, (ticker, future) in enumerate(results):
             print(f"\nProcessing Ticker {idx + 1}/{total_tickers}: {ticker}")
+            ledger.start(ticker)
+            status = "done"
+            ticker_counts = Counter()
             try:
-                url = f"https://financialmodelingprep.com/api/v3/profile/{ticker}?apikey={FMP_API_KEY}"
-                print(f"  Fetching profile for {ticker}...")
-                response = requests.get(url)
-                time.sleep(API_REQUEST_DELAY)  # Respect API rate limit
-                response.raise_for_status() # Raises HTTPError for bad responses (4xx or 5xx)
-
-                profile_data_list = response.json()
+                profile_data_list = future.result() # Raises HTTPError for bad responses (4xx or 5xx)
 
                 if not isinstance(profile_data_list, list) or not profile_data_list:
                     print(f"  -> No profile data returned or invalid format for {ticker}.")
                     skipped += 1
+                    status = "no_data"
                     continue
                 
-                # The API returns a list with a single profile object
+                # One profile object per symbol
                 profile_json = profile_data_list[0]
 
-                stmt = insert(profiles_table).values(
-                    ticker=ticker,
-                    profile_data=profile_json,
-                    date_fetched=today
-                ).on_conflict_do_update(
-                    index_elements=['ticker'], # Primary key column
-                    set_={
-                        'profile_data': profile_json,
-                        'date_fetched': today
-                    }
+                # A new date_fetched alone does not count as a change; it is
+                # only refreshed along with a changed profile
+                stmt = guarded_upsert(
+                    profiles_table,
+                    {'ticker': ticker, 'profile_data': profile_json, 'date_fetched': today},
+                    ['ticker'],
+                    unguarded=['date_fetched'],
                 )
-                res = session.execute(stmt)
-
-                if res.rowcount == 1: # Row was affected (inserted or updated)
-                    inserted += 1
-                else: # rowcount == 0 (e.g. conflict, but DO UPDATE conditions not met or DO NOTHING)
-                    updated += 1
+                ticker_counts[upsert_outcome(session.execute(stmt))] += 1
                 print(f"  -> Successfully processed profile for {ticker}.")
 
             except requests.exceptions.HTTPError as http_err:
                 print(f"  -> HTTP error fetching profile for {ticker}: {http_err}")
                 skipped += 1
+                status = "failed"
             except requests.exceptions.RequestException as req_err:
                 print(f"  -> Request error fetching profile for {ticker}: {req_err}")
                 skipped += 1
+                status = "failed"
             except Exception as e:
                 print(f"  -> Error processing profile for {ticker}: {e}")
                 skipped += 1
-                continue
+                status = "failed"
+            finally:
+                if status != "failed":  # a failed ticker's writes are rolled back, so not counted
+                    counts.update(ticker_counts)
+                ledger.finish(ticker, status)
 
-        session.commit()
-        print(f"\n✅ Profile processing complete: Inserted/Updated={inserted}, Potentially Re-updated={updated}, Skipped Tickers={skipped}")
+        ledger.close()
+        print(f"\n✅ Profile processing complete: Inserted={counts['inserted']}, Updated={counts['updated']}, "
+              f"Unchanged={counts['unchanged']}, Skipped Tickers={skipped}")
 
     except Exception as e:
         print(f"❌ An error occurred during the profile fetching process: {str(e)}")
@@ -96,4 +98,8 @@ def fetch_and_upsert_profiles():
         session.close()
 
 if __name__ == "__main__":
-    fetch_and_upsert_profiles()
+    parser = argparse.ArgumentParser(description="Fetch and upsert company profiles.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last unfinished run, skipping tickers it completed")
+    args = parser.parse_args()
+    fetch_and_upsert_profiles(resume=args.resume)
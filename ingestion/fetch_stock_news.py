@@ -1,117 +1,128 @@
+import argparse
+from collections import Counter
 from datetime import date, datetime, timedelta
-import requests
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.postgresql import insert
-from dotenv import load_dotenv
-import time
-import os
-
-# Load environment (override if already set)
-load_dotenv(override=True)
-
-# Configuration
-# Define a delay to stay within API rate limits
-API_REQUEST_DELAY = 0.21  # seconds
-
-DATABASE_URL = os.getenv('DATABASE_URL')
-FMP_API_KEY  = os.getenv('FMP_API_KEY')
+from fmp_client import get_client
+from db import Session, reflect_metadata
+from bulk_load import guarded_upsert, upsert_outcome
+from run_ledger import RunLedger
 
 # SQLAlchemy setup
-engine   = create_engine(DATABASE_URL)
-Session  = sessionmaker(bind=engine)
-session  = Session()
-metadata = MetaData()
-metadata.reflect(bind=engine)
+metadata = reflect_metadata()
 
 tickers_table   = metadata.tables['tickers']
 stock_news_table = metadata.tables['stock_news']
 
-def fetch_and_upsert_stock_news():
+NEWS_LIMIT_PER_SYMBOL = 50
+
+def fetch_stock_news(tickers, start_date, today):
+    # The endpoint accepts a comma-separated list of symbols; the limit applies
+    # to the combined payload, so scale it with the chunk size.
+    print(f"Fetching stock news for {', '.join(tickers)}...")
+    data = request_stock_news(tickers, start_date, today)
+    if len(tickers) > 1 and isinstance(data, list) and len(data) >= NEWS_LIMIT_PER_SYMBOL * len(tickers):
+        # The chunk hit its combined limit, so busy tickers may have crowded
+        # out quiet ones; fetch any ticker short of its own limit alone
+        per_symbol = Counter(rec.get("symbol") for rec in data)
+        short = [t for t in tickers if per_symbol[t] < NEWS_LIMIT_PER_SYMBOL]
+        if short:
+            print(f"  -> News chunk hit its limit; re-requesting {', '.join(short)} individually.")
+            data = [rec for rec in data if rec.get("symbol") not in short]
+            for ticker in short:
+                data.extend(request_stock_news([ticker], start_date, today))
+    return data
+
+def request_stock_news(tickers, start_date, today):
+    return get_client().get_json(
+        "stable/news/stock",
+        symbols=','.join(tickers),
+        limit=NEWS_LIMIT_PER_SYMBOL * len(tickers),
+        **{'from': start_date.isoformat(), 'to': today.isoformat()}
+    ) or []
+
+def fetch_and_upsert_stock_news(resume=False):
+    """
+    Upserts up to NEWS_LIMIT_PER_SYMBOL articles per ticker since 2025,
+    committing in batches as tickers complete (see run_ledger.RunLedger).
+    Args:
+        resume: When run on its own, continue the last unfinished run and
+            skip the tickers it already completed.
+    """
     session = Session()
+    client = get_client()
     try:
         # fixed start date because API only returns since Jan 1, 2025
         start_date = date(2025, 1, 1)
         today      = date.today()
 
-        inserted = updated = skipped = 0
-        tickers = [t[0] for t in session.query(tickers_table.c.ticker).all()]
+        counts = Counter()
+        skipped = 0
+        # /api/news serves these rows from the backend's response cache, so each
+        # batch that changes rows bumps data_version as it commits
+        ledger = RunLedger(session, "news", resume, outcomes=counts)
+        tickers = ledger.pending([t[0] for t in session.query(tickers_table.c.ticker).all()])
 
-        for ticker in tickers:
-            url = (
-                f"https://financialmodelingprep.com/stable/news/stock"
-                f"?symbols={ticker}"
-                f"&from={start_date.isoformat()}"
-                f"&to={today.isoformat()}"
-                f"&limit=50"
-                f"&apikey={FMP_API_KEY}"
-            )
-            resp = requests.get(url)
-            print(f"Fetching stock news for {ticker}...")
-            time.sleep(API_REQUEST_DELAY) # Respect API rate limit
-            resp.raise_for_status()
-            data = resp.json()
-            if not isinstance(data, list) or not data:
-                skipped += 1
-                print(f"  -> No stock news data returned or invalid format for {ticker}.")
-                continue
+        for ticker, future in client.map_symbol_chunks(fetch_stock_news, tickers, start_date, today):
+            ledger.start(ticker)
+            status = "done"
+            ticker_counts = Counter()
+            try:
+                # Raises the ticker's HTTP error; it fails this ticker, not the run
+                data = future.result()[:NEWS_LIMIT_PER_SYMBOL]
+                if not data:
+                    skipped += 1
+                    status = "no_data"
+                    print(f"  -> No stock news data returned or invalid format for {ticker}.")
+                    continue
 
-            news_to_process_for_ticker = []
-            for rec in data: # Initial filter based on date string
-                pub_dt = datetime.strptime(rec["publishedDate"], "%Y-%m-%d %H:%M:%S")
-                if pub_dt.date() >= start_date:
-                    news_to_process_for_ticker.append(rec)
+                news_to_process_for_ticker = []
+                for rec in data: # Initial filter based on date string
+                    pub_dt = datetime.strptime(rec["publishedDate"], "%Y-%m-%d %H:%M:%S")
+                    if pub_dt.date() >= start_date:
+                        news_to_process_for_ticker.append(rec)
             
-            if not news_to_process_for_ticker:
-                print(f"  -> No stock news for {ticker} since {start_date} (out of {len(data)} fetched).")
-                # If you want to count this as skipped if no relevant news:
-                # skipped += 1 
-                continue
+                if not news_to_process_for_ticker:
+                    print(f"  -> No stock news for {ticker} since {start_date} (out of {len(data)} fetched).")
+                    # If you want to count this as skipped if no relevant news:
+                    # skipped += 1 
+                    status = "no_data"
+                    continue
 
-            print(f"  -> Processing {len(news_to_process_for_ticker)} news items for {ticker} since {start_date}.")
-            items_processed_for_ticker = 0
-            for rec in news_to_process_for_ticker:
-                pub_dt = datetime.strptime(rec["publishedDate"], "%Y-%m-%d %H:%M:%S")
-                # This check is redundant if already filtered, but safe
-                # if pub_dt.date() < start_date: 
-                #    continue
+                print(f"  -> Processing {len(news_to_process_for_ticker)} news items for {ticker} since {start_date}.")
+                items_processed_for_ticker = 0
+                for rec in news_to_process_for_ticker:
+                    pub_dt = datetime.strptime(rec["publishedDate"], "%Y-%m-%d %H:%M:%S")
+                    # This check is redundant if already filtered, but safe
+                    # if pub_dt.date() < start_date: 
+                    #    continue
                 
-                stmt = insert(stock_news_table).values(
-                    url            = rec["url"],
-                    symbol         = rec["symbol"],
-                    published_date = pub_dt,
-                    publisher      = rec.get("publisher"),
-                    title          = rec.get("title"),
-                    image          = rec.get("image"),
-                    site           = rec.get("site"),
-                    text           = rec.get("text"),
-                    source         = 'FMP'  # Ensure source is in the VALUES clause
-                ).on_conflict_do_update(
-                    index_elements=['url'],
-                    set_={
-                      'symbol':          rec["symbol"],
-                      'published_date':  pub_dt,
-                      'publisher':       rec.get("publisher"),
-                      'title':           rec.get("title"),
-                      'image':           rec.get("image"),
-                      'site':            rec.get("site"),
-                      'text':            rec.get("text"),
-                      'source':          'FMP'
-                    }
-                )
-
-                res = session.execute(stmt)
-                if res.rowcount == 1:
-                    inserted += 1
-                else:
-                    updated += 1
-                items_processed_for_ticker +=1
+                    stmt = guarded_upsert(stock_news_table, {
+                        'url':            rec["url"],
+                        'symbol':         rec["symbol"],
+                        'published_date': pub_dt,
+                        'publisher':      rec.get("publisher"),
+                        'title':          rec.get("title"),
+                        'image':          rec.get("image"),
+                        'site':           rec.get("site"),
+                        'text':           rec.get("text"),
+                        'source':         'FMP'
+                    }, ['url'])
+                    ticker_counts[upsert_outcome(session.execute(stmt))] += 1
+                    items_processed_for_ticker +=1
             
-            if items_processed_for_ticker > 0:
-                print(f"  -> Finished processing {items_processed_for_ticker} news items for {ticker}.")
+                if items_processed_for_ticker > 0:
+                    print(f"  -> Finished processing {items_processed_for_ticker} news items for {ticker}.")
+            except Exception as e:
+                status = "failed"  # rolls back this ticker only
+                print(f"  -> Error processing stock news for {ticker}: {e}")
+                skipped += 1
+            finally:
+                if status != "failed":  # a failed ticker's writes are rolled back, so not counted
+                    counts.update(ticker_counts)
+                ledger.finish(ticker, status)
 
-        session.commit()
-        print(f"✅ Stock news since {start_date}: Inserted={inserted}, Updated={updated}, Skipped={skipped}")
+        ledger.close()
+        print(f"✅ Stock news since {start_date}: Inserted={counts['inserted']}, Updated={counts['updated']}, "
+              f"Unchanged={counts['unchanged']}, Skipped={skipped}")
     except Exception as e:
         print(f"  -> Error during stock news processing for {ticker if 'ticker' in locals() else 'unknown ticker'}: {e}")
         session.rollback()
@@ -119,4 +130,8 @@ def fetch_and_upsert_stock_news():
     finally:
         session.close()
 if __name__ == '__main__':
-    fetch_and_upsert_stock_news()
+    parser = argparse.ArgumentParser(description="Fetch and upsert stock news.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last unfinished run, skipping tickers it completed")
+    args = parser.parse_args()
+    fetch_and_upsert_stock_news(resume=args.resume)
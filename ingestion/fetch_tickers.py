@@ -1,23 +1,12 @@
-import os
 from datetime import date
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, Column, String, Date
-from sqlalchemy.orm import declarative_base, sessionmaker
-import time # Though not used for sleep here, good practice if other calls were added
+from sqlalchemy import Column, String, Date
+from sqlalchemy.orm import declarative_base
+from fmp_client import get_client
+from db import Session
 import requests
 
-# Load environment variables
-load_dotenv(override=True)
-FMP_API_KEY = os.getenv('FMP_API_KEY')
-DATABASE_URL = os.getenv('DATABASE_URL')
-
-if not FMP_API_KEY or not DATABASE_URL:
-    raise ValueError("FMP_API_KEY and DATABASE_URL must be set in .env file")
-
-# Create SQLAlchemy base and engine
+# Create SQLAlchemy base
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
 
 # Define Ticker model
 class Ticker(Base):
@@ -35,13 +24,10 @@ def fetch_and_upsert_tickers():
     
     try:
         # Fetch data from FMP API
-        url = f"https://financialmodelingprep.com/api/v3/sp500_constituent?apikey={FMP_API_KEY}"
         print(f"Fetching S&P 500 constituents list from API...")
-        response = requests.get(url)
-        response.raise_for_status()
         
         # Get data for all S&P 500 constituents
-        tickers_data = response.json()
+        tickers_data = get_client().get_json("api/v3/sp500_constituent")
         
         # Track changes
         updated_count = 0
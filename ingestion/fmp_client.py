@@ -0,0 +1,422 @@
+import atexit
+import io
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from decimal import Decimal
+from email.utils import parsedate_to_datetime
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+import requests
+from response_cache import ResponseCache, CacheMiss
+
+try:
+    import ijson
+except ImportError:  # streaming JSON parsing is optional
+    ijson = None
+
+# Load environment variables
+load_dotenv(override=True)
+FMP_API_KEY = os.getenv('FMP_API_KEY')
+FMP_BASE_URL = os.getenv('FMP_BASE_URL', 'https://financialmodelingprep.com')
+
+# Starting request rate and the ceiling the rate controller may probe up to
+# (FMP plans allow 300 to 3000 requests per minute); the real quota of the
+# key is found at run time. FMP_MAX_IN_FLIGHT bounds concurrent requests.
+FMP_REQUESTS_PER_MINUTE = int(os.getenv('FMP_REQUESTS_PER_MINUTE', '300'))
+FMP_MAX_REQUESTS_PER_MINUTE = int(os.getenv('FMP_MAX_REQUESTS_PER_MINUTE', '3000'))
+FMP_MAX_IN_FLIGHT = int(os.getenv('FMP_MAX_IN_FLIGHT', '16'))
+# Retries of throttled, failed (5xx) or timed-out requests: per request, and
+# in total per run so a struggling API cannot stretch a run indefinitely
+FMP_MAX_RETRIES = int(os.getenv('FMP_MAX_RETRIES', '5'))
+FMP_RETRY_BUDGET = int(os.getenv('FMP_RETRY_BUDGET', '500'))
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30
+# AIMD tuning: requests/minute gained per second of healthy responses,
+# multiplier applied on pushback, and the floor the rate never drops below
+AIMD_INCREASE_RPM = 30
+AIMD_DECREASE = 0.5
+AIMD_MIN_RPM = 30
+# A response this many times slower than the running average (and slower
+# than the minimum) counts as a latency spike
+LATENCY_SPIKE_FACTOR = 4
+LATENCY_SPIKE_MIN_SECONDS = 1.0
+REQUEST_TIMEOUT = 30  # seconds
+# FMP_CACHE=0 disables the on-disk response cache; FMP_REPLAY=1 serves only
+# from it (any age) and never touches the network.
+FMP_CACHE = os.getenv('FMP_CACHE', '1') != '0'
+FMP_REPLAY = os.getenv('FMP_REPLAY', '0') == '1'
+# Symbols per request for endpoints that accept comma-separated symbol lists
+FMP_SYMBOL_CHUNK_SIZE = int(os.getenv('FMP_SYMBOL_CHUNK_SIZE', '25'))
+# Read size for streamed response bodies
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class RateController:
+    """
+    Adaptive (AIMD) limit on request rate and concurrency, shared by every
+    request of the client. Each healthy response raises the rate additively
+    (by AIMD_INCREASE_RPM for every second's worth of responses) and the
+    concurrency window by one per window's worth; a 429, a 5xx, a network
+    error or a latency spike cuts both by AIMD_DECREASE. Only requests sent
+    after the last cut can cut again, so a burst of errors from requests
+    that were already in flight counts as one signal. Throughput so settles
+    just under the real quota of the configured key.
+
+    A Retry-After header pauses every request until the server's deadline.
+    The token bucket holds at most one second's worth of tokens, so a burst
+    never exceeds the current per-second rate.
+    """
+
+    def __init__(self, requests_per_minute: float, max_requests_per_minute: float, max_in_flight: int):
+        self.rpm = float(min(requests_per_minute, max_requests_per_minute))
+        self.max_rpm = float(max_requests_per_minute)
+        self.window = max(1.0, max_in_flight / 2)
+        self.max_window = max_in_flight
+        self.in_flight = 0
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.last_cut = 0.0
+        self.latency = None  # EWMA of healthy response times, in seconds
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+
+    def acquire(self) -> float:
+        """
+        Blocks until the window has room, any Retry-After pause has passed and
+        a token is available. Returns the send time to pass to release().
+        """
+        with self.slot_freed:
+            while self.in_flight >= int(self.window):
+                self.slot_freed.wait()
+            self.in_flight += 1
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                rate = self.rpm / 60.0
+                self.tokens = min(max(1.0, rate), self.tokens + (now - self.updated) * rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return now
+                wait = max(self.paused_until - now, (1 - self.tokens) / rate)
+            time.sleep(wait)
+
+    def release(self, sent_at: float, congested: bool, retry_after: float = None):
+        """
+        Frees the request's window slot and adapts the limits to its outcome.
+        Args:
+            sent_at: The value acquire() returned.
+            congested: The server throttled or failed, or the request timed out.
+            retry_after: Seconds the server asked us to wait, if it said.
+        """
+        with self.slot_freed:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.slot_freed.notify()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            elapsed = now - sent_at
+            if not congested and self.latency is not None and elapsed > max(
+                    LATENCY_SPIKE_MIN_SECONDS, LATENCY_SPIKE_FACTOR * self.latency):
+                congested = True
+            if congested:
+                if sent_at >= self.last_cut:
+                    self.last_cut = now
+                    self.rpm = max(AIMD_MIN_RPM, self.rpm * AIMD_DECREASE)
+                    self.window = max(1.0, self.window * AIMD_DECREASE)
+                    print(f"  ⚠️ FMP is pushing back; rate cut to {self.rpm:.0f}/min, "
+                          f"{int(self.window)} requests in flight.")
+                return
+            self.latency = elapsed if self.latency is None else 0.9 * self.latency + 0.1 * elapsed
+            self.rpm = min(self.max_rpm, self.rpm + AIMD_INCREASE_RPM * 60.0 / self.rpm)
+            self.window = min(self.max_window, self.window + 1 / self.window)
+            self.slot_freed.notify_all()
+
+
+class FMPClient:
+    """
+    Shared client for the FMP API. All fetchers in the process go through the
+    same rate controller and the same pool of keep-alive connections, and
+    submit their per-ticker work to one thread pool of `max_in_flight`
+    workers, of which the controller's window decides how many may have a
+    request outstanding.
+    """
+
+    def __init__(self, api_key=FMP_API_KEY, base_url=FMP_BASE_URL,
+                 requests_per_minute=FMP_REQUESTS_PER_MINUTE, max_in_flight=FMP_MAX_IN_FLIGHT,
+                 cache=None, replay=False, max_requests_per_minute=FMP_MAX_REQUESTS_PER_MINUTE,
+                 retry_budget=FMP_RETRY_BUDGET):
+        self.api_key = api_key
+        self.cache = cache
+        self.replay = replay
+        self.requests_sent = 0
+        self.http_errors = 0
+        self.retries = 0
+        self.retry_budget = retry_budget
+        self.budget_exhausted = False
+        self.first_sent = None
+        self.last_done = None
+        self.stats_lock = threading.Lock()
+        self.base_url = base_url.rstrip('/')
+        self.controller = RateController(requests_per_minute, max_requests_per_minute, max_in_flight)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='fmp')
+
+    def get(self, path: str, **params) -> requests.Response:
+        """
+        Issues a rate-limited GET for an FMP path such as
+        'api/v3/profile/AAPL' or 'stable/news/stock'.
+        429s, 5xx responses and network errors are retried after the server's
+        Retry-After, or else a jittered exponential backoff, while the
+        request's and the run's retry budgets last.
+        Raises requests.HTTPError for 4xx/5xx responses that are not retried.
+        """
+        return self._send(path, params)
+
+    def _send(self, path, params, stream=False):
+        # Checked here rather than at import, so cache replays need no key
+        if not self.api_key:
+            raise ValueError("FMP_API_KEY must be set in .env file")
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        attempt = 0
+        while True:
+            sent_at = self.controller.acquire()
+            try:
+                response = self.http.get(url, params={**params, 'apikey': self.api_key},
+                                         timeout=REQUEST_TIMEOUT, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                self.controller.release(sent_at, congested=True)
+                self._record(sent_at, error=True)
+                if not self._may_retry(attempt):
+                    raise
+                retry_after = None
+            else:
+                retry_after = _retry_after(response)
+                # A Retry-After beyond our longest backoff means the quota is
+                # spent for now (e.g. a daily cap); fail rather than stall
+                congested = response.status_code == 429 or response.status_code >= 500
+                retryable = congested and (retry_after is None or retry_after <= RETRY_MAX_SECONDS)
+                retry_after = retry_after if retryable else None
+                self.controller.release(sent_at, congested=congested, retry_after=retry_after)
+                self._record(sent_at, error=response.status_code >= 400)
+                if not retryable or not self._may_retry(attempt):
+                    response.raise_for_status()
+                    return response
+                response.close()
+            attempt += 1
+            # Full jitter keeps retries from every worker from arriving together
+            delay = retry_after or random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+            time.sleep(delay)
+
+    def _record(self, sent_at, error):
+        with self.stats_lock:
+            self.requests_sent += 1
+            self.http_errors += error
+            self.first_sent = self.first_sent or sent_at
+            self.last_done = time.monotonic()
+
+    def _may_retry(self, attempt):
+        """Claims one retry from the run's budget if this request has attempts left."""
+        with self.stats_lock:
+            if attempt >= FMP_MAX_RETRIES or self.retries >= self.retry_budget:
+                if self.retries >= self.retry_budget and not self.budget_exhausted:
+                    self.budget_exhausted = True
+                    print(f"  ⚠️ FMP retry budget of {self.retry_budget} exhausted; failing requests from now on.")
+                return False
+            self.retries += 1
+            return True
+
+    def log_rate(self):
+        """Prints the request rate achieved so far and the controller's current limits."""
+        if not self.requests_sent:
+            return
+        seconds = max(self.last_done - self.first_sent, 1e-9)
+        print(f"📈 FMP: {self.requests_sent} requests in {seconds:.1f}s "
+              f"({self.requests_sent / seconds * 60:.0f}/min achieved), {self.http_errors} errors, "
+              f"{self.retries}/{self.retry_budget} retries; rate limit now {self.controller.rpm:.0f}/min, "
+              f"{int(self.controller.window)} in flight.")
+
+    def get_json(self, path: str, **params):
+        """
+        Same as get(), returning the decoded JSON body. Responses are served
+        from the on-disk cache while fresh, and stored there after a download.
+        In replay mode a cache miss raises CacheMiss instead of downloading.
+        """
+        if self.cache is not None:
+            body = self.cache.get(path, params, ignore_ttl=self.replay)
+            if body is not None:
+                return json.loads(body)
+        if self.replay:
+            raise CacheMiss(f"No cached response for {path} {params}")
+        response = self.get(path, **params)
+        if self.cache is not None:
+            self.cache.put(path, params, response.content)
+        return response.json()
+
+    @contextmanager
+    def stream(self, path: str, **params):
+        """
+        Like get_json(), but yields the response body as a binary stream to
+        be parsed incrementally (see iter_items) instead of decoding it
+        whole. A downloaded body is copied into the cache as it is read, and
+        stored once the block exits normally.
+        """
+        if self.cache is not None:
+            cached = self.cache.open(path, params, ignore_ttl=self.replay)
+            if cached is not None:
+                with cached:
+                    yield cached
+                return
+        if self.replay:
+            raise CacheMiss(f"No cached response for {path} {params}")
+        with self._send(path, params, stream=True) as response:
+            response.raw.decode_content = True
+            response.raw.auto_close = False  # lets io.BufferedReader read it to EOF
+            if self.cache is None:
+                yield response.raw
+                return
+            with self.cache.writer(path, params) as copy:
+                body = _TeeReader(response.raw, copy)
+                yield body
+                while body.read(STREAM_CHUNK_BYTES):  # cache the whole body, even if unparsed
+                    pass
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn on the shared worker pool and returns its Future."""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def map_tickers(self, fn, tickers, *args, **kwargs):
+        """
+        Runs fn(ticker, *args, **kwargs) for every ticker on the worker pool.
+        Yields (ticker, future) pairs as they complete, so the caller can
+        write results to the database from its own thread and handle errors
+        per ticker via future.result(). Work not yet started is cancelled if
+        the caller stops iterating early.
+        """
+        futures = {self.executor.submit(fn, ticker, *args, **kwargs): ticker for ticker in tickers}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def map_symbol_chunks(self, fn, tickers, *args, chunk_size=FMP_SYMBOL_CHUNK_SIZE, **kwargs):
+        """
+        Like map_tickers, for endpoints that accept several symbols per request.
+        Calls fn(symbols, *args, **kwargs) once per chunk of tickers; fn returns a
+        list of records carrying a 'symbol' key, which are split back out per
+        ticker. A chunk whose request fails is retried one ticker at a time, so a
+        bad symbol only fails its own ticker.
+        Yields (ticker, future) pairs whose result is that ticker's list of records.
+        """
+        def run_chunk(chunk):
+            try:
+                by_symbol = _split_by_symbol(chunk, fn(chunk, *args, **kwargs))
+                return {ticker: (records, None) for ticker, records in by_symbol.items()}
+            except Exception as e:
+                if len(chunk) == 1:
+                    return {chunk[0]: (None, e)}
+                print(f"  Chunk request for {len(chunk)} symbols failed ({e}); retrying one by one.")
+            results = {}
+            for ticker in chunk:
+                try:
+                    results[ticker] = (_split_by_symbol([ticker], fn([ticker], *args, **kwargs))[ticker], None)
+                except Exception as e:
+                    results[ticker] = (None, e)
+            return results
+
+        chunks = [tickers[i:i + chunk_size] for i in range(0, len(tickers), chunk_size)]
+        for _, chunk_future in self.map_tickers(run_chunk, chunks):
+            for ticker, (records, error) in chunk_future.result().items():
+                future = Future()
+                if error is None:
+                    future.set_result(records)
+                else:
+                    future.set_exception(error)
+                yield ticker, future
+
+
+class _TeeReader(io.RawIOBase):
+    """Raw stream that copies everything read from `source` into `copy`."""
+
+    def __init__(self, source, copy):
+        self.source = source
+        self.copy = copy
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.source.readinto(buffer)
+        if n:
+            self.copy.write(memoryview(buffer)[:n])
+        return n
+
+
+def iter_items(stream, key):
+    """
+    Yields the records of a JSON payload one at a time: the items of a
+    top-level array, or of the array under `key` of a top-level object (as
+    in FMP's {"symbol": ..., "historical": [...]}). With ijson installed the
+    payload is parsed incrementally, so memory stays flat however long it
+    is, and numbers come back as Decimal; without it the payload is loaded
+    whole.
+    """
+    reader = stream if hasattr(stream, 'peek') else io.BufferedReader(stream, STREAM_CHUNK_BYTES)
+    if ijson is None:
+        data = json.load(reader, parse_float=Decimal)
+        if isinstance(data, dict):
+            data = data.get(key)
+        yield from data or []
+        return
+    prefix = 'item' if reader.peek(1).lstrip()[:1] == b'[' else f'{key}.item'
+    yield from ijson.items(reader, prefix)
+
+
+def _retry_after(response):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _split_by_symbol(tickers, records):
+    """Groups a multi-symbol payload into {ticker: [records]} for the requested tickers."""
+    by_symbol = {ticker: [] for ticker in tickers}
+    for record in records if isinstance(records, list) else []:
+        if record.get('symbol') in by_symbol:
+            by_symbol[record['symbol']].append(record)
+    return by_symbol
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> FMPClient:
+    """Returns the process-wide FMP client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            cache = ResponseCache() if FMP_CACHE or FMP_REPLAY else None
+            _client = FMPClient(cache=cache, replay=FMP_REPLAY)
+            atexit.register(_client.log_rate)
+        return _client
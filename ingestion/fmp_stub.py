@@ -0,0 +1,318 @@
+"""
+Local stand-in for the FMP endpoints our fetchers call, serving deterministic
+synthetic data for N tickers x M trading days. Point FMP_BASE_URL at it to run
+ingestion without a real API key (see benchmark.py).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+SECTORS = ["Technology", "Healthcare", "Financial Services", "Energy", "Industrials", "Utilities"]
+RATINGS = ["A+", "A", "A-", "B+", "B", "B-", "C"]
+
+
+def symbols(count):
+    return [f"BM{i:04d}" for i in range(count)]
+
+
+@lru_cache(maxsize=None)
+def trading_days(days):
+    """The last `days` weekdays up to today, newest first (as FMP returns them)."""
+    result = []
+    day = date.today()
+    while len(result) < days:
+        if day.weekday() < 5:
+            result.append(day)
+        day -= timedelta(days=1)
+    return tuple(result)
+
+
+@lru_cache(maxsize=4096)
+def price_series(symbol, days):
+    """Random-walk daily bars for a symbol, seeded by its name so reruns match."""
+    rng = random.Random(symbol)
+    close = rng.uniform(20, 400)
+    shares = rng.randint(100, 5000) * 1_000_000
+    bars = []
+    for day in reversed(trading_days(days)):
+        open_ = close
+        close = max(1.0, close * (1 + rng.gauss(0, 0.02)))
+        bars.append({
+            "date": day.isoformat(),
+            "open": round(open_, 4),
+            "high": round(max(open_, close) * (1 + rng.random() * 0.01), 4),
+            "low": round(min(open_, close) * (1 - rng.random() * 0.01), 4),
+            "close": round(close, 4),
+            "volume": rng.randint(100_000, 50_000_000),
+            "marketCap": int(close * shares),
+        })
+    bars.reverse()
+    return tuple(bars)
+
+
+def in_range(day, params):
+    return params.get("from", "0000") <= day <= params.get("to", "9999")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Routes FMP paths to synthetic payloads; config lives on the server object."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency_ms:
+            time.sleep(server.latency_ms / 1000)
+        if (server.error_rate and server.rng.random() < server.error_rate) or not server.admit():
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        endpoint = "/".join(parts[:-1]) if url.path.startswith("/api/v3/") else "/".join(parts)
+        last = parts[-1]
+
+        handler = ROUTES.get(endpoint) or ROUTES.get(url.path.strip("/"))
+        if handler is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps(handler(server, last, params)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def sp500_constituent(server, _, params):
+    return [
+        {"symbol": s, "name": f"{s} Holdings Inc.", "sector": SECTORS[i % len(SECTORS)]}
+        for i, s in enumerate(symbols(server.tickers))
+    ]
+
+
+def historical_price_full(server, symbol, params):
+    bars = price_series(symbol, server.days)
+    return {
+        "symbol": symbol,
+        "historical": [
+            {k: bar[k] for k in ("date", "open", "high", "low", "close", "volume")}
+            for bar in bars if in_range(bar["date"], params)
+        ],
+    }
+
+
+def historical_market_capitalization(server, symbol, params):
+    return [
+        {"symbol": symbol, "date": bar["date"], "marketCap": bar["marketCap"]}
+        for bar in price_series(symbol, server.days) if in_range(bar["date"], params)
+    ]
+
+
+def key_metrics(server, symbol, params):
+    rng = random.Random(f"metrics-{symbol}")
+    year = date.today().year - 1
+    return [
+        {
+            "symbol": symbol,
+            "date": f"{year - i}-12-31",
+            "calendarYear": str(year - i),
+            "period": "FY",
+            "marketCap": price_series(symbol, server.days)[0]["marketCap"],
+            "peRatio": round(rng.uniform(5, 60), 4),
+            "pbRatio": round(rng.uniform(0.5, 20), 4),
+            "debtToEquity": round(rng.uniform(0, 3), 4),
+            "dividendYield": round(rng.uniform(0, 0.06), 4),
+            "roe": round(rng.uniform(-0.2, 0.6), 4),
+            "currentRatio": round(rng.uniform(0.5, 4), 4),
+            "enterpriseValueOverEBITDA": round(rng.uniform(3, 40), 4),
+            "freeCashFlowYield": round(rng.uniform(-0.05, 0.1), 4),
+        }
+        for i in range(int(params.get("limit", 3)))
+    ]
+
+
+def profile(server, symbol_list, params):
+    result = []
+    for symbol in symbol_list.split(","):
+        rng = random.Random(f"profile-{symbol}")
+        latest = price_series(symbol, server.days)[0]
+        result.append({
+            "symbol": symbol,
+            "companyName": f"{symbol} Holdings Inc.",
+            "price": latest["close"],
+            "mktCap": latest["marketCap"],
+            "beta": round(rng.uniform(0.3, 2.5), 2),
+            "volAvg": latest["volume"],
+            "lastDiv": round(rng.uniform(0, 4), 2),
+            "sector": SECTORS[rng.randrange(len(SECTORS))],
+            "industry": "Synthetic",
+            "country": "US",
+            "exchangeShortName": "NASDAQ",
+            "fullTimeEmployees": str(rng.randint(100, 200_000)),
+            "ipoDate": "2000-01-03",
+            "description": f"{symbol} is a synthetic company served by the FMP stub.",
+        })
+    return result
+
+
+def ratings_snapshot(server, _, params):
+    symbol = params["symbol"]
+    rng = random.Random(f"rating-{symbol}-{date.today()}")
+    scores = {k: rng.randint(1, 5) for k in (
+        "overallScore", "discountedCashFlowScore", "returnOnEquityScore", "returnOnAssetsScore",
+        "debtToEquityScore", "priceToEarningsScore", "priceToBookScore",
+    )}
+    return [{"symbol": symbol, "rating": RATINGS[rng.randrange(len(RATINGS))], **scores}]
+
+
+def analyst_estimates(server, _, params):
+    symbol = params["symbol"]
+    rng = random.Random(f"estimates-{symbol}")
+    year = date.today().year + 2
+    records = []
+    for i in range(10):
+        revenue = rng.randint(1, 400) * 1_000_000_000
+        eps = round(rng.uniform(-2, 15), 4)
+        records.append({
+            "symbol": symbol,
+            "date": f"{year - i}-12-31",
+            "revenueLow": int(revenue * 0.9), "revenueHigh": int(revenue * 1.1), "revenueAvg": revenue,
+            "ebitdaLow": revenue // 6, "ebitdaHigh": revenue // 4, "ebitdaAvg": revenue // 5,
+            "ebitLow": revenue // 8, "ebitHigh": revenue // 6, "ebitAvg": revenue // 7,
+            "netIncomeLow": revenue // 12, "netIncomeHigh": revenue // 8, "netIncomeAvg": revenue // 10,
+            "sgaExpenseLow": revenue // 20, "sgaExpenseHigh": revenue // 15, "sgaExpenseAvg": revenue // 18,
+            "epsAvg": eps, "epsHigh": round(eps * 1.1, 4), "epsLow": round(eps * 0.9, 4),
+            "numAnalystsRevenue": rng.randint(1, 40), "numAnalystsEps": rng.randint(1, 40),
+        })
+    page, limit = int(params.get("page", 0)), int(params.get("limit", 10))
+    return records[page * limit:(page + 1) * limit]
+
+
+def grades_historical(server, _, params):
+    symbol = params["symbol"]
+    rng = random.Random(f"grades-{symbol}")
+    return [
+        {
+            "symbol": symbol,
+            "date": day.isoformat(),
+            "analystRatingsBuy": rng.randint(0, 30),
+            "analystRatingsHold": rng.randint(0, 20),
+            "analystRatingsSell": rng.randint(0, 5),
+            "analystRatingsStrongSell": rng.randint(0, 2),
+        }
+        for day in trading_days(server.days)[::21]  # roughly monthly
+    ]
+
+
+def news_stock(server, _, params):
+    articles = []
+    for symbol in params["symbols"].split(","):
+        for i, day in enumerate(trading_days(server.days)[:server.news_per_ticker]):
+            published = datetime.combine(day, datetime.min.time()) + timedelta(hours=9 + i % 8)
+            articles.append({
+                "symbol": symbol,
+                "publishedDate": published.strftime("%Y-%m-%d %H:%M:%S"),
+                "publisher": "Stub Wire",
+                "title": f"{symbol} update {i}: earnings, guidance and sector outlook",
+                "image": None,
+                "site": "example.com",
+                "text": f"Synthetic article {i} about {symbol} revenue growth, margins and analyst ratings.",
+                "url": f"https://example.com/{symbol}/{day.isoformat()}/{i}",
+            })
+    articles = [a for a in articles if in_range(a["publishedDate"][:10], params)]
+    articles.sort(key=lambda a: a["publishedDate"], reverse=True)
+    return articles[:int(params.get("limit", len(articles)))]
+
+
+ROUTES = {
+    "api/v3/sp500_constituent": sp500_constituent,
+    "api/v3/historical-price-full": historical_price_full,
+    "api/v3/historical-market-capitalization": historical_market_capitalization,
+    "api/v3/key-metrics": key_metrics,
+    "api/v3/profile": profile,
+    "stable/ratings-snapshot": ratings_snapshot,
+    "stable/analyst-estimates": analyst_estimates,
+    "stable/grades-historical": grades_historical,
+    "stable/news/stock": news_stock,
+}
+
+
+def make_server(host="127.0.0.1", port=0, tickers=50, days=750, latency_ms=0,
+                error_rate=0.0, news_per_ticker=20, seed=0, quota_rpm=0):
+    """
+    Builds (but does not start) a stub server.
+    Args:
+        tickers: Number of synthetic symbols in sp500_constituent.
+        days: Trading days of history per symbol.
+        latency_ms: Fixed delay added to every response.
+        error_rate: Fraction of requests answered with 429 + Retry-After.
+        quota_rpm: Requests per minute allowed, like an FMP plan; requests
+            beyond it (in any one second) get 429 + Retry-After. 0 is unlimited.
+        news_per_ticker: Articles available per symbol.
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.tickers = tickers
+    server.days = days
+    server.latency_ms = latency_ms
+    server.error_rate = error_rate
+    server.news_per_ticker = news_per_ticker
+    server.rng = random.Random(seed)
+    server.admit = quota_admitter(quota_rpm)
+    return server
+
+
+def quota_admitter(quota_rpm):
+    """Returns a thread-safe admit() that enforces quota_rpm with a one-second token bucket."""
+    if not quota_rpm:
+        return lambda: True
+    rate = quota_rpm / 60.0
+    state = {"tokens": rate, "updated": time.monotonic()}
+    lock = threading.Lock()
+
+    def admit():
+        with lock:
+            now = time.monotonic()
+            state["tokens"] = min(rate, state["tokens"] + (now - state["updated"]) * rate)
+            state["updated"] = now
+            if state["tokens"] < 1:
+                return False
+            state["tokens"] -= 1
+            return True
+    return admit
+
+
+def serve_in_background(**kwargs):
+    """Starts a stub server on a daemon thread and returns (server, base_url)."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic FMP data locally.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tickers", type=int, default=50)
+    parser.add_argument("--days", type=int, default=750)
+    parser.add_argument("--latency-ms", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--quota-rpm", type=int, default=0, help="requests per minute before 429s (0: unlimited)")
+    args = parser.parse_args()
+    server = make_server(port=args.port, tickers=args.tickers, days=args.days,
+                         latency_ms=args.latency_ms, error_rate=args.error_rate, quota_rpm=args.quota_rpm)
+    print(f"🧪 FMP stub serving {args.tickers} tickers x {args.days} days on http://127.0.0.1:{args.port}")
+    print(f"   Set FMP_BASE_URL=http://127.0.0.1:{args.port} to point the fetchers at it.")
+    server.serve_forever()
@@ -1,37 +1,177 @@
+import argparse
 import os
+from datetime import date
 from pathlib import Path
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+from db import engine, DATABASE_URL
 
-def init_database():
+# Tables range-partitioned by year in schema.sql -> partition key column
+PARTITIONED_TABLES = {
+    "prices": "price_date",
+    "allocations": "allocation_date",
+}
+# Oldest yearly partition to create; defaults to the fetchers' 3-year backfill
+PARTITION_FIRST_YEAR = int(os.getenv("PARTITION_FIRST_YEAR", date.today().year - 3))
+# Partitions are created this many years ahead, so loads never hit a missing one
+PARTITION_YEARS_AHEAD = 1
+
+
+def ensure_partitions(connection, table, first_year, last_year):
+    """
+    Creates the yearly partitions <table>_<year> of a partitioned table for
+    every year from first_year to last_year that does not have one yet.
+    Returns:
+        The names of the partitions created.
+    """
+    existing = set(connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass)"
+    ), {"table": table}).scalars())
+    created = []
+    for year in range(first_year, last_year + 1):
+        partition = f"{table}_{year}"
+        if partition in existing:
+            continue
+        connection.execute(text(
+            f"CREATE TABLE {partition} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        ))
+        created.append(partition)
+    return created
+
+
+def detach_unpartitioned(connection):
+    """
+    Renames heap versions of PARTITIONED_TABLES, left by databases created
+    before partitioning, to <table>_unpartitioned so schema.sql can create
+    the partitioned tables. Their secondary indexes are dropped and their
+    constraints renamed, so the new tables get the original names.
+    Returns:
+        {table: renamed heap table}
+    """
+    legacy = {}
+    for table in PARTITIONED_TABLES:
+        kind = connection.execute(text(
+            "SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"
+        ), {"table": table}).scalar()
+        if kind != "r":
+            continue
+        old = f"{table}_unpartitioned"
+        indexes = connection.execute(text(
+            "SELECT i.indexrelid::regclass::text FROM pg_index i "
+            "WHERE i.indrelid = CAST(:table AS regclass) AND NOT i.indisprimary"
+        ), {"table": table}).scalars().all()
+        for index in indexes:
+            connection.execute(text(f"DROP INDEX {index}"))
+        constraints = connection.execute(text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:table AS regclass)"
+        ), {"table": table}).scalars().all()
+        connection.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        for name in constraints:
+            renamed = old + name[len(table):] if name.startswith(f"{table}_") else f"{old}_{name}"
+            connection.execute(text(f"ALTER TABLE {old} RENAME CONSTRAINT {name} TO {renamed}"))
+        legacy[table] = old
+    return legacy
+
+
+def migrate_unpartitioned(connection, table, old):
+    """Moves every row of the renamed heap table into the partitioned table and drops it."""
+    columns = ", ".join(connection.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table ORDER BY ordinal_position"
+    ), {"table": old}).scalars())
+    moved = connection.execute(text(
+        f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}"
+    )).rowcount
+    connection.execute(text(f"DROP TABLE {old}"))
+    connection.execute(text(f"ANALYZE {table}"))
+    print(f"  Moved {moved} rows from {old} into the partitioned {table} table")
+
+
+def totals_need_backfill(connection):
+    """
+    True when allocation_totals predates its constituent_count column (or
+    does not exist yet), i.e. its rows were not written by the incremental
+    recompute of fetch_historical_market_cap.py. Checked before schema.sql runs.
+    """
+    return not connection.execute(text(
+        "SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() "
+        "AND table_name = 'allocation_totals' AND column_name = 'constituent_count'"
+    )).scalar()
+
+
+def backfill_allocation_totals(connection):
+    """
+    Aggregates allocation_totals for every allocation date without a counted
+    totals row. The market-cap fetcher only recomputes dates it marks dirty,
+    so rows loaded by older versions (or migrated from the heap table) would
+    otherwise have no totals and be missing from /api/growth.
+    """
+    filled = connection.execute(text("""
+        INSERT INTO allocation_totals (allocation_date, total_market_cap, constituent_count, updated_at)
+        SELECT allocation_date, SUM(market_cap_usd), COUNT(*), NOW()
+        FROM allocations
+        GROUP BY allocation_date
+        ON CONFLICT (allocation_date) DO UPDATE
+        SET total_market_cap = EXCLUDED.total_market_cap,
+            constituent_count = EXCLUDED.constituent_count,
+            updated_at = NOW()
+        WHERE allocation_totals.constituent_count = 0
+    """)).rowcount
+    print(f"  Backfilled allocation_totals for {filled} allocation dates")
+
+
+def init_database(first_year=PARTITION_FIRST_YEAR, last_year=None):
+    """
+    Applies schema.sql, creating or extending the yearly partitions of
+    PARTITIONED_TABLES from first_year to last_year (default: next year),
+    and migrating pre-partitioning heap tables. Partitions are widened to
+    cover the years of any migrated rows. allocation_totals is backfilled
+    once, when it is first created or the allocations table is migrated.
+    """
+    last_year = last_year or date.today().year + PARTITION_YEARS_AHEAD
     try:
-        # Load environment variables from .env file
-        load_dotenv(override=True)
-        
-        # Get database URL from environment variable
-        database_url = os.getenv('DATABASE_URL')
-        print("Using DATABASE_URL =", database_url)
-        if not database_url:
-            raise ValueError("DATABASE_URL environment variable is not set")
-        
-        # Create SQLAlchemy engine
-        engine = create_engine(database_url)
-        
+        print("Using DATABASE_URL =", DATABASE_URL)
+
         # Read schema.sql file
         schema_path = Path(__file__).parent / 'schema.sql'
         with open(schema_path, 'r') as f:
             schema_sql = f.read()
-        
-        # Execute schema.sql
+
+        # Execute schema.sql, in one transaction with the partition upkeep
         with engine.connect() as connection:
+            backfill_totals = totals_need_backfill(connection)
+            legacy = detach_unpartitioned(connection)
             connection.execute(text(schema_sql))
+            for table, column in PARTITIONED_TABLES.items():
+                start, end = first_year, last_year
+                if table in legacy:
+                    oldest, newest = connection.execute(text(
+                        f"SELECT EXTRACT(YEAR FROM MIN({column}))::int, EXTRACT(YEAR FROM MAX({column}))::int "
+                        f"FROM {legacy[table]}"
+                    )).one()
+                    start, end = min(start, oldest or start), max(end, newest or end)
+                created = ensure_partitions(connection, table, start, end)
+                if created:
+                    print(f"  Created partitions {', '.join(created)}")
+                if table in legacy:
+                    migrate_unpartitioned(connection, table, legacy[table])
+            # One-off: later runs find constituent_count and skip the full scan
+            if backfill_totals or "allocations" in legacy:
+                backfill_allocation_totals(connection)
             connection.commit()
-        
+
         print("✅ Database schema created successfully")
-        
+
     except Exception as e:
         print(f"Error initializing database: {str(e)}")
         raise
 
 if __name__ == "__main__":
-    init_database()
+    parser = argparse.ArgumentParser(description="Create the schema and yearly partitions.")
+    parser.add_argument("--first-year", type=int, default=PARTITION_FIRST_YEAR,
+                        help="oldest yearly partition of prices/allocations to create")
+    parser.add_argument("--last-year", type=int,
+                        help=f"newest yearly partition to create (default: {PARTITION_YEARS_AHEAD} year ahead)")
+    args = parser.parse_args()
+    init_database(args.first_year, args.last_year)
@@ -0,0 +1,174 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+FMP_CACHE_DIR = os.getenv('FMP_CACHE_DIR', str(Path(__file__).parent / '.fmp_cache'))
+FMP_CACHE_MAX_MB = int(os.getenv('FMP_CACHE_MAX_MB', '512'))
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# How long a cached response stays fresh, by endpoint path prefix
+CACHE_TTLS = {
+    'api/v3/profile': 7 * DAY,
+    'api/v3/key-metrics': 7 * DAY,
+    'api/v3/sp500_constituent': DAY,
+    'api/v3/historical-price-full': DAY,
+    'api/v3/historical-market-capitalization': DAY,
+    'stable/ratings-snapshot': DAY,
+    'stable/analyst-estimates': DAY,
+    'stable/grades-historical': DAY,
+    'stable/news/stock': 6 * HOUR,
+}
+DEFAULT_TTL = DAY
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of FMP response bodies.
+    Entries are keyed by the SHA-256 of the endpoint path plus its query
+    parameters (with the apikey removed), stored gzip-compressed, and evicted
+    least-recently-used once the cache grows past `max_bytes`.
+    File mtime records when a response was stored (for TTLs) and atime when it
+    was last served (for LRU).
+    """
+
+    def __init__(self, directory=FMP_CACHE_DIR, max_bytes=FMP_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.size = sum(p.stat().st_size for p in self.directory.glob('*/*.json.gz'))
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def key(path: str, params: dict) -> str:
+        params = {k: str(v) for k, v in params.items() if k != 'apikey'}
+        material = json.dumps([path.strip('/'), sorted(params.items())])
+        return hashlib.sha256(material.encode()).hexdigest()
+
+    @staticmethod
+    def ttl(path: str) -> int:
+        path = path.strip('/')
+        for prefix, seconds in CACHE_TTLS.items():
+            if path.startswith(prefix):
+                return seconds
+        return DEFAULT_TTL
+
+    def _file(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json.gz"
+
+    def get(self, path: str, params: dict, ignore_ttl: bool = False):
+        """
+        Returns the cached body for a request, or None if it is missing or
+        older than the endpoint's TTL (unless ignore_ttl is set).
+        """
+        f = self.open(path, params, ignore_ttl)
+        if f is None:
+            return None
+        try:
+            with f:
+                return f.read()
+        except (OSError, EOFError, zlib.error):  # a corrupt entry is a miss
+            with self.lock:
+                self.hits -= 1
+                self.misses += 1
+            self._discard(self._file(self.key(path, params)))
+            return None
+
+    def open(self, path: str, params: dict, ignore_ttl: bool = False):
+        """
+        Like get(), but returns the cached body as an open binary file to be
+        read incrementally (and closed by the caller), or None.
+        """
+        file = self._file(self.key(path, params))
+        f = None
+        try:
+            stored_at = file.stat().st_mtime
+            if not ignore_ttl and time.time() - stored_at > self.ttl(path):
+                self._count(hit=False)
+                return None
+            f = gzip.open(file, 'rb')
+            f.peek(1)  # fail here, not mid-read, on a corrupt header
+            os.utime(file, (time.time(), stored_at))  # mark as recently used
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+        except (OSError, EOFError, zlib.error):
+            if f is not None:
+                f.close()
+            self._count(hit=False)
+            self._discard(file)
+            return None
+        self._count(hit=True)
+        return f
+
+    def _count(self, hit: bool):
+        # get() and open() are called from the client's worker threads
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _discard(self, file: Path):
+        """Evicts a corrupt entry, so it is downloaded again rather than re-read."""
+        with self.lock:
+            try:
+                size = file.stat().st_size
+                file.unlink()
+            except FileNotFoundError:
+                return
+            self.size -= size
+
+    def put(self, path: str, params: dict, body: bytes):
+        """Stores a response body, then evicts old entries if over the size bound."""
+        with self.writer(path, params) as f:
+            f.write(body)
+
+    @contextmanager
+    def writer(self, path: str, params: dict):
+        """
+        Yields a binary file to stream a response body into. The entry is
+        stored when the block exits normally and discarded if it raises.
+        """
+        file = self._file(self.key(path, params))
+        file.parent.mkdir(exist_ok=True)
+        tmp = file.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            with gzip.open(tmp, 'wb', compresslevel=6) as f:
+                yield f
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        previous = file.stat().st_size if file.exists() else 0
+        os.replace(tmp, file)
+        with self.lock:
+            self.size += file.stat().st_size - previous
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Removes least-recently-used entries until the cache is at 90% of its bound."""
+        entries = sorted(
+            ((p.stat().st_atime, p.stat().st_size, p) for p in self.directory.glob('*/*.json.gz')),
+            key=lambda e: e[0],
+        )
+        target = self.max_bytes * 0.9
+        for _, size, file in entries:
+            if self.size <= target:
+                break
+            file.unlink(missing_ok=True)
+            self.size -= size
@@ -1,85 +1,145 @@
-import subprocess
-import sys
+import argparse
+import importlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
-# List of fetch scripts to run in order
-# fetch_tickers.py must run first as other data depends on the tickers.
-# The order of the subsequent scripts is generally flexible as they primarily depend on tickers.
-FETCH_SCRIPTS = [
-    "init_db.py",
-    "fetch_tickers.py",
-    "fetch_prices.py",
-    "fetch_historical_market_cap.py", # Added new script
-    "fetch_metrics.py",
-    "fetch_profile.py",
-    "fetch_analyst_labels.py",
-    "fetch_analyst_estimates.py",
-    "fetch_historical_analyst.py",
-    "fetch_stock_news.py"
-]
-
-def run_script(script_name: str) -> bool:
+# Pipeline stages as a dependency graph: name -> (module, entry function, dependencies).
+# Every fetcher only depends on the tickers table, so once fetch_tickers has run
+# the rest execute concurrently in this process, sharing the engine in db.py and
+# the rate-limited FMP client in fmp_client.py.
+STAGES = {
+    "init_db":     ("init_db",                  "init_database",                                []),
+    "tickers":     ("fetch_tickers",            "fetch_and_upsert_tickers",                     ["init_db"]),
+    "prices":      ("fetch_prices",             "fetch_and_upsert_prices",                      ["tickers"]),
+    "market_caps": ("fetch_historical_market_cap", "fetch_and_upsert_market_caps",              ["tickers"]),
+    "metrics":     ("fetch_metrics",            "fetch_and_upsert_metrics",                     ["tickers"]),
+    "profiles":    ("fetch_profile",            "fetch_and_upsert_profiles",                    ["tickers"]),
+    "labels":      ("fetch_analyst_labels",     "fetch_and_upsert_analyst_labels",              ["tickers"]),
+    "estimates":   ("fetch_analyst_estimates",  "fetch_and_upsert_analyst_estimates_quarterly", ["tickers"]),
+    "grades":      ("fetch_historical_analyst", "fetch_and_upsert_grades_historical",           ["tickers"]),
+    "news":        ("fetch_stock_news",         "fetch_and_upsert_stock_news",                  ["tickers"]),
+}
+
+# Stages whose entry function accepts full=True to skip incremental fetching
+INCREMENTAL_STAGES = {"prices", "market_caps", "estimates", "grades"}
+
+
+def run_stage(name: str, kwargs: dict) -> float:
+    """
+    Imports a stage's module and calls its entry function.
+    Modules are imported lazily so their schema reflection happens after init_db.
+    Returns:
+        Wall-clock seconds spent in the stage.
     """
-    Runs a given Python script using the same Python interpreter
-    and checks its output.
-    Args:
-        script_name: The name of the script file to run.
+    module_name, function_name, _ = STAGES[name]
+    print(f"\n--- Running {name} ({module_name}.{function_name}) ---")
+    started = time.perf_counter()
+    entry = getattr(importlib.import_module(module_name), function_name)
+    entry(**kwargs)
+    return time.perf_counter() - started
+
+
+def run_pipeline(selected, stage_kwargs=None) -> dict:
+    """
+    Runs the selected stages, starting each one as soon as its dependencies have
+    finished. Dependencies that were not selected are assumed to be satisfied;
+    stages whose dependency failed are skipped.
     Returns:
-        True if the script ran successfully, False otherwise.
+        {stage: (status, seconds)} for every selected stage.
     """
-    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script_name)
-    print(f"\n--- Running {script_name} ---")
-    
-    if not os.path.exists(script_path):
-        print(f"❌ Error: Script {script_path} not found.")
-        return False
-        
-    try:
-        # Use sys.executable to ensure the script is run with the same Python interpreter,
-        # especially important if you are using a virtual environment.
-        python_executable = sys.executable
-        # Let the subprocess print directly to the terminal for real-time output
-        process = subprocess.Popen(
-            [python_executable, script_path],
-            text=True, # Ensures strings for stdout/stderr if we were capturing
-            cwd=os.path.dirname(script_path) # Ensure script runs in its own directory context
-        )
-        
-        process.wait() # Wait for the script to complete
-        
-        if process.returncode != 0:
-            # Error messages from the script would have already printed to the terminal
-            print(f"--- {script_name} finished with an error ---")
-            print(f"❌ Error executing {script_name}: Return code: {process.returncode}")
-            return False
-            
-        print(f"--- {script_name} finished successfully ---")
-        print(f"✅ Successfully executed {script_name}")
-        return True
-        
-    except Exception as e:
-        print(f"❌ An unexpected error occurred while trying to run {script_name}: {e}")
-        return False
+    stage_kwargs = stage_kwargs or {}
+    pending = [name for name in STAGES if name in selected]
+    results = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=len(STAGES)) as executor:
+        while pending or running:
+            for name in list(pending):
+                deps = [d for d in STAGES[name][2] if d in selected]
+                if any(results.get(d, ("",))[0] in ("failed", "skipped") for d in deps):
+                    print(f"\n🛑 Skipping {name}: a dependency did not complete.")
+                    results[name] = ("skipped", 0.0)
+                    pending.remove(name)
+                elif all(results.get(d, ("",))[0] == "ok" for d in deps):
+                    running[executor.submit(run_stage, name, stage_kwargs.get(name, {}))] = name
+                    pending.remove(name)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    seconds = future.result()
+                    results[name] = ("ok", seconds)
+                    print(f"✅ {name} finished in {seconds:.1f}s")
+                except Exception as e:
+                    results[name] = ("failed", 0.0)
+                    print(f"❌ {name} failed: {e}")
+    return results
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the ingestion pipeline.")
+    parser.add_argument("--only", nargs="+", choices=STAGES, metavar="STAGE",
+                        help=f"run only these stages ({', '.join(STAGES)})")
+    parser.add_argument("--skip", nargs="+", choices=STAGES, default=[], metavar="STAGE",
+                        help="run every stage except these")
+    parser.add_argument("--full", action="store_true",
+                        help="disable incremental fetching for time-series stages")
+    parser.add_argument("--replay", action="store_true",
+                        help="serve FMP responses only from the on-disk cache, never the network")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="bypass the on-disk FMP response cache")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the last unfinished run, skipping tickers its fetchers completed")
+    args = parser.parse_args()
+
+    # Read by fmp_client when the first stage imports it
+    if args.replay:
+        os.environ["FMP_REPLAY"] = "1"
+    if args.no_cache:
+        os.environ["FMP_CACHE"] = "0"
+
+    selected = set(args.only or STAGES) - set(args.skip)
+    stage_kwargs = {name: {"full": True} for name in INCREMENTAL_STAGES} if args.full else {}
+
     print("🚀 Starting the data fetching pipeline...\n")
     print("🔔 IMPORTANT:")
     print("   1. Ensure your Docker containers (PostgreSQL, pgAdmin) are running.")
     print("      (You can start them with: docker-compose up -d)")
-    print("   3. Make sure your .env file is correctly configured with API keys and DATABASE_URL.\n")
-
-    all_successful = True
-    for script_file in FETCH_SCRIPTS:
-        if not run_script(script_file):
-            all_successful = False
-            print(f"\n🛑 Halting pipeline due to error in {script_file}.")
-            break
-    
+    print("   2. Make sure your .env file is correctly configured with API keys and DATABASE_URL.\n")
+
+    started = time.perf_counter()
+    if "init_db" in selected:
+        # The run ledger lives in the schema, so create it before the run starts
+        results = run_pipeline({"init_db"})
+        selected -= {"init_db"}
+    else:
+        results = {}
+    if all(status == "ok" for status, _ in results.values()):
+        # Every fetcher records its completed tickers under this run (see run_ledger.py)
+        from run_ledger import begin_run, finish_run
+        run_id = begin_run(resume=args.resume)
+        results.update(run_pipeline(selected, stage_kwargs))
+        finish_run(run_id, ok=all(status == "ok" for status, _ in results.values()))
+    else:
+        print("\n🛑 Skipping every fetcher: init_db did not complete.")
+        results.update({name: ("skipped", 0.0) for name in STAGES if name in selected})
+    total = time.perf_counter() - started
+
     print("\n--- Pipeline Execution Summary ---")
-    if all_successful:
-        print("🎉 All fetch scripts executed successfully!")
+    for name in STAGES:
+        if name in results:
+            status, seconds = results[name]
+            print(f"  {name:<12} {status:<8} {seconds:8.1f}s")
+    print(f"  {'total':<12} {'':<8} {total:8.1f}s")
+    if all(status == "ok" for status, _ in results.values()):
+        print("🎉 All fetch stages executed successfully!")
     else:
-        print("⚠️ Some scripts failed to execute. Please review the logs above.")
+        print("⚠️ Some stages failed or were skipped. Please review the logs above.")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
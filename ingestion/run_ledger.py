@@ -0,0 +1,148 @@
+import os
+import threading
+from dotenv import load_dotenv
+from sqlalchemy import text
+from db import engine, bump_data_version
+
+load_dotenv(override=True)
+# Tickers finished between commits; a crash loses at most this many tickers' work
+LEDGER_COMMIT_EVERY = int(os.getenv("LEDGER_COMMIT_EVERY", "25"))
+
+# Ledger statuses a resumed run does not redo; "partial" and "failed" tickers are retried
+COMPLETE_STATUSES = ("done", "no_data")
+
+_run_id = None
+_run_lock = threading.Lock()
+
+
+def begin_run(resume=False) -> int:
+    """
+    Starts the ingestion run that fetchers record their progress under.
+    Args:
+        resume: Continue the most recent run that did not finish, so its
+            completed tickers are skipped. Starts a new run if there is none.
+    Returns:
+        The run id.
+    """
+    global _run_id
+    with _run_lock, engine.begin() as conn:
+        run_id = None
+        if resume:
+            run_id = conn.execute(text(
+                "SELECT run_id FROM ingestion_runs WHERE status <> 'finished' ORDER BY run_id DESC LIMIT 1"
+            )).scalar()
+        if run_id is None:
+            run_id = conn.execute(text("INSERT INTO ingestion_runs DEFAULT VALUES RETURNING run_id")).scalar()
+            print(f"📒 Ingestion run {run_id} started.")
+        else:
+            conn.execute(text("UPDATE ingestion_runs SET status = 'running' WHERE run_id = :run_id"),
+                         {"run_id": run_id})
+            print(f"📒 Resuming ingestion run {run_id}.")
+        _run_id = run_id
+        return run_id
+
+
+def finish_run(run_id, ok=True):
+    """
+    Marks a run finished, or failed (and so resumable) if not ok or if any
+    ticker in its ledger is not complete.
+    """
+    global _run_id
+    with _run_lock, engine.begin() as conn:
+        if _run_id == run_id:
+            _run_id = None
+        conn.execute(text(
+            "UPDATE ingestion_runs SET finished_at = NOW(), status = CASE WHEN :ok AND NOT EXISTS ("
+            "SELECT 1 FROM ingestion_ledger WHERE run_id = :run_id AND status <> ALL(:complete)"
+            ") THEN 'finished' ELSE 'failed' END WHERE run_id = :run_id"
+        ), {"ok": ok, "run_id": run_id, "complete": list(COMPLETE_STATUSES)})
+
+
+class RunLedger:
+    """
+    Per-ticker progress of one fetcher within an ingestion run.
+    Each ticker's writes happen inside a savepoint (start), and finish
+    records the ticker in ingestion_ledger in the same transaction. The
+    session is committed every LEDGER_COMMIT_EVERY tickers, so data and
+    ledger rows land together and a failure late in a run only loses the
+    last batch. A failed ticker's savepoint is rolled back without
+    discarding the rest of the batch.
+
+    Given the fetcher's Counter of upsert outcomes (counting only tickers
+    that were not rolled back), a commit that follows new inserts or
+    updates also bumps data_version, so the backend's
+    response cache never outlives committed data, even if the run later
+    crashes.
+
+    Fetchers run by run_all_fetch_scripts.py share the pipeline's run; a
+    fetcher run on its own begins (and finishes) a run of its own, resuming
+    its last unfinished one if `resume` is set.
+    """
+
+    def __init__(self, session, fetcher, resume=False, outcomes=None):
+        self.session = session
+        self.fetcher = fetcher
+        self.outcomes = outcomes
+        self.bumped_changes = 0
+        self.owns_run = _run_id is None
+        self.run_id = begin_run(resume) if self.owns_run else _run_id
+        self.savepoint = None
+        self.uncommitted = 0
+        self.counts = {}
+        self.completed = set(session.execute(text(
+            "SELECT ticker FROM ingestion_ledger "
+            "WHERE run_id = :run_id AND fetcher = :fetcher AND status = ANY(:complete)"
+        ), {"run_id": self.run_id, "fetcher": fetcher, "complete": list(COMPLETE_STATUSES)}).scalars())
+
+    def pending(self, tickers):
+        """The tickers not yet completed by this fetcher in this run."""
+        todo = [t for t in tickers if t not in self.completed]
+        if len(todo) < len(tickers):
+            print(f"📒 {self.fetcher}: {len(tickers) - len(todo)} tickers already done in run {self.run_id}, "
+                  f"{len(todo)} to go.")
+        return todo
+
+    def start(self, ticker):
+        """Opens the savepoint for one ticker's writes."""
+        self.savepoint = self.session.begin_nested()
+
+    def finish(self, ticker, status="done"):
+        """
+        Records a ticker as done, no_data, partial (some records written
+        before an error) or failed (its writes are rolled back).
+        """
+        if self.savepoint is not None and self.savepoint.is_active:
+            if status == "failed":
+                self.savepoint.rollback()
+            else:
+                self.savepoint.commit()
+        self.savepoint = None
+        self.session.execute(text(
+            "INSERT INTO ingestion_ledger (run_id, fetcher, ticker, status) "
+            "VALUES (:run_id, :fetcher, :ticker, :status) "
+            "ON CONFLICT (run_id, fetcher, ticker) DO UPDATE "
+            "SET status = EXCLUDED.status, completed_at = NOW()"
+        ), {"run_id": self.run_id, "fetcher": self.fetcher, "ticker": ticker, "status": status})
+        self.counts[status] = self.counts.get(status, 0) + 1
+        self.uncommitted += 1
+        if self.uncommitted >= LEDGER_COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        if self.outcomes is not None:
+            changes = self.outcomes["inserted"] + self.outcomes["updated"]
+            if changes > self.bumped_changes:
+                bump_data_version(self.session)
+                self.bumped_changes = changes
+        self.session.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        """Commits the last batch, and finishes the run if this fetcher started it."""
+        self.commit()
+        failed = self.counts.get("failed", 0) + self.counts.get("partial", 0)
+        if self.owns_run:
+            finish_run(self.run_id)
+        if failed:
+            print(f"📒 {self.fetcher}: {failed} tickers failed in run {self.run_id}; "
+                  f"rerun with --resume to retry only those.")
@@ -17,10 +17,19 @@ CREATE TABLE IF NOT EXISTS prices (
     volume BIGINT,
     PRIMARY KEY (ticker, price_date),
     FOREIGN KEY (ticker) REFERENCES tickers(ticker) ON DELETE CASCADE
-);
+) PARTITION BY RANGE (price_date);
+-- Yearly partitions (prices_2024, ...) are created and extended by
+-- init_db.py, which also migrates a pre-partitioning prices table
 
--- Index for fast lookup by ticker and price_date
-CREATE INDEX idx_prices_ticker_date ON prices (ticker, price_date);
+-- The primary key already serves (ticker, price_date) lookups; this index
+-- duplicated it and doubled index writes on every upsert
+DROP INDEX IF EXISTS idx_prices_ticker_date;
+-- Date-range scans across all tickers (the primary key leads with ticker).
+-- The backfill loads each ticker's whole window in turn, so its block
+-- ranges overlap and BRIN prunes little beyond the yearly partition;
+-- incremental runs append recent dates in narrow block ranges, which it
+-- does prune. Kept for its near-zero write cost, not a second btree
+CREATE INDEX IF NOT EXISTS idx_prices_date_brin ON prices USING BRIN (price_date);
 
 -- 3. Analyst labels table: stores analyst ratings for each ticker
 CREATE TABLE IF NOT EXISTS analyst_labels (
@@ -91,10 +100,20 @@ CREATE TABLE IF NOT EXISTS stock_news (
   PRIMARY KEY (url)
 );
 
+-- Full-text search over headlines (weighted higher) and article text,
+-- maintained by Postgres as rows are written; served by /api/news
+ALTER TABLE stock_news ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', COALESCE(title, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(text, '')), 'B')
+) STORED;
+CREATE INDEX IF NOT EXISTS idx_stock_news_search ON stock_news USING GIN (search_vector);
+-- Most recent articles per symbol, read newest first
+CREATE INDEX IF NOT EXISTS idx_stock_news_symbol_date ON stock_news (symbol, published_date DESC);
+
 CREATE TABLE IF NOT EXISTS key_metrics (
     ticker VARCHAR(10) NOT NULL,
     date DATE NOT NULL,
-    metrics JSON NOT NULL,
+    metrics JSONB NOT NULL,
     PRIMARY KEY (ticker, date),
     FOREIGN KEY (ticker) REFERENCES tickers(ticker) ON DELETE CASCADE
 );
@@ -102,11 +121,76 @@ CREATE TABLE IF NOT EXISTS key_metrics (
 -- 5. Profiles table: stores company profile data for each ticker
 CREATE TABLE IF NOT EXISTS profiles (
     ticker VARCHAR(10) PRIMARY KEY,
-    profile_data JSON NOT NULL,
+    profile_data JSONB NOT NULL,
     date_fetched DATE NOT NULL,
     FOREIGN KEY (ticker) REFERENCES tickers(ticker) ON DELETE CASCADE
 );
 
+-- Databases created before the switch to JSONB store the blobs as JSON;
+-- convert them once (JSONB can be GIN-indexed and compared for equality)
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns WHERE table_schema = current_schema()
+        AND table_name = 'key_metrics' AND column_name = 'metrics') = 'json' THEN
+        ALTER TABLE key_metrics ALTER COLUMN metrics TYPE JSONB USING metrics::jsonb;
+    END IF;
+    IF (SELECT data_type FROM information_schema.columns WHERE table_schema = current_schema()
+        AND table_name = 'profiles' AND column_name = 'profile_data') = 'json' THEN
+        ALTER TABLE profiles ALTER COLUMN profile_data TYPE JSONB USING profile_data::jsonb;
+    END IF;
+END $$;
+
+-- A numeric field of a JSONB document, or NULL when it is missing or not a
+-- number (FMP sends null, and occasionally strings, for unavailable values)
+CREATE OR REPLACE FUNCTION jsonb_number(doc JSONB, field TEXT) RETURNS NUMERIC
+    LANGUAGE SQL IMMUTABLE PARALLEL SAFE AS $$
+    SELECT CASE WHEN jsonb_typeof(doc -> field) = 'number' THEN (doc ->> field)::numeric END
+$$;
+
+-- Hot fields extracted from the blobs into typed columns as rows are
+-- written, so screens filter and sort on plain indexed columns instead of
+-- parsing every document
+ALTER TABLE key_metrics
+    ADD COLUMN IF NOT EXISTS market_cap           NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'marketCap')) STORED,
+    ADD COLUMN IF NOT EXISTS pe_ratio             NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'peRatio')) STORED,
+    ADD COLUMN IF NOT EXISTS pb_ratio             NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'pbRatio')) STORED,
+    ADD COLUMN IF NOT EXISTS price_to_sales_ratio NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'priceToSalesRatio')) STORED,
+    ADD COLUMN IF NOT EXISTS ev_to_ebitda         NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'enterpriseValueOverEBITDA')) STORED,
+    ADD COLUMN IF NOT EXISTS debt_to_equity       NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'debtToEquity')) STORED,
+    ADD COLUMN IF NOT EXISTS current_ratio        NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'currentRatio')) STORED,
+    ADD COLUMN IF NOT EXISTS dividend_yield       NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'dividendYield')) STORED,
+    ADD COLUMN IF NOT EXISTS roe                  NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'roe')) STORED,
+    ADD COLUMN IF NOT EXISTS free_cash_flow_yield NUMERIC GENERATED ALWAYS AS (jsonb_number(metrics, 'freeCashFlowYield')) STORED;
+
+ALTER TABLE profiles
+    ADD COLUMN IF NOT EXISTS sector     TEXT    GENERATED ALWAYS AS (profile_data ->> 'sector') STORED,
+    ADD COLUMN IF NOT EXISTS industry   TEXT    GENERATED ALWAYS AS (profile_data ->> 'industry') STORED,
+    ADD COLUMN IF NOT EXISTS exchange   TEXT    GENERATED ALWAYS AS (profile_data ->> 'exchangeShortName') STORED,
+    ADD COLUMN IF NOT EXISTS market_cap NUMERIC GENERATED ALWAYS AS (jsonb_number(profile_data, 'mktCap')) STORED,
+    ADD COLUMN IF NOT EXISTS price      NUMERIC GENERATED ALWAYS AS (jsonb_number(profile_data, 'price')) STORED,
+    ADD COLUMN IF NOT EXISTS beta       NUMERIC GENERATED ALWAYS AS (jsonb_number(profile_data, 'beta')) STORED;
+
+-- Containment queries on fields without a column (metrics @> '{"period": "FY"}')
+CREATE INDEX IF NOT EXISTS idx_key_metrics_doc ON key_metrics USING GIN (metrics jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_profiles_doc ON profiles USING GIN (profile_data jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_key_metrics_pe_ratio ON key_metrics (pe_ratio);
+CREATE INDEX IF NOT EXISTS idx_profiles_sector ON profiles (sector, market_cap);
+
+-- One row per profiled ticker with its hot profile fields and the ratios of
+-- its most recent key_metrics entry, e.g.
+--   SELECT ticker FROM stock_screen WHERE sector = 'Technology' AND pe_ratio < 15;
+-- The sector filter uses idx_profiles_sector, and each ticker's latest
+-- metrics row is one backward step of the key_metrics primary key.
+CREATE OR REPLACE VIEW stock_screen AS
+SELECT p.ticker, p.profile_data ->> 'companyName' AS company_name, p.sector, p.industry, p.exchange,
+       p.market_cap, p.price, p.beta,
+       m.date AS metrics_date, m.pe_ratio, m.pb_ratio, m.price_to_sales_ratio, m.ev_to_ebitda,
+       m.debt_to_equity, m.current_ratio, m.dividend_yield, m.roe, m.free_cash_flow_yield
+FROM profiles p
+LEFT JOIN LATERAL (
+    SELECT * FROM key_metrics k WHERE k.ticker = p.ticker ORDER BY k.date DESC LIMIT 1
+) m ON TRUE;
+
 -- Historical Allocations Table
 CREATE TABLE IF NOT EXISTS allocations (
     ticker             VARCHAR(10)    NOT NULL
@@ -119,11 +203,96 @@ CREATE TABLE IF NOT EXISTS allocations (
     retrieved_at       TIMESTAMP      NOT NULL 
         DEFAULT NOW(),                  -- when this row was loaded
     PRIMARY KEY (ticker, allocation_date)
+) PARTITION BY RANGE (allocation_date);
+-- Yearly partitions, as for prices (see init_db.py)
+
+-- idx_allocations_date_ticker below serves every allocation_date range
+-- predicate, so a BRIN index only added write cost
+DROP INDEX IF EXISTS idx_allocations_date_brin;
+
+-- Index to speed date-range and time-series queries; also serves the
+-- (allocation_date, ticker) keyset pagination of /api/history. It
+-- supersedes the old date-only index.
+DROP INDEX IF EXISTS idx_allocations_date;
+CREATE INDEX IF NOT EXISTS idx_allocations_date_ticker
+    ON allocations (allocation_date, ticker);
+
+-- Last write time of every row of the time-series tables, kept by a
+-- trigger so every write path (COPY upserts, guarded upserts, ORM merges,
+-- the allocation_pct recompute) sets it. export.py fingerprints each
+-- (ticker, year) partition by its row count and latest updated_at to find
+-- what an incremental Parquet export must rewrite. Guarded upserts skip
+-- unchanged rows, so reruns over the same data leave it alone.
+CREATE OR REPLACE FUNCTION touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['prices', 'analyst_labels', 'analyst_estimates', 'grades_historical',
+                             'stock_news', 'key_metrics', 'allocations'] LOOP
+        EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW()', t);
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_touch_updated_at', t);
+        EXECUTE format('CREATE TRIGGER %I BEFORE UPDATE ON %I FOR EACH ROW EXECUTE FUNCTION touch_updated_at()',
+                       t || '_touch_updated_at', t);
+    END LOOP;
+END
+$$;
+
+-- Per-date market-cap totals, maintained incrementally by
+-- fetch_historical_market_cap.py; used to compute allocation_pct and
+-- served directly by /api/growth
+CREATE TABLE IF NOT EXISTS allocation_totals (
+    allocation_date    DATE           PRIMARY KEY,
+    total_market_cap   BIGINT         NOT NULL,
+    constituent_count  INTEGER        NOT NULL DEFAULT 0,
+    updated_at         TIMESTAMP      NOT NULL DEFAULT NOW()
+);
+ALTER TABLE allocation_totals
+    ADD COLUMN IF NOT EXISTS constituent_count INTEGER NOT NULL DEFAULT 0;
+
+-- Dates whose allocations changed since allocation_totals and
+-- allocation_pct were last recomputed. Written in the same transaction as
+-- the allocation rows, so dates left by a crashed run are recomputed by
+-- the next one
+CREATE TABLE IF NOT EXISTS allocation_dirty_dates (
+    allocation_date    DATE           PRIMARY KEY
+);
+
+-- Single-row stamp bumped by ingestion whenever allocations change;
+-- the backend keys its response cache on it
+CREATE TABLE IF NOT EXISTS data_version (
+    id                 BOOLEAN        PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version            BIGINT         NOT NULL DEFAULT 0,
+    updated_at         TIMESTAMP      NOT NULL DEFAULT NOW()
+);
+INSERT INTO data_version (id) VALUES (TRUE) ON CONFLICT DO NOTHING;
+
+-- Ingestion runs and the tickers each fetcher completed in them (see
+-- run_ledger.py); --resume continues the latest unfinished run, skipping
+-- tickers already done
+CREATE TABLE IF NOT EXISTS ingestion_runs (
+    run_id             SERIAL         PRIMARY KEY,
+    status             VARCHAR(10)    NOT NULL DEFAULT 'running',  -- running / finished / failed
+    started_at         TIMESTAMP      NOT NULL DEFAULT NOW(),
+    finished_at        TIMESTAMP
 );
 
--- Index to speed date-range and time-series queries
-CREATE INDEX IF NOT EXISTS idx_allocations_date 
-    ON allocations (allocation_date);
+CREATE TABLE IF NOT EXISTS ingestion_ledger (
+    run_id             INTEGER        NOT NULL
+        REFERENCES ingestion_runs(run_id)
+        ON DELETE CASCADE,
+    fetcher            VARCHAR(30)    NOT NULL,
+    ticker             VARCHAR(10)    NOT NULL,
+    status             VARCHAR(10)    NOT NULL,    -- done / no_data / partial / failed
+    completed_at       TIMESTAMP      NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (run_id, fetcher, ticker)
+);
 
 -- Predictions table: stores LLM predictions for user requests
 CREATE TABLE IF NOT EXISTS predictions (
@@ -132,3 +301,16 @@ CREATE TABLE IF NOT EXISTS predictions (
     response_data JSON NOT NULL,
     created_at TIMESTAMP NOT NULL DEFAULT NOW()
 );
+
+-- Id of the /api/predict job that produced the row, for status lookups
+ALTER TABLE predictions ADD COLUMN IF NOT EXISTS job_id UUID UNIQUE;
+
+-- Forecasts keyed by a hash of the ticker's prompt inputs, so unchanged
+-- inputs reuse the previous forecast (see prompting-training/forecast_cache.py)
+CREATE TABLE IF NOT EXISTS forecast_cache (
+    input_hash  VARCHAR(64) PRIMARY KEY,
+    ticker      VARCHAR(10) NOT NULL,
+    prompt      TEXT        NOT NULL,
+    forecast    TEXT        NOT NULL,
+    created_at  TIMESTAMP   NOT NULL DEFAULT NOW()
+);
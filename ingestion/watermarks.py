@@ -0,0 +1,33 @@
+import os
+from datetime import timedelta
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+load_dotenv(override=True)
+
+# Days re-requested before each ticker's watermark so late revisions from FMP
+# (restated prices, adjusted market caps) are picked up on the next run.
+INCREMENTAL_OVERLAP_DAYS = int(os.getenv('INCREMENTAL_OVERLAP_DAYS', '5'))
+
+
+def load_watermarks(session, table, ticker_column, date_column, until=None):
+    """
+    Returns {ticker: latest date stored} for a time-series table, read with one
+    GROUP BY over its (ticker, date) primary key. With `until`, only dates on
+    or before it count (e.g. to skip forward-looking estimates).
+    """
+    result = session.execute(text(
+        f"SELECT {ticker_column}, MAX({date_column}) FROM {table} "
+        f"WHERE {date_column} <= COALESCE(:until, {date_column}) GROUP BY {ticker_column}"
+    ), {"until": until})
+    return {ticker: latest for ticker, latest in result}
+
+
+def fetch_start(watermark, backfill_start, overlap_days=INCREMENTAL_OVERLAP_DAYS):
+    """
+    First date to request for a ticker: the day after its watermark, minus the
+    revision overlap. Tickers with no watermark get the full backfill window.
+    """
+    if watermark is None:
+        return backfill_start
+    return max(backfill_start, watermark + timedelta(days=1 - overlap_days))
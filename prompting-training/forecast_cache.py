@@ -0,0 +1,167 @@
+"""
+Content-hash cache for prompts and forecasts.
+
+Each ticker's inputs (the price, news, label, estimate, allocation and
+profile rows its prompt is built from) are fingerprinted with one vectorized
+hash per DataFrame. If the fingerprint matches a cached entry, the prompt
+does not need rebuilding and the stored forecast is reused instead of
+calling the model again.
+"""
+import hashlib
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Column, DateTime, MetaData, String, Table, Text, create_engine, func, select
+
+from prompt_features import WINDOWS, _latest
+
+metadata = MetaData()
+# Also created by ingestion/schema.sql when the cache lives in the main database
+forecast_cache = Table(
+    "forecast_cache", metadata,
+    Column("input_hash", String(64), primary_key=True),
+    Column("ticker", String(10), nullable=False),
+    Column("prompt", Text, nullable=False),
+    Column("forecast", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
+)
+
+
+def _group_hashes(df, key, name):
+    """
+    Order-independent digest of each group's rows: the wrapping sum and the
+    count of pandas' per-row 64-bit hashes.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=[f"{name}_sum", f"{name}_rows"])
+    rows = pd.util.hash_pandas_object(df.drop(columns=[key]), index=False).to_numpy().view(np.int64)
+    grouped = pd.Series(rows, index=df[key].to_numpy()).groupby(level=0)
+    return pd.DataFrame({f"{name}_sum": grouped.sum(), f"{name}_rows": grouped.size()})
+
+
+def input_fingerprints(prices_df, news_df, labels_df, estimates_df, allocations_df=None,
+                       profiles_df=None, tickers=None, today=None, salt=""):
+    """
+    Hashes the input rows behind every ticker's prompt.
+    Only rows a prompt can depend on are hashed: prices and news inside the
+    longest window, the latest label, estimate and allocation, and the
+    profile's company name and sector. `today` is part of the hash because
+    the windows move with it.
+    Args:
+        salt: Anything else the output depends on, e.g. the system prompt and
+            model name, so changing them invalidates the cache.
+    Returns:
+        Series of SHA-256 hex digests indexed by ticker.
+    """
+    today = pd.Timestamp(today or pd.to_datetime("today")).normalize()
+    since = today - timedelta(days=max(days for _, days in WINDOWS.values()))
+    if tickers is None:
+        tickers = prices_df.ticker.unique()
+
+    parts = [
+        _group_hashes(prices_df[prices_df.price_date >= since], "ticker", "prices"),
+        _group_hashes(news_df.loc[news_df.published_date >= since, ["symbol", "published_date", "title", "text"]],
+                      "symbol", "news"),
+        _group_hashes(_latest(labels_df, "ticker", "label_date", "").reset_index(), "ticker", "label"),
+        _group_hashes(_latest(estimates_df, "symbol", "report_date", "").reset_index(), "symbol", "estimate"),
+    ]
+    if allocations_df is not None:
+        latest = _latest(allocations_df, "ticker", "allocation_date", "").reset_index()
+        parts.append(_group_hashes(latest[["ticker", "allocation_date", "allocation_pct"]], "ticker", "allocation"))
+    if profiles_df is not None:
+        profiles = pd.DataFrame({
+            "ticker": profiles_df.ticker,
+            "company_name": profiles_df.profile_data.map(lambda p: p.get("companyName", "")),
+            "sector": profiles_df.profile_data.map(lambda p: p.get("sector", "")),
+        })
+        parts.append(_group_hashes(profiles, "ticker", "profile"))
+
+    table = pd.DataFrame(index=pd.Index(tickers, name="ticker")).join(parts).fillna(0)
+    prefix = f"{today.date()}|{salt}|"
+    return pd.Series(
+        [hashlib.sha256(f"{prefix}{ticker}|{values}".encode()).hexdigest()
+         for ticker, values in zip(table.index, table.astype("int64").itertuples(index=False, name=None))],
+        index=table.index,
+        name="input_hash",
+    )
+
+
+class ForecastCache:
+    """
+    Forecasts keyed by input fingerprint, stored in the forecast_cache table
+    of any SQLAlchemy database (the project's Postgres, or a local SQLite
+    file when working from CSV exports).
+    """
+
+    def __init__(self, url_or_engine="sqlite:///forecast_cache.db"):
+        self.engine = create_engine(url_or_engine) if isinstance(url_or_engine, str) else url_or_engine
+        metadata.create_all(self.engine, tables=[forecast_cache])
+
+    def lookup(self, fingerprints):
+        """
+        Returns {ticker: (prompt, forecast)} for tickers whose fingerprint is cached.
+        """
+        by_hash = {h: t for t, h in fingerprints.items()}
+        found = {}
+        hashes = list(by_hash)
+        with self.engine.connect() as conn:
+            for start in range(0, len(hashes), 500):
+                rows = conn.execute(
+                    select(forecast_cache.c.input_hash, forecast_cache.c.prompt, forecast_cache.c.forecast)
+                    .where(forecast_cache.c.input_hash.in_(hashes[start:start + 500]))
+                )
+                for input_hash, prompt, forecast in rows:
+                    found[by_hash[input_hash]] = (prompt, forecast)
+        return found
+
+    def store(self, fingerprints, prompts, forecasts):
+        """
+        Saves forecasts for the given tickers.
+        Args:
+            fingerprints: Series of input hashes indexed by ticker.
+            prompts, forecasts: Mappings of ticker -> text for the new entries.
+        """
+        rows = [
+            {"input_hash": fingerprints[t], "ticker": t, "prompt": prompts[t], "forecast": forecasts[t]}
+            for t in forecasts
+        ]
+        if not rows:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(forecast_cache.delete().where(
+                forecast_cache.c.input_hash.in_([r["input_hash"] for r in rows])
+            ))
+            conn.execute(forecast_cache.insert(), rows)
+
+
+def forecast_with_cache(cache, fingerprints, build_prompts_for, generate):
+    """
+    Returns a forecast for every fingerprinted ticker, only building prompts
+    and calling the model for tickers whose inputs changed. Each new
+    forecast is cached as soon as it is generated.
+    Args:
+        cache: A ForecastCache.
+        fingerprints: Output of input_fingerprints.
+        build_prompts_for: Callable taking a list of tickers and returning
+            {ticker: prompt}, e.g. lambda t: build_prompts(features.loc[t], SYSTEM_PROMPT).
+        generate: Callable taking a prompt and returning the forecast text.
+    Returns:
+        (DataFrame indexed by ticker with prompt, forecast and cached columns,
+        number of model calls made)
+    """
+    cached = cache.lookup(fingerprints)
+    stale = [t for t in fingerprints.index if t not in cached]
+    prompts = dict(build_prompts_for(stale)) if stale else {}
+    forecasts = {}
+    for t in stale:
+        forecasts[t] = generate(prompts[t])
+        # Store each forecast as soon as it exists, so a run that fails
+        # partway keeps every model call it already paid for
+        cache.store(fingerprints, prompts, {t: forecasts[t]})
+
+    result = pd.DataFrame(
+        [(t, *cached[t], True) if t in cached else (t, prompts[t], forecasts[t], False) for t in fingerprints.index],
+        columns=["ticker", "prompt", "forecast", "cached"],
+    ).set_index("ticker")
+    return result, len(stale)
@@ -0,0 +1,229 @@
+"""
+Vectorized prompt features for the whole ticker universe.
+
+Replaces the notebook's per-ticker helpers (_compute_price_stats, _top_news,
+_latest_label, _latest_estimate, get_previous_allocation and the
+build_*_block functions), which filtered every DataFrame with
+`df[df.ticker == ticker]` once per ticker and horizon. Here each input is
+sorted and grouped once for all tickers and all three windows, and the
+result is a feature table with one row per ticker, ready to render.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# Chat-format tokens
+B_INST, E_INST = "[INST]", "[/INST]"
+B_SYS,  E_SYS  = "<<SYS>>\n", "\n<</SYS>>\n\n"
+
+# Window name -> (heading, days back from today)
+WINDOWS = {
+    "weekly": ("Weekly Outlook", 7),
+    "quarterly": ("Quarterly Outlook", 90),
+    "yearly": ("Yearly Outlook", 365),
+}
+
+
+def _price_features(prices_df, today):
+    """
+    Change, high, low and average volume per ticker for every window in one
+    groupby. Windows are nested, so each window's columns are the price
+    columns masked to that window, and first/last skip the masked rows.
+    """
+    longest = max(days for _, days in WINDOWS.values())
+    prices = prices_df[prices_df.price_date >= today - timedelta(days=longest)]
+    prices = prices.sort_values(["ticker", "price_date"], kind="stable")
+
+    columns = {"ticker": prices.ticker.to_numpy()}
+    aggregations = {}
+    for name, (_, days) in WINDOWS.items():
+        inside = (prices.price_date >= today - timedelta(days=days)).to_numpy()
+        columns[f"{name}_close"] = np.where(inside, prices.close_price, np.nan)
+        columns[f"{name}_high"] = np.where(inside, prices.high_price, np.nan)
+        columns[f"{name}_low"] = np.where(inside, prices.low_price, np.nan)
+        columns[f"{name}_volume"] = np.where(inside, prices.volume, np.nan)
+        aggregations.update({
+            f"{name}_first_close": (f"{name}_close", "first"),
+            f"{name}_last_close": (f"{name}_close", "last"),
+            f"{name}_days": (f"{name}_close", "count"),
+            f"{name}_high": (f"{name}_high", "max"),
+            f"{name}_low": (f"{name}_low", "min"),
+            f"{name}_avg_volume": (f"{name}_volume", "mean"),
+        })
+    stats = pd.DataFrame(columns).groupby("ticker", sort=False).agg(**aggregations)
+
+    for name in WINDOWS:
+        stats[f"{name}_change_pct"] = (stats[f"{name}_last_close"] / stats[f"{name}_first_close"] - 1) * 100
+        stats = stats.drop(columns=[f"{name}_first_close", f"{name}_last_close"])
+    return stats
+
+
+def _latest(df, key, date_column, prefix):
+    """The most recent row per key, with its columns prefixed."""
+    latest = df.sort_values(date_column, kind="stable").drop_duplicates(key, keep="last")
+    return latest.set_index(key).add_prefix(prefix)
+
+
+def _top_news(news_df, today, n):
+    """
+    The n most recent articles per symbol within the longest window, as a list
+    of (published_date, title, text) tuples. The articles in a shorter window
+    are a prefix of this list, so rendering filters it by date.
+    """
+    longest = max(days for _, days in WINDOWS.values())
+    news = news_df[news_df.published_date >= today - timedelta(days=longest)]
+    news = news.sort_values("published_date", ascending=False, kind="stable")
+    news = news.groupby("symbol", sort=False).head(n)
+    items = pd.Series(list(zip(news.published_date, news.title, news.text)), index=news.symbol.to_numpy())
+    return items.groupby(level=0, sort=False).agg(list).rename("news")
+
+
+def load_recent_news(engine, tickers, today=None, n=2, q=None):
+    """
+    Reads only the news rows _top_news would keep straight from Postgres:
+    the n most recent articles per symbol within the longest window (or the
+    n best matches for a web-search query `q`). Each symbol is one short
+    scan of the (symbol, published_date DESC) index, or of the search_vector
+    GIN index with q, instead of loading and sorting the whole table.
+    Returns:
+        DataFrame with symbol, published_date, title and text columns, usable
+        as build_feature_table's news_df.
+    """
+    from sqlalchemy import text
+
+    today = pd.Timestamp(today or pd.to_datetime("today")).normalize()
+    longest = max(days for _, days in WINDOWS.values())
+    match = "AND n.search_vector @@ websearch_to_tsquery('english', :q)" if q else ""
+    order = ("ts_rank_cd(n.search_vector, websearch_to_tsquery('english', :q)) DESC, n.published_date DESC"
+             if q else "n.published_date DESC")
+    sql = text(
+        "SELECT a.* FROM unnest(CAST(:symbols AS text[])) AS s(symbol) CROSS JOIN LATERAL ("
+        "SELECT n.symbol, n.published_date, n.title, n.text FROM stock_news n "
+        f"WHERE n.symbol = s.symbol AND n.published_date >= :since {match} "
+        f"ORDER BY {order} LIMIT :n) a"
+    )
+    params = {"symbols": list(tickers), "since": (today - timedelta(days=longest)).to_pydatetime(), "n": n, "q": q}
+    with engine.connect() as conn:
+        return pd.read_sql(sql, conn, params=params, parse_dates=["published_date"])
+
+
+def build_feature_table(prices_df, news_df, labels_df, estimates_df, allocations_df=None,
+                        profiles_df=None, tickers=None, today=None, news_per_window=2):
+    """
+    Computes every feature the prompt blocks need, for all tickers at once.
+    Args:
+        prices_df, news_df, labels_df, estimates_df: The notebook's DataFrames,
+            with their date columns already parsed.
+        allocations_df: Optional; adds the latest allocation_pct per ticker.
+        profiles_df: Optional; adds company name and sector from profile_data.
+        tickers: Universe to return; defaults to every ticker with prices.
+        today: Reference date (defaults to today, normalized).
+        news_per_window: Headlines per window, as in _top_news(n=2).
+    Returns:
+        DataFrame indexed by ticker with, per window, change_pct / high / low /
+        avg_volume / days, plus the latest label and estimate columns
+        (label_*, estimate_*), the news list, previous_allocation_pct,
+        company_name and sector.
+    """
+    today = pd.Timestamp(today or pd.to_datetime("today")).normalize()
+    if tickers is None:
+        tickers = prices_df.ticker.unique()
+
+    features = pd.DataFrame(index=pd.Index(tickers, name="ticker"))
+    features = features.join(_price_features(prices_df, today))
+    features = features.join(_latest(labels_df, "ticker", "label_date", "label_")
+                             [["label_label_date", "label_rating", "label_overall_score"]]
+                             .rename(columns={"label_label_date": "label_date"}))
+    features = features.join(_latest(estimates_df, "symbol", "report_date", "estimate_")
+                             [["estimate_report_date", "estimate_eps_avg", "estimate_revenue_avg"]])
+    features = features.join(_top_news(news_df, today, news_per_window))
+    # Keep integer columns integral (e.g. "Score 4/5") despite the NaNs the joins introduce
+    for column, source in (("label_overall_score", labels_df.overall_score),
+                           ("estimate_revenue_avg", estimates_df.revenue_avg)):
+        if pd.api.types.is_integer_dtype(source):
+            features[column] = features[column].astype("Int64")
+
+    if allocations_df is not None:
+        latest = _latest(allocations_df, "ticker", "allocation_date", "")
+        features["previous_allocation_pct"] = (latest.allocation_pct.astype(float) * 100).round(2)
+    if profiles_df is not None:
+        profiles = profiles_df.drop_duplicates("ticker").set_index("ticker").profile_data
+        features["company_name"] = profiles.map(lambda p: p.get("companyName", ""))
+        features["sector"] = profiles.map(lambda p: p.get("sector", ""))
+    features.attrs["today"] = today
+    features.attrs["news_per_window"] = news_per_window
+    return features
+
+
+def render_block(row, window, today):
+    """Renders one window's block for a feature-table row, in the notebook's format."""
+    heading, days = WINDOWS[window]
+    since = today - timedelta(days=days)
+
+    if row[f"{window}_days"] >= 2:
+        stats = (f"  Change: {row[f'{window}_change_pct']:.2f}% | High: {row[f'{window}_high']:.2f} | "
+                 f"Low: {row[f'{window}_low']:.2f} | Avg Vol: {int(row[f'{window}_avg_volume'])}")
+    else:
+        stats = "  Insufficient data"
+
+    news = row["news"] if isinstance(row["news"], list) else []
+    news = [f"  [Headline]: {title}\n  [Summary]: {text}" for published, title, text in news if published >= since]
+
+    if pd.notna(row["label_date"]) and row["label_date"] >= since:
+        label = f"  Rating: {row['label_rating']} (Score {row['label_overall_score']}/5) on {row['label_date'].date()}"
+    else:
+        label = "  No recent analyst rating"
+
+    if pd.notna(row["estimate_report_date"]) and row["estimate_report_date"] >= since:
+        estimate = (f"  EPS Avg: {row['estimate_eps_avg']:.2f} | Revenue Avg: {row['estimate_revenue_avg']:,} "
+                    f"on {row['estimate_report_date'].date()}")
+    else:
+        estimate = "  No recent estimates"
+
+    return "\n".join([f"### {heading}", stats, *(news or ["  No news"]), label, estimate])
+
+
+def render_blocks(features):
+    """
+    Renders all three blocks for every ticker.
+    Returns:
+        DataFrame indexed by ticker with weekly_block, quarterly_block and
+        yearly_block text columns.
+    """
+    today = features.attrs["today"]
+    rows = features.to_dict("index")
+    return pd.DataFrame.from_dict(
+        {ticker: {f"{window}_block": render_block(row, window, today) for window in WINDOWS}
+         for ticker, row in rows.items()},
+        orient="index",
+    ).rename_axis("ticker")
+
+
+def build_prompts(features, system_prompt):
+    """
+    Full chat-format prompts for every ticker, equivalent to the notebook's
+    build_full_prompt.
+    Returns:
+        Series of prompt text indexed by ticker.
+    """
+    blocks = render_blocks(features)
+    prompts = {}
+    for ticker, row in features.to_dict("index").items():
+        allocation = row.get("previous_allocation_pct")
+        allocation = 0.00 if allocation is None or pd.isna(allocation) else allocation
+        intro = (
+            f"[Company]: {ticker} — {row.get('company_name', '') if isinstance(row.get('company_name'), str) else ''}, "
+            f"Sector: {row.get('sector', '') if isinstance(row.get('sector'), str) else ''}\n"
+            f"Previous Allocation: {allocation:.2f}%\n\n"
+        )
+        body = "\n\n".join([
+            intro,
+            blocks.at[ticker, "weekly_block"],
+            "",
+            blocks.at[ticker, "quarterly_block"],
+            "",
+            blocks.at[ticker, "yearly_block"],
+        ])
+        prompts[ticker] = f"{B_INST} {B_SYS}{system_prompt}{E_SYS}{body}{E_INST}"
+    return pd.Series(prompts, name="prompt").rename_axis("ticker")
@@ -14,14 +14,7 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ———— Chat‐format tokens & system prompt ————
-B_INST, E_INST = "[INST]", "[/INST]"
-B_SYS,  E_SYS  = "<<SYS>>\n", "\n<</SYS>>\n\n"
-SYSTEM_PROMPT = (
-    "You are a seasoned stock market analyst. Your task is to list the positive "
-    "developments and potential concerns for companies based on relevant news and "
-    "basic financials from the past weeks, then provide an analysis and prediction "
-    "for the companies' stock price movement for the upcoming week."
-)
+from chat_format import B_INST, E_INST, B_SYS, E_SYS, SYSTEM_PROMPT
 
 # ———— Model + LoRA adapter configs ————
 BASE_MODEL   = "meta-llama/Llama-2-7b-chat-hf"